@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Analysis Queue
+Bounded asyncio work queue that runs analyses with a concurrency limit,
+serving connections round-robin so one client cannot starve the others, and
+urgent jobs before deferrable ones
+"""
+
+import asyncio
+from collections import deque
+
+
+class QueueFullError(Exception):
+    """Raised when a job cannot be queued"""
+
+    def __init__(self, message, position=None):
+        super().__init__(message)
+        self.position = position
+
+
+class AnalysisQueue:
+    """Fair (per-client round-robin) bounded queue feeding a pool of async workers
+
+    Jobs have a priority (lower is more urgent, 0 by default). Every job of a priority is
+    started before any job of a less urgent one; when the queue is full, a new job displaces
+    the newest job of a less urgent priority; and reserved_workers workers are only ever used
+    by priority 0 jobs.
+    """
+
+    def __init__(self, worker, concurrency=2, max_size=20, max_per_client=3, reserved_workers=0):
+        self.worker = worker
+        self.concurrency = concurrency
+        self.max_size = max_size
+        self.max_per_client = max_per_client
+        self.reserved_workers = min(reserved_workers, concurrency - 1)
+
+        # Maps priority to {client key: deque of pending (args, future)}; dict order is the round-robin order
+        self._queues = {}
+        self._pending = 0
+        self._in_flight = 0
+        self._in_flight_deferrable = 0  # Jobs in flight with a priority other than 0
+        self._wakeup = None
+        self._workers = []
+
+        # Counters
+        self.displaced = 0
+
+    def start(self):
+        """Spawn the worker tasks (must be called from the running event loop)"""
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker_loop()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        """Cancel the workers and every pending job"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for client in {client for clients in self._queues.values() for client in clients}:
+            self.cancel_client(client)
+
+    @property
+    def depth(self):
+        """Number of jobs waiting for a worker"""
+        return self._pending
+
+    @property
+    def in_flight(self):
+        """Number of jobs currently being processed"""
+        return self._in_flight
+
+    def _position_of_new_job(self, client, priority):
+        """Estimate the 1-based position a job appended for client would have in the service order"""
+        ahead = sum(
+            len(jobs) for job_priority, clients in self._queues.items() if job_priority < priority
+            for jobs in clients.values()
+        )
+        clients = self._queues.get(priority, {})
+        own = len(clients.get(client, ())) + 1
+        ahead += sum(min(len(jobs), own) for key, jobs in clients.items() if key != client)
+        return ahead + own
+
+    def _displace(self, priority):
+        """Drop the newest pending job less urgent than priority to make room; returns False if there is none"""
+        for job_priority in sorted(self._queues, reverse=True):
+            if job_priority <= priority:
+                break
+            clients = self._queues[job_priority]
+            for client in reversed(clients):
+                jobs = clients[client]
+                _, future = jobs.pop()
+                if not jobs:
+                    del clients[client]
+                if not clients:
+                    del self._queues[job_priority]
+                self._pending -= 1
+                self.displaced += 1
+                if not future.done():
+                    future.set_exception(QueueFullError("Displaced by a more urgent analysis"))
+                return True
+        return False
+
+    def submit(self, client, *args, priority=0):
+        """Queue a job for client; returns (future, position) or raises QueueFullError"""
+        jobs = self._queues.get(priority, {}).get(client)
+
+        if jobs is not None and len(jobs) >= self.max_per_client:
+            raise QueueFullError(
+                f"Too many pending analyses for this connection (max {self.max_per_client})",
+                position=self._position_of_new_job(client, priority) - 1,
+            )
+        if self._pending >= self.max_size and not self._displace(priority):
+            raise QueueFullError(f"Analysis queue is full ({self.max_size} pending)", position=self._pending)
+
+        position = self._position_of_new_job(client, priority)
+        future = asyncio.get_running_loop().create_future()
+
+        if jobs is None:
+            jobs = self._queues.setdefault(priority, {})[client] = deque()
+        jobs.append((args, future))
+        self._pending += 1
+        self._wakeup.set()
+
+        return future, position
+
+    def cancel_client(self, client):
+        """Drop all pending jobs for a client (e.g. on disconnect)"""
+        cancelled = 0
+        for priority in list(self._queues):
+            jobs = self._queues[priority].pop(client, None)
+            if not self._queues[priority]:
+                del self._queues[priority]
+            if not jobs:
+                continue
+            for _, future in jobs:
+                future.cancel()
+            cancelled += len(jobs)
+
+        self._pending -= cancelled
+        return cancelled
+
+    def _next_job(self):
+        """Pop the next job: most urgent priority first, rotating through its clients"""
+        for priority in sorted(self._queues):
+            if priority != 0 and self._in_flight_deferrable >= self.concurrency - self.reserved_workers:
+                # The remaining workers are kept for priority 0 jobs
+                return None
+
+            clients = self._queues[priority]
+            client = next(iter(clients))
+            jobs = clients.pop(client)
+            job = jobs.popleft()
+            if jobs:
+                # Client still has work: move it to the back of the rotation
+                clients[client] = jobs
+            if not clients:
+                del self._queues[priority]
+            self._pending -= 1
+            return priority, job
+        return None
+
+    async def _worker_loop(self):
+        """Process jobs forever"""
+        while True:
+            next_job = self._next_job()
+            if next_job is None:
+                # Nothing this worker may start: wait for a new job or a finished one
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            priority, (args, future) = next_job
+            if future.cancelled():
+                continue
+
+            self._in_flight += 1
+            if priority != 0:
+                self._in_flight_deferrable += 1
+            try:
+                result = await self.worker(*args)
+                if not future.cancelled():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            finally:
+                self._in_flight -= 1
+                if priority != 0:
+                    self._in_flight_deferrable -= 1
+                    self._wakeup.set()
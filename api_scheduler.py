@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+API Scheduler
+Paces vision API calls with token buckets sized from the API's rate limit
+headers, hands free capacity to interactive requests before background work,
+and retries throttled or failed calls with jittered exponential backoff as
+long as the caller's deadline allows
+"""
+
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from datetime import datetime, timezone
+
+import anthropic
+
+# Priority classes: lower runs first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Statuses worth another attempt: timeouts, conflicts, rate limits, server errors, overload
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a call cannot start or be retried before its deadline"""
+
+
+def parse_reset(value):
+    """Seconds until an RFC 3339 rate limit reset time (None if it cannot be parsed)"""
+    try:
+        reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    return max(0.0, (reset_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """Continuously refilled allowance (requests or tokens per minute); unlimited until a capacity is known"""
+
+    def __init__(self, per_minute=None):
+        self.capacity = per_minute
+        self.tokens = per_minute or 0
+        self._updated = time.monotonic()
+
+    @property
+    def rate(self):
+        return self.capacity / 60 if self.capacity else None
+
+    def _refill(self, now):
+        if self.capacity:
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount, now=None):
+        """Seconds until amount can be taken"""
+        if not self.capacity:
+            return 0.0
+        self._refill(now or time.monotonic())
+        # A single call larger than the whole bucket only waits for a full bucket
+        needed = min(amount, self.capacity) - self.tokens
+        return max(0.0, needed / self.rate)
+
+    def take(self, amount):
+        """Remove amount (may go negative when a call cost more than estimated)"""
+        if self.capacity:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+
+    def update(self, limit, remaining):
+        """Resize from the limit and remaining values reported by the API"""
+        self._refill(time.monotonic())
+        self.capacity = limit
+        self.tokens = min(remaining, limit)
+
+
+class ApiScheduler:
+    """Priority-ordered admission, rate limiting and retries for vision API calls"""
+
+    def __init__(self, requests_per_minute=None, input_tokens_per_minute=None, max_retries=4,
+                 base_delay=1.0, max_delay=30.0, tokens_per_image=1600):
+        self.max_retries = max_retries
+        self.base_delay = base_delay  # First backoff delay; doubles on every retry (full jitter)
+        self.max_delay = max_delay
+
+        self.requests = TokenBucket(requests_per_minute)
+        self.input_tokens = TokenBucket(input_tokens_per_minute)
+        self.tokens_per_image = tokens_per_image  # Running estimate of input tokens per image
+        self._blocked_until = 0.0  # Monotonic time before which nothing is sent (retry-after)
+
+        self._waiters = []  # Heap of (priority, sequence, images, deadline, future)
+        self._sequence = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+
+        # Counters
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0  # Calls that had to wait for capacity
+        self.rate_limited = 0  # 429 replies
+        self.deadline_failures = 0
+        self.throttled_seconds = 0.0
+
+    @property
+    def waiting(self):
+        """Calls waiting for capacity"""
+        return sum(1 for *_, future in self._waiters if not future.done())
+
+    def _wait_time(self, images):
+        now = time.monotonic()
+        return max(
+            self._blocked_until - now,
+            self.requests.wait_time(1, now),
+            self.input_tokens.wait_time(images * self.tokens_per_image, now),
+        )
+
+    def _take(self, images):
+        self.requests.take(1)
+        self.input_tokens.take(images * self.tokens_per_image)
+
+    async def _acquire(self, priority, images, deadline, on_throttle=None):
+        """Wait for capacity, behind every waiter of the same or a higher priority"""
+        wait = self._wait_time(images)
+        if not self._waiters and wait <= 0:
+            self._take(images)
+            return
+
+        self.throttled += 1
+        if deadline is not None and time.monotonic() + wait > deadline:
+            self.deadline_failures += 1
+            raise DeadlineExceededError("Rate limited: no API capacity before the deadline")
+        if on_throttle is not None:
+            await on_throttle(wait)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), images, deadline, future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        self._wakeup.set()
+
+        started = time.monotonic()
+        try:
+            await future
+        finally:
+            self.throttled_seconds += time.monotonic() - started
+
+    async def _dispatch(self):
+        """Hand out capacity to waiters in priority order as the buckets refill"""
+        while self._waiters:
+            priority, _, images, deadline, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if deadline is not None and time.monotonic() + self._wait_time(images) > deadline:
+                heapq.heappop(self._waiters)
+                self.deadline_failures += 1
+                future.set_exception(DeadlineExceededError("Rate limited: no API capacity before the deadline"))
+                continue
+
+            wait = self._wait_time(images)
+            if wait <= 0:
+                heapq.heappop(self._waiters)
+                self._take(images)
+                future.set_result(None)
+                continue
+
+            # Sleep until the head can go, or until a more urgent waiter arrives
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def update_limits(self, headers):
+        """Resize the buckets from anthropic-ratelimit-* response headers"""
+        if headers is None:
+            return
+        for bucket, prefix in ((self.requests, "requests"), (self.input_tokens, "input-tokens")):
+            limit = headers.get(f"anthropic-ratelimit-{prefix}-limit")
+            remaining = headers.get(f"anthropic-ratelimit-{prefix}-remaining")
+            try:
+                bucket.update(int(limit), int(remaining))
+            except (TypeError, ValueError):
+                continue
+
+    def record_usage(self, images, input_tokens):
+        """Correct the input token bucket and the per-image estimate with the tokens a call really used"""
+        self.input_tokens.take(input_tokens - images * self.tokens_per_image)
+        if images:
+            self.tokens_per_image = 0.8 * self.tokens_per_image + 0.2 * (input_tokens / images)
+
+    def _retry_delay(self, error):
+        """Seconds to wait before retrying error, or None if it must not be retried"""
+        response = getattr(error, "response", None)
+        headers = response.headers if response is not None else None
+        self.update_limits(headers)
+
+        if isinstance(error, anthropic.APIStatusError):
+            if error.status_code not in RETRYABLE_STATUSES:
+                return None
+            if error.status_code == 429:
+                self.rate_limited += 1
+                # The API says when capacity is back: hold every call until then
+                retry_after = headers.get("retry-after") if headers is not None else None
+                reset = parse_reset(headers.get("anthropic-ratelimit-requests-reset")) if headers is not None else None
+                try:
+                    delay = float(retry_after)
+                except (TypeError, ValueError):
+                    delay = reset
+                if delay is not None:
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+                    return delay + random.uniform(0, self.base_delay)
+            return 0.0
+        if isinstance(error, (anthropic.APIConnectionError, asyncio.TimeoutError)):
+            return 0.0
+        return None
+
+    async def call(self, request, priority=INTERACTIVE, deadline=None, images=1, can_retry=None, on_retry=None,
+                   on_throttle=None):
+        """Run `await request(timeout)` once capacity allows, retrying retryable errors
+
+        deadline is a time.monotonic() value (None: no limit); request gets the seconds left
+        as its timeout. can_retry() may veto a retry (e.g. once partial results were sent),
+        on_retry(attempt, delay, error) is awaited before each retry and on_throttle(wait)
+        before waiting for capacity.
+        """
+        attempt = 0
+        while True:
+            await self._acquire(priority, images, deadline, on_throttle)
+            self.calls += 1
+            timeout = max(1.0, deadline - time.monotonic()) if deadline is not None else None
+            try:
+                return await request(timeout)
+            except Exception as error:
+                attempt += 1
+                delay = self._retry_delay(error)
+                if delay is None or attempt > self.max_retries or (can_retry is not None and not can_retry()):
+                    raise
+                delay = max(delay, self._backoff(attempt))
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    self.deadline_failures += 1
+                    raise
+
+                self.retries += 1
+                if on_retry is not None:
+                    await on_retry(attempt, delay, error)
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        """Return a JSON-serializable summary of the scheduler state"""
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "rate_limited": self.rate_limited,
+            "deadline_failures": self.deadline_failures,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "waiting": self.waiting,
+            "requests_per_minute": self.requests.capacity,
+            "requests_available": round(self.requests.tokens, 1) if self.requests.capacity else None,
+            "input_tokens_per_minute": self.input_tokens.capacity,
+            "tokens_per_image": round(self.tokens_per_image),
+        }
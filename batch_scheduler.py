@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Batch Scheduler
+Coalesces analyses submitted within a short time window into a single multi-image API call
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[index]
+
+
+class BatchScheduler:
+    """Collects submitted items for up to `window` seconds or `max_batch_size` items, then sends them together"""
+
+    def __init__(self, send_batch, max_batch_size=4, window=0.2, latency_samples=500):
+        self.send_batch = send_batch  # async callable: list of items -> list of results (same order)
+        self.max_batch_size = max_batch_size
+        self.window = window
+
+        self._pending = []  # (item, future, submitted_at)
+        self._timer = None
+        self._sending = set()
+
+        # Measurements
+        self.requests = 0
+        self.batches = 0
+        self.batched_items = 0
+        self._latencies = deque(maxlen=latency_samples)  # Seconds from submit to result
+        self._completions = deque()  # Completion times, for throughput over the last minute
+
+    async def submit(self, item):
+        """Add an item to the next batch and wait for its own result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        self.requests += 1
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        """Send up to max_batch_size pending items as one batch"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        # Items whose requester went away are not worth sending
+        self._pending = [entry for entry in self._pending if not entry[1].cancelled()]
+        batch = self._pending[:self.max_batch_size]
+        self._pending = self._pending[self.max_batch_size:]
+
+        if batch:
+            task = asyncio.create_task(self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+
+    async def _send(self, batch):
+        """Send one batch and dispatch the results to their futures"""
+        self.batches += 1
+        self.batched_items += len(batch)
+
+        try:
+            results = await self.send_batch([item for item, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        now = time.perf_counter()
+        for (_, future, submitted_at), result in zip(batch, results):
+            self._latencies.append(now - submitted_at)
+            self._completions.append(now)
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        """Return a JSON-serializable summary of batch sizes, latency and throughput"""
+        now = time.perf_counter()
+        while self._completions and now - self._completions[0] > 60:
+            self._completions.popleft()
+
+        latencies = list(self._latencies)
+        p50 = percentile(latencies, 0.5)
+        p95 = percentile(latencies, 0.95)
+        return {
+            "max_batch_size": self.max_batch_size,
+            "window": self.window,
+            "requests": self.requests,
+            "batches": self.batches,
+            "average_batch_size": round(self.batched_items / self.batches, 2) if self.batches else None,
+            "pending": len(self._pending),
+            "latency_p50": round(p50, 3) if p50 is not None else None,
+            "latency_p95": round(p95, 3) if p95 is not None else None,
+            "throughput_per_minute": len(self._completions),
+        }
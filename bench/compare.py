@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark Comparison
+Prints the differences between two load test results (baseline first) and exits
+with status 1 when a latency, throughput, error rate, memory or loop lag figure
+got worse than the allowed threshold
+"""
+
+import argparse
+import json
+import sys
+
+# (key in the result, label, True if higher is better, absolute change below which it is noise)
+ACTION_FIGURES = [
+    ("p50_ms", "p50 ms", False, 5),
+    ("p95_ms", "p95 ms", False, 5),
+    ("p99_ms", "p99 ms", False, 5),
+    ("throughput_per_s", "req/s", True, 0.05),
+    ("error_rate", "error rate", False, 0.01),
+]
+SERVER_FIGURES = [
+    ("rss_growth_mb", "RSS growth MB", False, 5),
+    ("rss_peak_mb", "RSS peak MB", False, 5),
+    ("loop_lag_mean_ms", "loop lag mean ms", False, 1),
+    ("loop_lag_p99_ms_le", "loop lag p99 ms", False, 1),
+]
+
+
+def change(before, after, higher_is_better):
+    """Relative change in percent, positive meaning worse; None when it cannot be computed"""
+    if before is None or after is None:
+        return None
+    if before == 0:
+        return 0.0 if after == 0 else (float("-inf") if higher_is_better else float("inf"))
+    delta = (after - before) / abs(before) * 100
+    return -delta if higher_is_better else delta
+
+
+def compare_rows(baseline, candidate):
+    """Yield (section, label, before, after, worse_percent, noise) for every comparable figure"""
+    for action in sorted(set(baseline["actions"]) & set(candidate["actions"])):
+        for key, label, higher_is_better, noise in ACTION_FIGURES:
+            before = baseline["actions"][action].get(key)
+            after = candidate["actions"][action].get(key)
+            yield action, label, before, after, change(before, after, higher_is_better), noise
+
+    for server in sorted(set(baseline["servers"]) & set(candidate["servers"])):
+        for key, label, higher_is_better, noise in SERVER_FIGURES:
+            before = baseline["servers"][server].get(key)
+            after = candidate["servers"][server].get(key)
+            yield server, label, before, after, change(before, after, higher_is_better), noise
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change counted as a regression")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+
+    if baseline.get("config") != candidate.get("config"):
+        print("Warning: the two runs used different load settings", file=sys.stderr)
+
+    print(f"baseline:  {baseline['label']} ({baseline.get('git_commit')}, {baseline['started_at']})")
+    print(f"candidate: {candidate['label']} ({candidate.get('git_commit')}, {candidate['started_at']})\n")
+    print(f"{'':<16}{'figure':<20}{'baseline':>12}{'candidate':>12}{'worse by':>10}")
+
+    regressions = 0
+    for section, label, before, after, worse, noise in compare_rows(baseline, candidate):
+        if worse is None:
+            marker, text = "", "-"
+        else:
+            regressed = worse > args.threshold and abs(after - before) >= noise
+            marker = "  REGRESSION" if regressed else ""
+            regressions += regressed
+            text = f"{worse:+.1f}%"
+        print(f"{section:<16}{label:<20}{before if before is not None else '-':>12}"
+              f"{after if after is not None else '-':>12}{text:>10}{marker}")
+
+    print(f"\n{regressions} regression(s) beyond {args.threshold}%")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Fake Messages API
+Local stand-in for the Anthropic Messages API used by the benchmarks: configurable
+latency, streaming speed, error rate and rate limit, with canned detection replies.
+Point the bird detector at it with ANTHROPIC_BASE_URL=http://127.0.0.1:<port>
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import deque
+
+# Default reply for each image: one bird, in the format asked by the identification prompt
+DEFAULT_BIRDS = [{
+    "species": "Mésange charbonnière",
+    "scientific_name": "Parus major",
+    "confidence": "élevée",
+    "bbox": {"x": 40, "y": 35, "width": 12, "height": 15},
+    "description": "Tête noire, joues blanches, ventre jaune avec une bande noire",
+}]
+
+
+def build_reply_text(image_count, birds):
+    """Detection JSON for a request carrying image_count images (birds tagged with "image" for batches)"""
+    if image_count <= 1:
+        reply_birds = [dict(bird) for bird in birds]
+    else:
+        reply_birds = [{**bird, "image": index} for index in range(1, image_count + 1) for bird in birds]
+    return json.dumps({"birds": reply_birds, "count": len(reply_birds)}, ensure_ascii=False)
+
+
+def count_images(body):
+    """Number of image blocks in the request messages"""
+    count = 0
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            count += sum(1 for block in content if isinstance(block, dict) and block.get("type") == "image")
+    return count
+
+
+def sse_event(event_type, data):
+    return f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+
+class FakeMessagesAPI:
+    """Answers POST /v1/messages (streaming or not) after a simulated delay"""
+
+    def __init__(self, latency=1.5, jitter=0.5, first_token=0.6, chars_per_second=400.0,
+                 error_rate=0.0, requests_per_minute=0, birds=None, seed=None):
+        self.latency = latency  # Mean total response time in seconds
+        self.jitter = jitter  # Uniform +/- variation of the latency
+        self.first_token = first_token  # Seconds before the first streamed text
+        self.chars_per_second = chars_per_second
+        self.error_rate = error_rate  # Fraction of requests answered with an overloaded error
+        self.requests_per_minute = requests_per_minute  # 0 disables the rate limit
+        self.birds = birds if birds is not None else DEFAULT_BIRDS
+        self.random = random.Random(seed)
+
+        self._request_times = deque()
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+
+    def _rate_limit_headers(self):
+        """Rate limit headers in the API's format, plus whether this request is over the limit"""
+        if not self.requests_per_minute:
+            return {}, False
+
+        now = time.monotonic()
+        while self._request_times and now - self._request_times[0] > 60:
+            self._request_times.popleft()
+        over_limit = len(self._request_times) >= self.requests_per_minute
+        if not over_limit:
+            self._request_times.append(now)
+
+        reset_in = 60 - (now - self._request_times[0]) if self._request_times else 60
+        headers = {
+            "anthropic-ratelimit-requests-limit": str(self.requests_per_minute),
+            "anthropic-ratelimit-requests-remaining": str(max(0, self.requests_per_minute - len(self._request_times))),
+            "anthropic-ratelimit-requests-reset": time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + reset_in)
+            ),
+        }
+        if over_limit:
+            headers["retry-after"] = str(max(1, int(reset_in)))
+        return headers, over_limit
+
+    def _usage(self, body, image_count):
+        # Rough figures: the cached system prompt, ~1600 tokens per image, the question
+        system_cached = any(
+            isinstance(block, dict) and block.get("cache_control") for block in body.get("system") or []
+        )
+        return {
+            "input_tokens": 40 + 1600 * image_count,
+            "cache_read_input_tokens": 3000 if system_cached and self.requests > 1 else 0,
+            "cache_creation_input_tokens": 3000 if system_cached and self.requests == 1 else 0,
+        }
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            body_bytes = await reader.readexactly(int(headers.get("content-length", "0")))
+            parts = request_line.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] != "POST" or parts[1].split("?")[0] != "/v1/messages":
+                await self._send_json(writer, 404, {"type": "error", "error": {
+                    "type": "not_found_error", "message": "Not found"}})
+                return
+
+            await self._answer(writer, json.loads(body_bytes or b"{}"))
+        except (ConnectionError, asyncio.IncompleteReadError, json.JSONDecodeError):
+            pass
+        finally:
+            writer.close()
+
+    async def _answer(self, writer, body):
+        self.requests += 1
+        rate_headers, over_limit = self._rate_limit_headers()
+        if over_limit:
+            self.rate_limited += 1
+            await self._send_json(writer, 429, {"type": "error", "error": {
+                "type": "rate_limit_error", "message": "Rate limit exceeded (fake API)"}}, rate_headers)
+            return
+
+        total = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            await asyncio.sleep(total / 2)
+            await self._send_json(writer, 529, {"type": "error", "error": {
+                "type": "overloaded_error", "message": "Overloaded (fake API)"}}, rate_headers)
+            return
+
+        image_count = count_images(body)
+        text = build_reply_text(image_count, self.birds)
+        usage = self._usage(body, image_count)
+        output_tokens = max(1, len(text) // 3)
+        message = {
+            "id": f"msg_fake_{uuid.uuid4().hex[:16]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "fake"),
+            "stop_reason": None,
+            "stop_sequence": None,
+        }
+
+        if not body.get("stream"):
+            await asyncio.sleep(total)
+            await self._send_json(writer, 200, {
+                **message,
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn",
+                "usage": {**usage, "output_tokens": output_tokens},
+            }, rate_headers)
+            return
+
+        # Streamed reply: wait for the first token, then spread the text over the rest of the latency
+        first_token = min(self.first_token, total)
+        streaming_time = max(total - first_token, len(text) / self.chars_per_second if self.chars_per_second else 0)
+        chunk_size = 12
+        chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+        await self._start_stream(writer, rate_headers)
+        await asyncio.sleep(first_token)
+        await self._write_chunk(writer, sse_event("message_start", {
+            "type": "message_start",
+            "message": {**message, "content": [], "usage": {**usage, "output_tokens": 1}},
+        }))
+        await self._write_chunk(writer, sse_event("content_block_start", {
+            "type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}
+        }))
+        for chunk in chunks:
+            await self._write_chunk(writer, sse_event("content_block_delta", {
+                "type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": chunk}
+            }))
+            await asyncio.sleep(streaming_time / len(chunks))
+        await self._write_chunk(writer, sse_event("content_block_stop", {"type": "content_block_stop", "index": 0}))
+        await self._write_chunk(writer, sse_event("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+            "usage": {"output_tokens": output_tokens},
+        }))
+        await self._write_chunk(writer, sse_event("message_stop", {"type": "message_stop"}))
+        await self._write_chunk(writer, b"")
+
+    async def _send_json(self, writer, status, payload, extra_headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        head = [f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}",
+                "Content-Type: application/json",
+                f"Content-Length: {len(body)}",
+                f"request-id: req_fake_{uuid.uuid4().hex[:12]}",
+                "Connection: close"]
+        head.extend(f"{name}: {value}" for name, value in (extra_headers or {}).items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+
+    async def _start_stream(self, writer, extra_headers):
+        head = ["HTTP/1.1 200 OK",
+                "Content-Type: text/event-stream",
+                "Cache-Control: no-cache",
+                "Transfer-Encoding: chunked",
+                f"request-id: req_fake_{uuid.uuid4().hex[:12]}",
+                "Connection: close"]
+        head.extend(f"{name}: {value}" for name, value in extra_headers.items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode())
+        await writer.drain()
+
+    async def _write_chunk(self, writer, data):
+        """Write one HTTP chunk (an empty chunk ends the body)"""
+        writer.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        await writer.drain()
+
+    def stats(self):
+        return {"requests": self.requests, "errors": self.errors, "rate_limited": self.rate_limited}
+
+
+async def main(args):
+    birds = DEFAULT_BIRDS
+    if args.reply:
+        with open(args.reply, "r", encoding="utf-8") as f:
+            birds = json.load(f)["birds"]
+
+    api = FakeMessagesAPI(
+        latency=args.latency,
+        jitter=args.jitter,
+        first_token=args.first_token,
+        chars_per_second=args.chars_per_second,
+        error_rate=args.error_rate,
+        requests_per_minute=args.rpm,
+        birds=birds,
+        seed=args.seed,
+    )
+    server = await asyncio.start_server(api.handle, args.host, args.port)
+    print(f"Fake Messages API listening on http://{args.host}:{args.port} "
+          f"(latency {args.latency}s ±{args.jitter}s, error rate {args.error_rate}, rpm {args.rpm or 'unlimited'})",
+          flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=1.5, help="mean response time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.5, help="uniform +/- variation of the latency")
+    parser.add_argument("--first-token", type=float, default=0.6, help="seconds before the first streamed text")
+    parser.add_argument("--chars-per-second", type=float, default=400.0, help="minimum streaming speed")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 529 overloaded replies")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before 429 replies (0: no limit)")
+    parser.add_argument("--reply", help='JSON file with a {"birds": [...]} reply used for every image')
+    parser.add_argument("--seed", type=int, help="random seed for reproducible latencies and errors")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+Load Generator
+Opens N simulated users against bird_detector.py and screenshot.py, each sending a
+weighted mix of analyze / save / delete requests, and reports latency percentiles,
+throughput, server memory growth and event loop lag. Results are saved as JSON
+files that bench/compare.py can diff.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import time
+import urllib.request
+from collections import defaultdict
+from datetime import datetime
+
+import cv2
+import numpy as np
+import websockets
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Actions a simulated user can take, and the service each one talks to
+ACTIONS = {
+    "analyze": "detector",  # Upload a frame for identification
+    "analyze_stream": "detector",  # Ask the detector to identify the current stream frame
+    "save": "screenshot",  # Save a capture
+    "delete": "both",  # Delete the user's captures on both services
+    "stats": "detector",  # Service stats
+}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(latencies):
+    """Latency summary in milliseconds"""
+    if not latencies:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None, "max_ms": None}
+    return {
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+    }
+
+
+def parse_mix(text):
+    """'analyze=4,save=2' -> {'analyze': 4.0, 'save': 2.0}"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"Unknown action {name!r} (expected one of {', '.join(ACTIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def make_image(rng, width, height, quality):
+    """JPEG with a random smooth background and a dark blob, different enough each time to miss the cache"""
+    coarse = rng.integers(40, 210, (9, 16, 3), dtype=np.uint8)
+    frame = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    center = (int(rng.integers(width // 10, width * 9 // 10)), int(rng.integers(height // 10, height * 9 // 10)))
+    cv2.ellipse(frame, center, (max(4, width // 40), max(3, height // 60)), 0, 0, 360, (40, 60, 70), -1)
+    _, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+
+class MetricsSampler:
+    """Scrapes a service's /metrics endpoint for resident memory and event loop lag"""
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.memory_samples = []
+        self.first_lag = None
+        self.last_lag = None
+        self.errors = 0
+
+    def _scrape(self):
+        with urllib.request.urlopen(self.url, timeout=5) as response:
+            return response.read().decode()
+
+    async def sample(self):
+        try:
+            text = await asyncio.to_thread(self._scrape)
+        except OSError:
+            self.errors += 1
+            return
+
+        lag = {"buckets": {}, "sum": 0.0, "count": 0}
+        for line in text.splitlines():
+            if line.startswith("#") or not line.strip():
+                continue
+            name_and_labels, _, value = line.rpartition(" ")
+            if name_and_labels.endswith("_resident_memory_bytes"):
+                self.memory_samples.append(float(value))
+            elif "_event_loop_lag_seconds_bucket" in name_and_labels:
+                bound = re.search(r'le="([^"]+)"', name_and_labels).group(1)
+                lag["buckets"][bound] = float(value)
+            elif name_and_labels.endswith("_event_loop_lag_seconds_sum"):
+                lag["sum"] = float(value)
+            elif name_and_labels.endswith("_event_loop_lag_seconds_count"):
+                lag["count"] = float(value)
+
+        if self.first_lag is None:
+            self.first_lag = lag
+        self.last_lag = lag
+
+    def _lag_quantile(self, fraction):
+        """Upper bound of the bucket holding the given quantile of lag observed during the run"""
+        buckets = sorted(
+            ((float("inf") if bound == "+Inf" else float(bound),
+              count - self.first_lag["buckets"].get(bound, 0))
+             for bound, count in self.last_lag["buckets"].items()),
+        )
+        total = self.last_lag["count"] - self.first_lag["count"]
+        if total <= 0:
+            return None
+        for bound, cumulative in buckets:
+            if cumulative >= fraction * total:
+                return bound
+        return None
+
+    def summary(self):
+        result = {"url": self.url, "scrape_errors": self.errors}
+        if self.memory_samples:
+            result.update({
+                "rss_start_mb": round(self.memory_samples[0] / 1e6, 1),
+                "rss_end_mb": round(self.memory_samples[-1] / 1e6, 1),
+                "rss_peak_mb": round(max(self.memory_samples) / 1e6, 1),
+                "rss_growth_mb": round((self.memory_samples[-1] - self.memory_samples[0]) / 1e6, 1),
+            })
+        if self.first_lag and self.last_lag:
+            count = self.last_lag["count"] - self.first_lag["count"]
+            total = self.last_lag["sum"] - self.first_lag["sum"]
+            p95 = self._lag_quantile(0.95)
+            p99 = self._lag_quantile(0.99)
+            result.update({
+                "loop_lag_mean_ms": round(total / count * 1000, 2) if count else None,
+                "loop_lag_p95_ms_le": p95 * 1000 if p95 not in (None, float("inf")) else p95,
+                "loop_lag_p99_ms_le": p99 * 1000 if p99 not in (None, float("inf")) else p99,
+            })
+        return result
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.latencies = defaultdict(list)  # action -> seconds, successful requests only
+        self.first_partial = []  # Seconds from analyze request to the first streamed bird
+        self.outcomes = defaultdict(lambda: defaultdict(int))  # action -> outcome -> count
+        self.client_lag = []
+        self.deadline = None
+
+    async def _recv_json(self, websocket):
+        """Next JSON message, skipping binary frames"""
+        while True:
+            message = await websocket.recv()
+            if isinstance(message, str):
+                return json.loads(message)
+
+    async def _analyze(self, websocket, jpeg_bytes):
+        """Send one analyze request and wait for its final reply; returns the outcome"""
+        started = time.perf_counter()
+        if jpeg_bytes is None:
+            await websocket.send(json.dumps({"action": "analyze", "protocol": self.args.protocol}))
+        elif self.args.protocol >= 2:
+            await websocket.send(json.dumps({"action": "analyze", "binary": True, "protocol": 2}))
+            await websocket.send(jpeg_bytes)
+        else:
+            await websocket.send(json.dumps({
+                "action": "analyze",
+                "frame": base64.b64encode(jpeg_bytes).decode("ascii"),
+            }))
+
+        saw_partial = False
+        while True:
+            reply = await self._recv_json(websocket)
+            status = reply.get("status")
+            if status == "partial":
+                if not saw_partial:
+                    self.first_partial.append(time.perf_counter() - started)
+                    saw_partial = True
+                continue
+            if status in ("queued", "throttled", "retrying"):
+                continue
+            if status == "busy":
+                return "busy"
+            if reply.get("binary_follows"):
+                await websocket.recv()
+            if "error" in reply:
+                return "error"
+            return "cached" if reply.get("cached") else "ok"
+
+    async def _save(self, websocket, jpeg_bytes):
+        await websocket.send(json.dumps({
+            "action": "save_capture",
+            "image": base64.b64encode(jpeg_bytes).decode("ascii"),
+        }))
+        reply = await self._recv_json(websocket)
+        return "ok" if reply.get("status") == "saved" else "error"
+
+    async def _delete(self, websocket):
+        await websocket.send(json.dumps({"action": "delete_captures"}))
+        while True:
+            reply = await self._recv_json(websocket)
+            if reply.get("status") == "deleted":
+                return "ok"
+
+    async def _stats(self, websocket):
+        await websocket.send(json.dumps({"action": "stats"}))
+        await self._recv_json(websocket)
+        return "ok"
+
+    async def _perform(self, action, connections, rng, state):
+        detector = connections.get("detector")
+        screenshot = connections.get("screenshot")
+
+        if action in ("analyze", "save"):
+            if state.get("previous_image") is not None and rng.random() < self.args.duplicate_ratio:
+                jpeg_bytes = state["previous_image"]
+            else:
+                jpeg_bytes = await asyncio.to_thread(
+                    make_image, np.random.default_rng(rng.getrandbits(32)),
+                    self.args.image_width, self.args.image_height, self.args.image_quality,
+                )
+                state["previous_image"] = jpeg_bytes
+
+        if action == "analyze":
+            return await self._analyze(detector, jpeg_bytes)
+        if action == "analyze_stream":
+            return await self._analyze(detector, None)
+        if action == "save":
+            return await self._save(screenshot, jpeg_bytes)
+        if action == "stats":
+            return await self._stats(detector)
+        if action == "delete":
+            outcomes = [await self._delete(connection) for connection in (detector, screenshot) if connection]
+            return "ok" if all(outcome == "ok" for outcome in outcomes) else "error"
+        raise ValueError(action)
+
+    async def user(self, index):
+        """One simulated user: its own connections, actions picked from the mix, random think time"""
+        rng = random.Random(self.args.seed * 1000 + index)
+        state = {}
+        mix = {action: weight for action, weight in self.args.mix.items() if weight > 0}
+        needed = {ACTIONS[action] for action in mix}
+        urls = {"detector": self.args.detector, "screenshot": self.args.screenshot}
+        if "both" in needed:
+            needed.discard("both")
+            needed.update(name for name in ("detector", "screenshot") if urls[name])
+
+        # Spread connection setup so all users do not start in the same millisecond
+        await asyncio.sleep(rng.uniform(0, self.args.ramp_up))
+
+        actions, weights = list(mix), list(mix.values())
+        while time.perf_counter() < self.deadline:
+            connections = {}
+            try:
+                for name in sorted(needed):
+                    connections[name] = await websockets.connect(urls[name], max_size=20 * 1024 * 1024)
+                await self._session(connections, actions, weights, rng, state)
+            except OSError as e:
+                self.outcomes["connect"][type(e).__name__] += 1
+                await asyncio.sleep(1)
+            finally:
+                for connection in connections.values():
+                    await connection.close()
+
+    async def _session(self, connections, actions, weights, rng, state):
+        """Send requests on one set of connections until the deadline or until they become unusable"""
+        while time.perf_counter() < self.deadline:
+            action = rng.choices(actions, weights)[0]
+            started = time.perf_counter()
+            try:
+                outcome = await asyncio.wait_for(self._perform(action, connections, rng, state), self.args.timeout)
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+            except websockets.ConnectionClosed:
+                self.outcomes[action]["connection_closed"] += 1
+                return
+            elapsed = time.perf_counter() - started
+
+            self.outcomes[action][outcome] += 1
+            if outcome in ("ok", "cached"):
+                self.latencies[action].append(elapsed)
+            if outcome == "timeout":
+                # A late reply would be mistaken for the next one's: start over on fresh connections
+                return
+
+            if self.args.think > 0:
+                await asyncio.sleep(rng.expovariate(1 / self.args.think))
+
+    async def monitor_client_loop(self, interval=0.25):
+        """Lag of the load generator's own loop; high values mean the generator is the bottleneck"""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.client_lag.append(max(0.0, loop.time() - start - interval))
+
+    async def run(self):
+        args = self.args
+        samplers = [MetricsSampler(name, url) for name, url in
+                    (("detector", args.detector_metrics), ("screenshot", args.screenshot_metrics)) if url]
+
+        for sampler in samplers:
+            await sampler.sample()
+
+        started_at = datetime.now()
+        start = time.perf_counter()
+        self.deadline = start + args.ramp_up + args.duration
+        monitor = asyncio.create_task(self.monitor_client_loop())
+
+        async def sample_periodically():
+            while True:
+                await asyncio.sleep(1)
+                for sampler in samplers:
+                    await sampler.sample()
+
+        sampling = asyncio.create_task(sample_periodically())
+        users = [asyncio.create_task(self.user(index)) for index in range(args.clients)]
+        await asyncio.gather(*users)
+        elapsed = time.perf_counter() - start
+
+        sampling.cancel()
+        monitor.cancel()
+        # Let disconnect cleanups finish before the last memory reading
+        await asyncio.sleep(1)
+        for sampler in samplers:
+            await sampler.sample()
+
+        return self.report(started_at, elapsed, samplers)
+
+    def report(self, started_at, elapsed, samplers):
+        args = self.args
+        actions = {}
+        for action in sorted(set(self.outcomes) | set(self.latencies)):
+            outcomes = dict(self.outcomes[action])
+            total = sum(outcomes.values())
+            succeeded = len(self.latencies[action])
+            actions[action] = {
+                "requests": total,
+                "succeeded": succeeded,
+                "error_rate": round(1 - succeeded / total, 4) if total else None,
+                "throughput_per_s": round(succeeded / elapsed, 3),
+                "outcomes": outcomes,
+                **summarize(self.latencies[action]),
+            }
+        if self.first_partial:
+            actions.setdefault("analyze", {})["first_partial"] = summarize(self.first_partial)
+
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        return {
+            "label": args.label,
+            "started_at": started_at.isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "config": {
+                "clients": args.clients,
+                "duration_s": args.duration,
+                "ramp_up_s": args.ramp_up,
+                "think_s": args.think,
+                "mix": args.mix,
+                "protocol": args.protocol,
+                "image": f"{args.image_width}x{args.image_height}@q{args.image_quality}",
+                "duplicate_ratio": args.duplicate_ratio,
+                "seed": args.seed,
+            },
+            "elapsed_s": round(elapsed, 2),
+            "total": {
+                "requests": sum(sum(outcomes.values()) for outcomes in self.outcomes.values()),
+                "succeeded": len(all_latencies),
+                "throughput_per_s": round(len(all_latencies) / elapsed, 3),
+                **summarize(all_latencies),
+            },
+            "actions": actions,
+            "servers": {sampler.name: sampler.summary() for sampler in samplers},
+            "load_generator": {
+                "loop_lag_p99_ms": round(percentile(self.client_lag, 0.99) * 1000, 2) if self.client_lag else None,
+            },
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_report(result):
+    print(f"\n{result['label']} - {result['config']['clients']} clients, {result['elapsed_s']}s "
+          f"(commit {result['git_commit']})")
+    header = f"{'action':<16}{'requests':>10}{'errors':>8}{'req/s':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for action, stats in result["actions"].items():
+        if "requests" not in stats:
+            continue
+        errors = stats["requests"] - stats["succeeded"]
+        print(f"{action:<16}{stats['requests']:>10}{errors:>8}{stats['throughput_per_s']:>8}"
+              f"{stats['p50_ms'] or '-':>10}{stats['p95_ms'] or '-':>10}{stats['p99_ms'] or '-':>10}")
+    if "first_partial" in result["actions"].get("analyze", {}):
+        first = result["actions"]["analyze"]["first_partial"]
+        print(f"{'  first bird':<16}{'':>26}{first['p50_ms']:>10}{first['p95_ms']:>10}{first['p99_ms']:>10}")
+    for name, server in result["servers"].items():
+        print(f"{name}: RSS {server.get('rss_start_mb')} -> {server.get('rss_end_mb')} MB "
+              f"(peak {server.get('rss_peak_mb')}), loop lag mean {server.get('loop_lag_mean_ms')} ms, "
+              f"p99 <= {server.get('loop_lag_p99_ms_le')} ms")
+    print(f"load generator loop lag p99: {result['load_generator']['loop_lag_p99_ms']} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--detector", default="ws://127.0.0.1:8765", help="bird detector WebSocket URL ('' to skip)")
+    parser.add_argument("--screenshot", default="ws://127.0.0.1:8766", help="screenshot WebSocket URL ('' to skip)")
+    parser.add_argument("--detector-metrics", default="http://127.0.0.1:9100/metrics")
+    parser.add_argument("--screenshot-metrics", default="http://127.0.0.1:9101/metrics")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=60, help="seconds of load after the ramp-up")
+    parser.add_argument("--ramp-up", type=float, default=5, help="seconds over which users connect")
+    parser.add_argument("--think", type=float, default=1.0, help="mean pause between a user's requests")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("analyze=4,save=3,delete=1"),
+                        help=f"weighted actions among: {', '.join(ACTIONS)}")
+    parser.add_argument("--protocol", type=int, choices=(1, 2), default=2, help="analyze upload protocol")
+    parser.add_argument("--image-width", type=int, default=1280)
+    parser.add_argument("--image-height", type=int, default=720)
+    parser.add_argument("--image-quality", type=int, default=85)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0,
+                        help="fraction of uploads repeating the user's previous image")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds before a request counts as timed out")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--output", default=RESULTS_DIR, help="directory for the JSON result")
+    args = parser.parse_args()
+
+    if not args.detector:
+        args.mix = {action: weight for action, weight in args.mix.items() if ACTIONS[action] == "screenshot"}
+        args.detector_metrics = None
+    if not args.screenshot:
+        args.mix = {action: weight for action, weight in args.mix.items() if ACTIONS[action] != "screenshot"}
+        args.screenshot_metrics = None
+    if not args.mix:
+        parser.error("no action left in the mix for the selected services")
+
+    result = asyncio.run(LoadTest(args).run())
+    print_report(result)
+
+    os.makedirs(args.output, exist_ok=True)
+    filename = os.path.join(args.output, f"{result['started_at'].replace(':', '')}_{args.label}.json")
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"Saved {filename}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/bin/bash
+# Runs a complete offline benchmark: fake Messages API, synthetic camera stream,
+# both WebSocket services, then the load generator. Extra arguments are passed to
+# load_generator.py, e.g.:  bench/run_local.sh --label baseline --clients 20 --duration 120
+#
+# API behaviour can be tuned with FAKE_API_ARGS, e.g. FAKE_API_ARGS="--latency 3 --error-rate 0.05"
+
+set -euo pipefail
+
+BENCH_DIR="$(cd "$(dirname "$0")" && pwd)"
+ROOT_DIR="$(dirname "$BENCH_DIR")"
+PYTHON="${PYTHON:-python3}"
+
+API_PORT="${API_PORT:-8900}"
+STREAM_PORT="${STREAM_PORT:-8901}"
+DETECTOR_PORT="${DETECTOR_PORT:-8765}"
+SCREENSHOT_PORT="${SCREENSHOT_PORT:-8766}"
+DETECTOR_METRICS_PORT="${DETECTOR_METRICS_PORT:-9100}"
+SCREENSHOT_METRICS_PORT="${SCREENSHOT_METRICS_PORT:-9101}"
+# Simulated users upload faster than the per-connection limit meant for real ones
+UPLOAD_RATE_PER_MINUTE="${UPLOAD_RATE_PER_MINUTE:-600}"
+
+# Services write their captures (and logs) in a scratch directory
+WORK_DIR="$(mktemp -d -t bird-bench-XXXXXX)"
+PIDS=()
+
+cleanup() {
+    for pid in "${PIDS[@]}"; do
+        kill "$pid" 2>/dev/null || true
+    done
+    wait 2>/dev/null || true
+    rm -rf "$WORK_DIR"
+}
+trap cleanup EXIT
+
+wait_for_port() {
+    local port=$1
+    for _ in $(seq 1 100); do
+        if (echo > "/dev/tcp/127.0.0.1/$port") 2>/dev/null; then
+            return 0
+        fi
+        sleep 0.2
+    done
+    echo "Timed out waiting for port $port" >&2
+    exit 1
+}
+
+echo "Scratch directory: $WORK_DIR"
+
+# shellcheck disable=SC2086
+"$PYTHON" "$BENCH_DIR/fake_anthropic.py" --port "$API_PORT" ${FAKE_API_ARGS:-} > "$WORK_DIR/fake_api.log" 2>&1 &
+PIDS+=($!)
+"$PYTHON" "$BENCH_DIR/synthetic_stream.py" --port "$STREAM_PORT" ${STREAM_ARGS:-} > "$WORK_DIR/stream.log" 2>&1 &
+PIDS+=($!)
+wait_for_port "$API_PORT"
+wait_for_port "$STREAM_PORT"
+
+cd "$WORK_DIR"
+ANTHROPIC_API_KEY=bench-fake-key \
+ANTHROPIC_BASE_URL="http://127.0.0.1:$API_PORT" \
+STREAM_URL="http://127.0.0.1:$STREAM_PORT/live/camera/index.m3u8" \
+WEBSOCKET_PORT="$DETECTOR_PORT" \
+METRICS_PORT="$DETECTOR_METRICS_PORT" \
+UPLOAD_RATE_PER_MINUTE="$UPLOAD_RATE_PER_MINUTE" \
+    "$PYTHON" "$ROOT_DIR/bird_detector.py" > "$WORK_DIR/bird_detector.log" 2>&1 &
+PIDS+=($!)
+WEBSOCKET_PORT="$SCREENSHOT_PORT" \
+METRICS_PORT="$SCREENSHOT_METRICS_PORT" \
+UPLOAD_RATE_PER_MINUTE="$UPLOAD_RATE_PER_MINUTE" \
+    "$PYTHON" "$ROOT_DIR/screenshot.py" > "$WORK_DIR/screenshot.log" 2>&1 &
+PIDS+=($!)
+cd "$ROOT_DIR"
+wait_for_port "$DETECTOR_PORT"
+wait_for_port "$SCREENSHOT_PORT"
+
+"$PYTHON" "$BENCH_DIR/load_generator.py" \
+    --detector "ws://127.0.0.1:$DETECTOR_PORT" \
+    --screenshot "ws://127.0.0.1:$SCREENSHOT_PORT" \
+    --detector-metrics "http://127.0.0.1:$DETECTOR_METRICS_PORT/metrics" \
+    --screenshot-metrics "http://127.0.0.1:$SCREENSHOT_METRICS_PORT/metrics" \
+    "$@"
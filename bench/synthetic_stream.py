@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Synthetic Camera Stream
+Plays a local video file (looped), or generated frames with a moving "bird", as a
+live HLS stream served over HTTP, standing in for nginx-rtmp during benchmarks.
+Point the bird detector at it with STREAM_URL=http://127.0.0.1:<port>/live/camera/index.m3u8
+"""
+
+import argparse
+import functools
+import glob
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Static file handler without per-request logging"""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def synthetic_frames(width, height, fps, seed=0):
+    """Endless frames: a textured background with a small dark shape crossing it now and then"""
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(60, 190, (height, width, 3), dtype=np.uint8), (0, 0), 6)
+    crossing_frames = int(fps * 4)  # One crossing every 4 seconds, half of it visible
+    index = 0
+    while True:
+        frame = background.copy()
+        # Sensor noise so consecutive frames are never byte-identical
+        noise = rng.integers(-4, 5, frame.shape, dtype=np.int16)
+        frame = np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+        phase = index % crossing_frames
+        if phase < crossing_frames // 2:
+            progress = phase / (crossing_frames // 2)
+            center = (int(width * (0.1 + 0.8 * progress)), int(height * (0.4 + 0.1 * np.sin(progress * 6))))
+            axes = (max(4, width // 40), max(3, height // 60))
+            cv2.ellipse(frame, center, axes, 0, 0, 360, (40, 60, 70), -1)
+            cv2.circle(frame, (center[0] + axes[0], center[1] - axes[1]), max(2, axes[1]), (20, 20, 20), -1)
+        yield frame
+        index += 1
+
+
+def file_frames(path, width, height):
+    """Endless frames read from a video file, restarting at the end"""
+    while True:
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise SystemExit(f"Cannot open video file: {path}")
+        read_any = False
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            read_any = True
+            if frame.shape[1] != width or frame.shape[0] != height:
+                frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            yield frame
+        cap.release()
+        if not read_any:
+            raise SystemExit(f"No frames in video file: {path}")
+
+
+def prune_segments(output_dir, keep=12):
+    """Delete old segments; the live playlist only lists the last few"""
+    segments = sorted(glob.glob(os.path.join(output_dir, "index*.ts")), key=os.path.getmtime)
+    for path in segments[:-keep]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def segment_writer(frames, output_dir, width, height, fps, stop_event):
+    """Write frames in real time into a live HLS playlist using OpenCV's FFmpeg backend"""
+    playlist = os.path.join(output_dir, "index.m3u8")
+    # MPEG-2 video is the codec OpenCV can put in HLS transport-stream segments
+    writer = cv2.VideoWriter(playlist, cv2.CAP_FFMPEG, cv2.VideoWriter_fourcc(*"MPEG"), fps, (width, height))
+    if not writer.isOpened():
+        raise SystemExit("OpenCV cannot write HLS output (FFmpeg backend missing?)")
+
+    interval = 1.0 / fps
+    next_time = time.perf_counter()
+    try:
+        for index, frame in enumerate(frames):
+            if stop_event.is_set():
+                break
+            writer.write(frame)
+            if index % (fps * 10) == 0:
+                prune_segments(output_dir)
+            next_time += interval
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Fell behind (slow machine): do not try to catch up with a burst
+                next_time = time.perf_counter()
+    finally:
+        writer.release()
+
+
+def main(args):
+    root = tempfile.mkdtemp(prefix="synthetic-stream-")
+    output_dir = os.path.join(root, "live", "camera")
+    os.makedirs(output_dir)
+
+    if args.video:
+        frames = file_frames(args.video, args.width, args.height)
+    else:
+        frames = synthetic_frames(args.width, args.height, args.fps, args.seed)
+
+    stop_event = threading.Event()
+    writer_thread = threading.Thread(
+        target=segment_writer,
+        args=(frames, output_dir, args.width, args.height, args.fps, stop_event),
+        name="hls-writer",
+        daemon=True,
+    )
+    writer_thread.start()
+
+    server = ThreadingHTTPServer((args.host, args.port), functools.partial(QuietHandler, directory=root))
+    print(f"Synthetic stream ({args.video or 'generated frames'}, {args.width}x{args.height} @ {args.fps} fps) "
+          f"at http://{args.host}:{args.port}/live/camera/index.m3u8", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        server.server_close()
+        writer_thread.join(5)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--video", help="local video file to loop (default: generated frames)")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=int, default=15)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
@@ -9,46 +9,144 @@ import base64
 import json
 import asyncio
 import websockets
-from anthropic import Anthropic
 import os
 from datetime import datetime
-import re
+import time
+from camera_process import CameraProcess, parse_cameras, parse_frame_size
+from analysis_queue import AnalysisQueue, QueueFullError
+from frame_cache import FrameCache
+from motion_gate import MotionGate, parse_mask_regions
+from capture_writer import CaptureWriter, InvalidImageError, jpeg_dimensions
+from capture_store import CaptureStore, is_valid_token, new_session_token
+from connection_limits import OutboundQueue, UploadLimiter
+from capture_retention import CaptureRetention
+from detection_history import DetectionHistory
+from tracker import BirdTracker
+from preprocessing import FramePreprocessor
+from local_detector import load_detector
+from batch_scheduler import BatchScheduler
+from api_scheduler import BACKGROUND, INTERACTIVE, ApiScheduler
+from json_extract import IncrementalBirdParser, extract_json_object
+from metrics import (
+    MetricsRegistry, configure_logging, log_event, monitor_event_loop, new_request_id, register_process_metrics,
+    start_background_task, start_metrics_server
+)
 
 # Configuration
-STREAM_URL = "http://nginx-rtmp:8080/live/camera/index.m3u8"
+STREAM_URL = os.getenv("STREAM_URL", "http://nginx-rtmp:8080/live/camera/index.m3u8")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
-WEBSOCKET_PORT = 8765
+WEBSOCKET_PORT = int(os.getenv("WEBSOCKET_PORT", "8765"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))  # Local Prometheus endpoint (0 disables it)
+STREAM_BUFFER_SIZE = 5  # Number of recent frames kept per camera
+MAX_FRAME_AGE = 10  # Seconds after which a buffered frame is considered stale
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", "4"))  # Analyses in progress at once (coalesced into batches)
+ANALYSIS_QUEUE_SIZE = int(os.getenv("ANALYSIS_QUEUE_SIZE", "20"))  # Pending analyses across all clients
+ANALYSIS_QUEUE_PER_CLIENT = int(os.getenv("ANALYSIS_QUEUE_PER_CLIENT", "3"))  # Pending analyses per connection
+ANALYSIS_RESERVED_WORKERS = int(os.getenv("ANALYSIS_RESERVED_WORKERS", "1"))  # Workers automatic detections never use
+CACHE_MAX_DISTANCE = int(os.getenv("CACHE_MAX_DISTANCE", "6"))  # Max Hamming distance between frame hashes for a hit
+CACHE_TTL = int(os.getenv("CACHE_TTL", "120"))  # Seconds a cached result stays valid
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(2 * 1024 * 1024)))
+AUTO_DETECT_INTERVAL = float(os.getenv("AUTO_DETECT_INTERVAL", "0.5"))  # Seconds between motion checks
+MOTION_MIN_AREA = float(os.getenv("MOTION_MIN_AREA", "0.002"))  # Fraction of the frame that must change
+MOTION_VAR_THRESHOLD = float(os.getenv("MOTION_VAR_THRESHOLD", "16"))  # MOG2 sensitivity (lower = more sensitive)
+MOTION_COOLDOWN = float(os.getenv("MOTION_COOLDOWN", "5"))  # Minimum seconds between two automatic analyses
+MOTION_MASK = os.getenv("MOTION_MASK", "")  # Regions to ignore, "x,y,w,h;..." in percentages
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "4"))  # Images per API call (1 disables batching)
+BATCH_WINDOW = float(os.getenv("BATCH_WINDOW", "0.2"))  # Seconds to wait for more images before sending
+PREPROCESS_MAX_EDGE = int(os.getenv("PREPROCESS_MAX_EDGE", "1280"))  # Longest side sent to the model, in pixels
+PREPROCESS_JPEG_QUALITY = int(os.getenv("PREPROCESS_JPEG_QUALITY", "85"))
+PREPROCESS_AUTO_CROP = os.getenv("PREPROCESS_AUTO_CROP", "1") == "1"  # Crop automatic detections to the motion region
+PREPROCESS_DENOISE = os.getenv("PREPROCESS_DENOISE", "0") == "1"
+PREPROCESS_SHARPEN = os.getenv("PREPROCESS_SHARPEN", "0") == "1"
+LOCAL_DETECTOR_MODEL = os.getenv("LOCAL_DETECTOR_MODEL", "")  # cv2.dnn model file, "stub" for offline tests (empty disables)
+LOCAL_DETECTOR_CONFIG = os.getenv("LOCAL_DETECTOR_CONFIG", "")  # Companion file for Caffe/TensorFlow/Darknet models
+LOCAL_DETECTOR_CLASS = int(os.getenv("LOCAL_DETECTOR_CLASS", "14"))  # Index of the bird class in the model's labels (COCO: 14)
+LOCAL_DETECTOR_CONFIDENCE = float(os.getenv("LOCAL_DETECTOR_CONFIDENCE", "0.35"))  # Minimum score of a bird box
+LOCAL_DETECTOR_INPUT_SIZE = int(os.getenv("LOCAL_DETECTOR_INPUT_SIZE", "640"))  # Square network input, in pixels
+LOCAL_DETECTOR_SCALE = float(os.getenv("LOCAL_DETECTOR_SCALE", str(1 / 255)))  # Pixel scale factor expected by the model
+LOCAL_DETECTOR_MEAN = float(os.getenv("LOCAL_DETECTOR_MEAN", "0"))  # Value subtracted from every channel
+LOCAL_DETECTOR_PADDING = float(os.getenv("LOCAL_DETECTOR_PADDING", "0.3"))  # Fraction of the bird box added around the crop
+LOCAL_DETECTOR_MIN_CROP = int(os.getenv("LOCAL_DETECTOR_MIN_CROP", "256"))  # Smallest crop side sent to the model, in pixels
+API_REQUESTS_PER_MINUTE = int(os.getenv("API_REQUESTS_PER_MINUTE", "0"))  # Starting rate limit (0 = unknown until the API reports it)
+API_INPUT_TOKENS_PER_MINUTE = int(os.getenv("API_INPUT_TOKENS_PER_MINUTE", "0"))  # Starting input token limit (same)
+API_MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "4"))  # Retries of a throttled or failed call
+API_RETRY_BASE_DELAY = float(os.getenv("API_RETRY_BASE_DELAY", "1.0"))  # First backoff delay, doubled on every retry
+API_DEADLINE = float(os.getenv("API_DEADLINE", "45"))  # Seconds a user's analysis may take, queueing and retries included
+API_AUTO_DEADLINE = float(os.getenv("API_AUTO_DEADLINE", "20"))  # Same for automatic detections, whose frames go stale
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+PROMPT_VERSION = os.getenv("PROMPT_VERSION", "v1")  # Loads prompts/identification_<version>.txt
+CAPTURES_DIR = os.getenv("CAPTURES_DIR", "captures")  # Shared with the screenshot service
+CAPTURE_GRACE_PERIOD = int(os.getenv("CAPTURE_GRACE_PERIOD", "600"))  # Seconds a session's captures outlive its last activity
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", str(1024 * 1024 * 1024)))  # Disk budget of the captures directory (0 = unlimited)
+CAPTURE_MAX_AGE = int(os.getenv("CAPTURE_MAX_AGE", "86400"))  # Seconds since last use after which a capture is evicted (0 = never)
+CAPTURE_SWEEP_INTERVAL = int(os.getenv("CAPTURE_SWEEP_INTERVAL", "60"))  # Seconds between expiry/retention passes
+CAMERA_ID = os.getenv("CAMERA_ID", "camera")  # ID of the STREAM_URL camera when CAMERAS is empty
+CAMERAS = parse_cameras(os.getenv("CAMERAS", ""), CAMERA_ID, STREAM_URL)  # "id=url,id=url", one decoder process each
+CAMERA_MAX_FRAME = parse_frame_size(os.getenv("CAMERA_MAX_FRAME", "1920x1080"))  # Larger frames are downscaled when shared
+CAMERA_SUPERVISE_INTERVAL = 5  # Seconds between checks that every decoder process is alive
+TRACK_IOU_THRESHOLD = float(os.getenv("TRACK_IOU_THRESHOLD", "0.3"))  # Box overlap for a detection to continue a track
+TRACK_MAX_DISTANCE = float(os.getenv("TRACK_MAX_DISTANCE", "10"))  # Or centroid move, in percent of the frame
+TRACK_MAX_AGE = float(os.getenv("TRACK_MAX_AGE", "30"))  # Seconds a bird may go unseen before its track ends
+TRACK_STABLE_VOTES = int(os.getenv("TRACK_STABLE_VOTES", "2"))  # Identifications before a track stops being re-identified
+TRACK_REIDENTIFY_AFTER = float(os.getenv("TRACK_REIDENTIFY_AFTER", "120"))  # Seconds before a stable track is identified again (0 = always)
+TRACK_COARSE_COVERAGE = float(os.getenv("TRACK_COARSE_COVERAGE", "0.9"))  # Without a local detector, share of the motion region stable tracks must cover
+HISTORY_DB = os.getenv("HISTORY_DB", "data/detections.db")  # SQLite detection history (empty disables it)
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "200"))  # Results committed per transaction at most
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))  # Seconds a result waits before being committed
+OUTBOUND_MAX_MESSAGES = int(os.getenv("OUTBOUND_MAX_MESSAGES", "64"))  # Replies queued for a slow client before dropping
+OUTBOUND_MAX_BYTES = int(os.getenv("OUTBOUND_MAX_BYTES", str(8 * 1024 * 1024)))  # Same, in bytes
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(4 * 1024 * 1024)))  # Largest JPEG a client may upload
+UPLOAD_RATE_PER_MINUTE = float(os.getenv("UPLOAD_RATE_PER_MINUTE", "30"))  # Sustained uploads per connection
+UPLOAD_BURST = int(os.getenv("UPLOAD_BURST", "5"))  # Uploads a connection may send back to back
+INBOUND_MAX_MESSAGES = int(os.getenv("INBOUND_MAX_MESSAGES", "4"))  # Received messages buffered per connection
 
-# Initialize Anthropic client
-client = Anthropic(api_key=ANTHROPIC_API_KEY)
-
-# Store connected WebSocket clients and their captures
+# Store connected WebSocket clients and their sessions
 connected_clients = set()
-user_captures = {}  # Maps websocket to list of their capture filenames
+client_sessions = {}  # Maps websocket to the session token its captures are stored under
+analysis_tasks = {}  # Maps websocket to its running analyze request tasks
+subscribers = {}  # Maps websocket to the camera IDs it receives automatic detections from
+client_protocols = {}  # Maps websocket to the protocol version it speaks (1 = base64 JSON, 2 = binary frames)
+pending_uploads = {}  # Maps websocket to the JSON header waiting for its binary frame
+outbound_queues = {}  # Maps websocket to the queue its replies are sent from
+upload_limiters = {}  # Maps websocket to its upload rate limit
 
-def capture_frame_from_stream():
-    """Capture a single frame from the HLS stream"""
-    cap = cv2.VideoCapture(STREAM_URL)
+# Queue key prefix of analyses triggered by the motion gate (one key per camera, served round-robin)
+AUTO_DETECT_CLIENT = "auto-detect"
 
-    if not cap.isOpened():
-        print("Error: Cannot open stream")
-        return None
+# Camera used by requests that do not name one
+DEFAULT_CAMERA = next(iter(CAMERAS))
 
-    ret, frame = cap.read()
-    cap.release()
+def capture_frame_from_stream(camera_id):
+    """Return the latest buffered frame from a camera's HLS stream and its age in seconds"""
+    frame, frame_timestamp = cameras[camera_id].latest()
 
-    if not ret:
-        print("Error: Cannot read frame")
-        return None
+    if frame is None:
+        log_event("stream_frame_unavailable", level="error", camera=camera_id)
+        return None, None
+
+    frame_age = time.time() - frame_timestamp
+    if frame_age > MAX_FRAME_AGE:
+        log_event("stream_frame_stale", level="error", camera=camera_id, frame_age=round(frame_age, 1))
+        return None, frame_age
 
-    return frame
+    return frame, frame_age
+
+def frame_to_jpeg(frame):
+    """Encode OpenCV frame as JPEG bytes"""
+    _, buffer = cv2.imencode('.jpg', frame)
+    return buffer.tobytes()
 
 def frame_to_base64(frame):
     """Convert OpenCV frame to base64 string"""
-    _, buffer = cv2.imencode('.jpg', frame)
-    jpg_as_text = base64.b64encode(buffer).decode('utf-8')
+    jpg_as_text = base64.b64encode(frame_to_jpeg(frame)).decode('utf-8')
     return jpg_as_text
 
+def read_file_bytes(filename):
+    """Read a whole file (run in a worker thread)"""
+    with open(filename, "rb") as f:
+        return f.read()
+
 def draw_bounding_boxes(frame, birds):
     """Draw bounding boxes around detected birds"""
     if not birds:
@@ -88,276 +186,1155 @@ def draw_bounding_boxes(frame, birds):
 
     return annotated_frame
 
-async def analyze_frame_with_claude(frame_base64):
-    """Send frame to Claude Vision API for bird identification"""
-    try:
-        message = client.messages.create(
+def load_prompt(version):
+    """Load a versioned identification guide from the prompts directory"""
+    path = os.path.join(PROMPTS_DIR, f"identification_{version}.txt")
+    with open(path, encoding="utf-8") as f:
+        return f.read().strip()
+
+# Static identification guide, sent as a cached system block
+IDENTIFICATION_GUIDE = load_prompt(PROMPT_VERSION)
+
+# Short per-request instruction sent with each image
+ANALYZE_INSTRUCTION = "Analyse cette image et identifie tous les oiseaux présents. Réponds uniquement avec le JSON demandé."
+
+# Instruction for multi-image requests: one flat list of birds, each tagged with its image number
+BATCH_INSTRUCTION = (
+    "Analyse séparément chacune des {count} images ci-dessus et identifie tous les oiseaux présents. "
+    "Les coordonnées de bbox sont relatives à l'image où se trouve l'oiseau. "
+    "Ajoute à chaque oiseau un champ \"image\" contenant le numéro de son image (1 à {count}) "
+    "et regroupe tous les oiseaux dans la même liste \"birds\". Réponds uniquement avec le JSON demandé."
+)
+
+def log_usage(usage, batch_size):
+    """Log and count token usage, including prompt cache reads/writes"""
+    tokens = {
+        "input": usage.input_tokens,
+        "output": usage.output_tokens,
+        "cache_read": getattr(usage, "cache_read_input_tokens", None) or 0,
+        "cache_write": getattr(usage, "cache_creation_input_tokens", None) or 0,
+    }
+    for token_type, count in tokens.items():
+        api_tokens.inc(count, type=token_type)
+    log_event("api_usage", batch_size=batch_size, **{f"{key}_tokens": value for key, value in tokens.items()})
+
+def parse_detection_response(response_text, streamed_birds=None):
+    """Extract the detection JSON from a model reply"""
+    # Claude sometimes includes text or a markdown fence around the JSON block
+    result = extract_json_object(response_text, "birds")
+    if result is not None:
+        return result
+
+    # The reply was cut or malformed: keep the birds that were complete while streaming
+    if streamed_birds:
+        return {
+            "birds": list(streamed_birds),
+            "count": len(streamed_birds),
+            "timestamp": datetime.now().isoformat()
+        }
+
+    # If all parsing fails, return raw response
+    return {
+        "birds": [],
+        "count": 0,
+        "raw_response": response_text,
+        "timestamp": datetime.now().isoformat()
+    }
+
+def build_image_content(frames_base64):
+    """Build the user message content for one or several images"""
+    content = []
+    for index, frame_base64 in enumerate(frames_base64, start=1):
+        if len(frames_base64) > 1:
+            content.append({"type": "text", "text": f"Image {index} :"})
+        content.append({
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": "image/jpeg",
+                "data": frame_base64,
+            },
+        })
+
+    if len(frames_base64) > 1:
+        content.append({"type": "text", "text": BATCH_INSTRUCTION.format(count=len(frames_base64))})
+    else:
+        content.append({"type": "text", "text": ANALYZE_INSTRUCTION})
+    return content
+
+def split_batch_result(result, count):
+    """Split a multi-image detection result into one result per image"""
+    if "birds" not in result or "raw_response" in result:
+        return [dict(result) for _ in range(count)]
+
+    timestamp = result.get("timestamp") or datetime.now().isoformat()
+    results = [{"birds": [], "count": 0, "timestamp": timestamp} for _ in range(count)]
+    for bird in result.get("birds", []):
+        try:
+            index = int(bird.pop("image")) - 1
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= index < count:
+            results[index]["birds"].append(bird)
+
+    for image_result in results:
+        image_result["count"] = len(image_result["birds"])
+        image_result["batch_size"] = count
+    return results
+
+async def analyze_frames_with_claude(frames_base64, on_bird=None, priority=INTERACTIVE, deadline=None, on_status=None):
+    """Send one or several frames to Claude Vision API in a single request; returns one result per frame
+
+    The reply is streamed: on_bird(frame_index, bird) is awaited for each bird as soon as
+    its JSON object is complete, long before the whole reply has been generated. The call
+    goes through api_scheduler; on_status(message) is awaited when it is throttled or retried.
+    """
+    parser = None
+    attempts = 0
+    started = time.perf_counter()
+
+    async def request(timeout):
+        nonlocal parser, attempts
+        parser = IncrementalBirdParser()
+        attempts += 1
+        async with client.messages.stream(
             model="claude-sonnet-4-20250514",
-            max_tokens=1024,
+            max_tokens=1024 * len(frames_base64),
+            system=[
+                {
+                    "type": "text",
+                    "text": IDENTIFICATION_GUIDE,
+                    # The guide is identical on every call: let the API reuse its processed prefix
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ],
             messages=[
                 {
                     "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": frame_base64,
-                            },
-                        },
-                        {
-                            "type": "text",
-                            "text": """Analyse cette image et identifie tous les oiseaux présents.
-
-IMPORTANT : N'identifie que les oiseaux réels qui ont l'air vrais à l'image. Réagis comme un ornithologue professionnel. Si tu as un doute, ne dis rien. Tu peux en revanche, si tu es sûr de la famille ou du genre de l'oiseau, répondre quelque chose comme "Rapace indéterminé" ou "Corvidés indéterminé".
-
-IMPORTANT : les espèces que tu es susceptible de trouver sont : Mésanges charbonnière, bleue, nonnette, noire (plus rare), huppée (rare aussi), sitelle torchepot, rouge-gorge familier, pinson des arbres, Chardonneret élégant (rarement), pinson du nord (rare), gros bec cassenoyau (rare), tarin des aulnes (rare). Les espèces les plus fréquentes sont les mésanges charbonnières et bleue, la sitelle et la mésange nonnette sont là souvent également.
-
-GUIDE D'IDENTIFICATION - Espèces souvent confondues :
-
-MÉSANGES (attention aux détails !) :
-- Mésange charbonnière (Parus major) : Tache blache très visible sur la joue et ENTIEREMENT entourée de noir, bande ventrale noire LARGE (en tous cas visible) et continue du menton au bas-ventre, joues blanches éclatantes, grande taille (14-15cm), calotte noire brillante, le ventre a clairement des teintes jaunes et le dos, notamment dans le haut, des teintes vert/jaune/olive. n'a JAMAIS de bleu sur le dessus de la tête. n'a JAMAIS de barre noire sur les yeux.
-- Mésange noire (Periparus ater) : TACHE BLANCHE sur la NUQUE (derrière la tête), la mésange noire a TOUJOURS une barre blanche sur les ailes, bande ventrale noire fine ou ABSENTE mais généralement absente, plus petite (11cm), calotte noire mate, PAS DE JAUNE SUR LE VENTRE, dos à dominante clairement GRISE : on dirait un dos noir et blanc, pas de couleurs spécifique. Le noir du menton s'étend jusqu'à l'épaule et la base du cou sur les côtés. Zone de noir sous lec importante.
-- Mésange bleue (Cyanistes caeruleus) : calotte bleue vif, ailes et queue bleues, joues blanches avec trait noir sur l'œil
-- Mésange huppée (Lophophanes cristatus) : HUPPE pointue noire et blanche très visible, dos brun/marron moyen et ventre brun/fauve clair
-- Mésange nonnette (Poecile palustris) : la mésange nonnette n'a JAMAIS de barre blanche sur les ailes. calotte noire mate, SANS bande nucale blanche, menton noir (noir très restreint), joues gris/chamois clair allant jusqu'à la nuque. Le noir sous le bec reste sous le bec et ne s'étend pas jusqu'à l'épaule. Le dessus de la tête et le dos sont CLAIREMENT de couleur différente, Très peu de noir sous le bec. Couleur dominante du dos beigne/marron clair, ventre fauve clair/beige clair. Le noir sur la tête descend sur la nuque mais elle n'a JAMAIS de noir à la base du cou sur les côtés.
-- Si hésitation entre charbonnière et noire : cherche la tache nucale blanche (noire) ou la bande ventrale plus ou moins large (charbonnière)
-- Ne confond pas une mésange avec la sitelle torchepot. La sitelle n'a JAMAIS la calotte noire, elle a le ventre clairement orangé et le dos gris ardoise, elle a une barre noire bien visible en travers de la face, passant par les yeux, comme un masque et n'a JAMAIS la calotte noire. La mésange bleue a aussi une barre sur les yeux mais a la calotte bleutée et le ventre jaune. De plus elle a une ligne noire à la base du cou ce que n'a JAMAIS la sitelle. Idem pour une petite barre alaire blanche chez la mésange bleue, totalement absente chez la sitelle.
-La couleur de la tête de la sitelle est la même que le cou et le dos formant une zone unie du dessus de la queue à la tête. La sitelle a le bec BEAUCOUP PLUS LONG que celui des mésanges.
-- Si tu hésites entre mésange nonnette et mésange noire, sache qu'il y a 95% de chances que ce soit une nonnette.
-- Si tu ne vois pas de jaune, ce n'est ni une mésange bleue, ni une mésange charbonnière.
-
-CORVIDÉ OU MERLE
-- Le merle NOIR mâle a TOUJOURS un bec jaune. Les corvidés n'ont JAMAIS le bec jaune (sauf le chocard à bec jaune mais dont le bec est COURBÉ et surtout il n'y en a pas ici)
-
-MOINEAUX :
-- Moineau domestique mâle (Passer domesticus) : calotte grise, joue blanche, bavette noire, dos brun strié
-- Moineau domestique femelle : entièrement brun-beige strié, sourcil clair
-- Moineau friquet (Passer montanus) : calotte MARRON (pas grise), tache noire sur joue blanche, plus petit
-- Si hésitation : le friquet a TOUJOURS une tache noire sur la joue, le domestique mâle a une calotte grise
-
-PINSONS :
-- Pinson des arbres (Fringilla coelebs) : poitrine rosée, double barre alaire blanche bien visible
-- Verdier d'Europe (Chloris chloris) : corps vert-jaune, bec fort et conique
-- Chardonneret élégant (Carduelis carduelis) : masque facial rouge vif, ailes noires avec barre jaune
-
-ROUGES-GORGES vs ROUGEQUEUES :
-- Rouge-gorge (Erithacus rubecula) : plastron orange-roux sur poitrine ET face. le rouge gorge n'a JAMAIS de bandeau noir sur les yeux. Ne pas confondre avec la sitelle.
-- Rougequeue noir (Phoenicurus ochruros) : queue rousse en mouvement, corps gris-noir, mâle avec bavette noire
-
-En cas de doute entre deux espèces proches, indique "Mésange sp." ou "Moineau sp." avec mention des deux possibilités dans la description.
-
-Pour chaque oiseau détecté, fournis :
-1. Nom de l'espèce (commun en français et scientifique)
-2. Niveau de confiance : "élevé", "moyen", ou "faible"
-3. Brève description des caractéristiques visuelles qui ont aidé à l'identifier
-4. Position approximative dans l'image : "gauche"/"centre"/"droite", "haut"/"milieu"/"bas"
-5. Coordonnées de la bounding box : position x,y du coin supérieur gauche et largeur/hauteur en pourcentages (0-100) de la zone de l'image qui contient l'oiseau.
-
-Si aucun oiseau n'est visible, réponds avec : "Aucun oiseau détecté"
-
-Formate ta réponse en JSON uniquement, sans texte avant ou après :
-{
-  "birds": [
-    {
-      "species": "nom de l'espèce en français",
-      "scientific_name": "nom scientifique",
-      "confidence": "élevé/moyen/faible",
-      "description": "caractéristiques visuelles en français",
-      "location": "position dans l'image en français",
-      "bbox": {
-        "x": pourcentage_x,
-        "y": pourcentage_y,
-        "width": pourcentage_largeur,
-        "height": pourcentage_hauteur
-      }
-    }
-  ],
-  "count": nombre_d_oiseaux,
-  "timestamp": "heure_actuelle"
-}"""
-                        }
-                    ],
+                    "content": build_image_content(frames_base64),
                 }
             ],
+            timeout=timeout,
+        ) as stream:
+            api_scheduler.update_limits(stream.response.headers)
+            async for text in stream.text_stream:
+                for bird in parser.feed(text):
+                    if on_bird is not None:
+                        await notify_bird(on_bird, bird, len(frames_base64))
+            return await stream.get_final_message()
+
+    async def on_retry(attempt, delay, error):
+        log_event("api_retry", level="warning", attempt=attempt, delay=round(delay, 2), error=str(error),
+                  batch_size=len(frames_base64))
+        if on_status is not None:
+            await on_status({"status": "retrying", "attempt": attempt, "retry_in": round(delay, 2),
+                             "reason": type(error).__name__})
+
+    async def on_throttle(wait):
+        if on_status is not None:
+            await on_status({"status": "throttled", "wait": round(wait, 2)})
+
+    try:
+        message = await api_scheduler.call(
+            request,
+            priority=priority,
+            deadline=deadline,
+            images=len(frames_base64),
+            # Birds already streamed to clients would be sent twice by a new attempt
+            can_retry=lambda: not parser.birds,
+            on_retry=on_retry,
+            on_throttle=on_throttle,
+        )
+
+        stage_seconds.observe(time.perf_counter() - started, stage="api")
+        log_usage(message.usage, len(frames_base64))
+        api_scheduler.record_usage(
+            len(frames_base64),
+            message.usage.input_tokens + (getattr(message.usage, "cache_creation_input_tokens", None) or 0),
         )
 
-        response_text = message.content[0].text
+        result = parse_detection_response(parser.text, parser.birds)
+        if attempts > 1:
+            result["api_attempts"] = attempts
+        if len(frames_base64) == 1:
+            return [result]
+        results = split_batch_result(result, len(frames_base64))
+        if attempts > 1:
+            for image_result in results:
+                image_result["api_attempts"] = attempts
+        return results
+
+    except Exception as e:
+        api_errors.inc()
+        log_event("api_error", level="error", error=str(e), batch_size=len(frames_base64))
+        return [{
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        } for _ in frames_base64]
 
-        # Try to extract JSON from the response
-        # Claude often includes text before/after the JSON block
+async def notify_bird(on_bird, bird, frame_count):
+    """Pass a streamed bird to the callback of the frame it belongs to"""
+    index = 0
+    if frame_count > 1:
         try:
-            # First try direct parsing
-            return json.loads(response_text)
-        except json.JSONDecodeError:
-            # Try to extract JSON from markdown code blocks
-            json_match = re.search(r'```json\s*(\{.*?\})\s*```', response_text, re.DOTALL)
-            if json_match:
-                try:
-                    return json.loads(json_match.group(1))
-                except json.JSONDecodeError:
-                    pass
-
-            # Try to find any JSON object in the text
-            json_match = re.search(r'\{[^{}]*"birds"[^{}]*\}', response_text, re.DOTALL)
-            if json_match:
-                try:
-                    return json.loads(json_match.group(0))
-                except json.JSONDecodeError:
-                    pass
-
-            # If all parsing fails, return raw response
-            return {
-                "birds": [],
-                "count": 0,
-                "raw_response": response_text,
-                "timestamp": datetime.now().isoformat()
-            }
+            index = int(bird.get("image")) - 1
+        except (TypeError, ValueError):
+            return
+        if not 0 <= index < frame_count:
+            return
 
+    try:
+        await on_bird(index, {key: value for key, value in bird.items() if key != "image"})
     except Exception as e:
-        print(f"Error analyzing frame: {e}")
-        return {
+        log_event("partial_send_error", level="error", error=str(e))
+
+async def send_analysis_batch(jobs):
+    """Analyze a batch of (frame_base64, on_bird, on_status, priority, deadline) jobs of one priority in one API call"""
+    async def on_bird(index, bird):
+        callback = jobs[index][1]
+        if callback is not None:
+            await callback(bird)
+
+    async def on_status(message):
+        for _, _, callback, _, _ in jobs:
+            if callback is not None:
+                await callback(message)
+
+    # Batches never mix priorities; the batch gives up when its most urgent job would
+    deadlines = [deadline for *_, deadline in jobs if deadline is not None]
+    return await analyze_frames_with_claude(
+        [frame_base64 for frame_base64, *_ in jobs],
+        on_bird,
+        priority=jobs[0][3],
+        deadline=min(deadlines) if deadlines else None,
+        on_status=on_status,
+    )
+
+async def analyze_job(frame_base64, on_bird=None, on_status=None, priority=INTERACTIVE, deadline=None):
+    """Queue worker: add a frame to the next batch of its priority and wait for its result"""
+    return await batch_schedulers[priority].submit((frame_base64, on_bird, on_status, priority, deadline))
+
+def record_send(size, seconds):
+    """Account for a message written by a connection's writer task"""
+    bytes_sent.inc(size)
+    stage_seconds.observe(seconds, stage="send")
+
+def send_message(websocket, *messages, key=None, droppable=False):
+    """Queue text or binary messages to be sent back to back by the client's writer task (never waits)
+
+    Messages with a key replace a queued message with the same key; they and droppable
+    messages are the first discarded when a slow client's queue is full.
+    """
+    queue = outbound_queues.get(websocket)
+    return queue is not None and queue.put(*messages, key=key, droppable=droppable)
+
+def broadcast_message(connections, *messages, key):
+    """Queue messages for several clients; slow ones lose stale results instead of holding up the others"""
+    for websocket in connections:
+        send_message(websocket, *messages, key=key)
+
+def check_upload(websocket, size, request_id=None):
+    """Apply the upload size and rate limits; sends the error and returns False when the upload is refused"""
+    if size is not None and size > UPLOAD_MAX_BYTES:
+        analyze_requests.inc(outcome="upload_too_large")
+        error, retry_in = f"Image too large ({size} bytes, max {UPLOAD_MAX_BYTES})", None
+    else:
+        retry_in = upload_limiters[websocket].acquire()
+        if not retry_in:
+            return True
+        analyze_requests.inc(outcome="rate_limited")
+        error = "Too many uploads, slow down"
+
+    log_event("upload_refused", level="warning", user=id(websocket), request_id=request_id, size=size, error=error)
+    send_message(websocket, json.dumps({
+        "status": "error",
+        "error": error,
+        "retry_in": round(retry_in, 1) if retry_in else None,
+        "request_id": request_id,
+        "timestamp": datetime.now().isoformat()
+    }))
+    return False
+
+async def run_analysis(websocket, frame_base64, on_bird=None, request_id=None):
+    """Queue a frame for analysis and wait for the result; returns None if it was rejected"""
+    async def send_status(message):
+        # Throttling and retries of the API call, as they happen (only the latest matters)
+        send_message(websocket, json.dumps({
+            **message,
+            "request_id": request_id,
+            "timestamp": datetime.now().isoformat()
+        }), key=f"status:{request_id}")
+
+    # The queue runs a bounded number of API calls at once
+    try:
+        analysis, position = analysis_queue.submit(
+            websocket, frame_base64, on_bird, send_status, INTERACTIVE, time.monotonic() + API_DEADLINE,
+            priority=INTERACTIVE,
+        )
+    except QueueFullError as e:
+        analyze_requests.inc(outcome="rejected")
+        log_event("analysis_rejected", level="warning", request_id=request_id, error=str(e))
+        send_message(websocket, json.dumps({
+            "status": "busy",
             "error": str(e),
+            "queue_position": e.position,
             "timestamp": datetime.now().isoformat()
-        }
+        }))
+        return
+
+    # Let the client know it is waiting behind other analyses
+    if position > ANALYSIS_CONCURRENCY - analysis_queue.in_flight:
+        send_message(websocket, json.dumps({
+            "status": "queued",
+            "queue_position": position,
+            "timestamp": datetime.now().isoformat()
+        }), key=f"status:{request_id}")
+
+    log_event("analysis_queued", request_id=request_id, queue_position=position)
+    with stage_seconds.time(stage="analysis"):
+        return await analysis
+
+async def detect_birds_locally(frame, jpeg_bytes):
+    """Run the local detector on a BGR frame (decoded from the JPEG if None); returns (frame, summary, crop region)
 
-async def handle_analyze_request(websocket, frame_base64=None):
-    """Handle an analyze request from a client"""
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] Received analyze request")
+    The crop region is None when no bird was found.
+    """
+    if frame is None:
+        import numpy as np
+        with stage_seconds.time(stage="decode"):
+            frame = await asyncio.to_thread(cv2.imdecode, np.frombuffer(jpeg_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("Could not decode image")
+
+    with stage_seconds.time(stage="local_detect"):
+        detections = await asyncio.to_thread(local_detector.detect, frame)
+
+    height, width = frame.shape[:2]
+    summary = {
+        "birds": [detection.to_dict(width, height) for detection in detections],
+        "inference_ms": round(local_detector.last_seconds * 1000, 2),
+    }
+    region = local_detector.crop_region(detections, width, height) if detections else None
+    return frame, summary, region
+
+async def handle_analyze_request(websocket, jpeg_bytes=None, protocol=1, request_id=None, camera_id=DEFAULT_CAMERA):
+    """Handle an analyze request from a client
+
+    Protocol 1 clients get the analyzed image back as a base64 data URL. Protocol 2
+    clients uploaded raw JPEG bytes and only get the capture ID back (plus the image
+    as a binary frame when it was captured server-side). Without an upload the frame
+    is taken from camera_id, which uploads are also recorded under.
+    """
+    request_id = request_id or new_request_id()
+    request_started = time.perf_counter()
+    log_event("analyze_request_received", request_id=request_id, protocol=protocol, camera=camera_id,
+              upload_bytes=len(jpeg_bytes) if jpeg_bytes else None)
+
+    frame_age = None
+    from_stream = jpeg_bytes is None
 
     # If no frame provided, capture from stream (fallback)
-    if frame_base64 is None:
-        frame = capture_frame_from_stream()
+    if from_stream:
+        with stage_seconds.time(stage="capture"):
+            frame, frame_age = capture_frame_from_stream(camera_id)
 
         if frame is None:
+            analyze_requests.inc(outcome="capture_error")
             error_response = {
                 "error": "Could not capture frame from stream",
+                "frame_age": frame_age,
+                "grabber": cameras[camera_id].health(),
+                "request_id": request_id,
                 "timestamp": datetime.now().isoformat()
             }
-            await websocket.send(json.dumps(error_response))
+            send_message(websocket, json.dumps(error_response))
             return
 
-        # Convert to base64
-        frame_base64 = frame_to_base64(frame)
+        with stage_seconds.time(stage="encode"):
+            jpeg_bytes = await asyncio.to_thread(frame_to_jpeg, frame)
     else:
-        # Decode base64 to OpenCV frame for saving and annotation
-        import numpy as np
-        nparr = np.frombuffer(base64.b64decode(frame_base64), np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        # Check the JPEG headers before doing any work with the upload
+        try:
+            jpeg_dimensions(jpeg_bytes)
+        except InvalidImageError as e:
+            analyze_requests.inc(outcome="invalid_image")
+            send_message(websocket, json.dumps({
+                "error": f"Invalid image: {e}",
+                "request_id": request_id,
+                "timestamp": datetime.now().isoformat()
+            }))
+            return
 
-    # Generate unique identifier for this user and capture
-    user_id = id(websocket)
-    timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
-    frame_filename = f"captures/user_{user_id}_frame_{timestamp_str}.jpg"
+        # A reduced grayscale decode is all the perceptual hash needs
+        import numpy as np
+        nparr = np.frombuffer(jpeg_bytes, np.uint8)
+        with stage_seconds.time(stage="decode"):
+            frame = await asyncio.to_thread(cv2.imdecode, nparr, cv2.IMREAD_REDUCED_GRAYSCALE_2)
 
-    # Create captures directory if it doesn't exist
-    os.makedirs("captures", exist_ok=True)
+        if frame is None:
+            analyze_requests.inc(outcome="invalid_image")
+            send_message(websocket, json.dumps({
+                "error": "Could not decode image",
+                "request_id": request_id,
+                "timestamp": datetime.now().isoformat()
+            }))
+            return
 
-    # Save the frame
-    import cv2 as cv
-    cv.imwrite(frame_filename, frame)
-    print(f"Frame saved: {frame_filename}")
+    # Queue the original JPEG bytes for storage in the user's session (no re-encode, written in the background)
+    with stage_seconds.time(stage="write_queue"):
+        capture = capture_store.save(client_sessions[websocket], "frame", jpeg_bytes)
+    log_event("capture_queued", request_id=request_id, capture_id=capture.id, bytes=len(jpeg_bytes))
 
-    # Track this capture for this user
-    if websocket not in user_captures:
-        user_captures[websocket] = []
-    user_captures[websocket].append(frame_filename)
+    # Near-duplicate uploads (crops the user selected) reuse a recent result instead of calling the API again.
+    # Whole stream frames skip the cache: a small bird barely moves their hash, as on the automatic path
+    frame_hash = detection_result = None
+    if not from_stream:
+        with stage_seconds.time(stage="cache_lookup"):
+            frame_hash, detection_result = result_cache.get(frame)
+    if detection_result is not None:
+        remote_calls_avoided.inc(reason="cache")
+        log_event("cache_hit", request_id=request_id, distance=detection_result["cache_distance"],
+                  age=detection_result["cache_age"], hit_rate=result_cache.stats()["hit_rate"])
+    else:
+        # Uploads only have a reduced grayscale decode, so the preprocessor works from their bytes
+        color_frame = frame if from_stream else None
+        local_summary = bird_region = None
+        try:
+            if local_detector is not None:
+                color_frame, local_summary, bird_region = await detect_birds_locally(color_frame, jpeg_bytes)
+            if local_summary is None or bird_region is not None:
+                with stage_seconds.time(stage="preprocess"):
+                    prepared = await asyncio.to_thread(
+                        preprocessor.process, color_frame, jpeg_bytes, None, bird_region
+                    )
+        except ValueError as e:
+            analyze_requests.inc(outcome="invalid_image")
+            send_message(websocket, json.dumps({
+                "error": f"Could not prepare image: {e}",
+                "request_id": request_id,
+                "timestamp": datetime.now().isoformat()
+            }))
+            return
 
-    # Analyze with Claude
-    print("Analyzing frame with Claude Vision API...")
-    detection_result = await analyze_frame_with_claude(frame_base64)
+        async def send_partial(bird):
+            # Streamed bird, sent before the full reply is available (which makes it droppable)
+            partial = prepared.map_result({"birds": [bird]})
+            send_message(websocket, json.dumps({
+                "status": "partial",
+                "bird": partial["birds"][0],
+                "request_id": request_id,
+                "timestamp": datetime.now().isoformat()
+            }), droppable=True)
 
-    # Print results
-    if detection_result.get("count", 0) > 0:
-        print(f"✓ Detected {detection_result['count']} bird(s):")
-        for bird in detection_result.get("birds", []):
-            print(f"  - {bird.get('species')} ({bird.get('confidence')})")
+        if local_summary is not None and bird_region is None:
+            # No bird for the local detector: answer without calling the API
+            remote_calls_avoided.inc(reason="local_detector")
+            detection_result = {"birds": [], "count": 0}
+        else:
+            detection_result = await run_analysis(
+                websocket, base64.b64encode(prepared.jpeg).decode('ascii'), send_partial, request_id
+            )
+            if detection_result is None:
+                return
+            prepared.map_result(detection_result)
+            detection_result["preprocessing"] = prepared.summary()
+            if frame_hash is not None:
+                result_cache.put(frame_hash, frame, detection_result)
+            record_detection(detection_result, camera_id, "manual", capture.id, request_id)
+        if local_summary is not None:
+            detection_result["local_detector"] = local_summary
 
-    # Always use original frame (no annotation)
-    detection_result["captured_image"] = f"data:image/jpeg;base64,{frame_base64}"
+    # Log results
+    log_event("analysis_result", request_id=request_id, count=detection_result.get("count", 0),
+              species=[bird.get("species") for bird in detection_result.get("birds", [])],
+              cached=detection_result.get("cached", False), error=detection_result.get("error"))
+    if "error" in detection_result:
+        outcome = "error"
+    elif detection_result.get("local_detector", {}).get("birds") == []:
+        outcome = "no_bird"
+    else:
+        outcome = "ok"
+    analyze_requests.inc(outcome=outcome)
 
     # Add timestamp and metadata
+    detection_result["status"] = "final"
+    detection_result["request_id"] = request_id
+    detection_result["camera"] = camera_id
     detection_result["timestamp"] = datetime.now().isoformat()
-    detection_result["saved_filename"] = frame_filename
+    detection_result["saved_filename"] = capture.path
+    detection_result["capture_id"] = capture.id
+    if frame_age is not None:
+        detection_result["frame_age"] = round(frame_age, 3)
+        detection_result["grabber"] = cameras[camera_id].health()
 
-    # Send response to client
-    await websocket.send(json.dumps(detection_result))
+    if protocol >= 2:
+        # The client already has the image it uploaded; stream captures follow as a binary frame
+        detection_result["binary_follows"] = from_stream
+        if from_stream:
+            send_message(websocket, json.dumps(detection_result), jpeg_bytes)
+        else:
+            send_message(websocket, json.dumps(detection_result))
+    else:
+        # Always use original frame (no annotation)
+        frame_base64 = base64.b64encode(jpeg_bytes).decode('ascii')
+        detection_result["captured_image"] = f"data:image/jpeg;base64,{frame_base64}"
+
+        # Send response to client
+        send_message(websocket, json.dumps(detection_result))
+
+    stage_seconds.observe(time.perf_counter() - request_started, stage="total")
+
+async def handle_get_capture(websocket, capture_id):
+    """Send one of the session's captures (from either service) back as a binary frame"""
+    capture = await capture_store.find(client_sessions[websocket], capture_id)
+    if capture is not None:
+        try:
+            await capture_writer.wait_for([capture.path])
+            jpeg_bytes = await asyncio.to_thread(read_file_bytes, capture.path)
+        except OSError as e:
+            log_event("capture_read_error", level="error", capture_id=capture_id, error=str(e))
+        else:
+            send_message(websocket, json.dumps({
+                "status": "capture",
+                "capture_id": capture_id,
+                "kind": capture.kind,
+                "binary_follows": True
+            }), jpeg_bytes)
+            return
+
+    send_message(websocket, json.dumps({
+        "status": "error",
+        "error": f"Unknown capture: {capture_id}"
+    }))
 
 async def handle_delete_captures(websocket):
-    """Delete all captures for a specific user"""
-    if websocket not in user_captures:
+    """Delete the analyzed frames of the user's session (screenshots are left to their service)"""
+    deleted_count = await capture_store.delete(client_sessions[websocket], kind="frame")
+    log_event("captures_deleted", user=id(websocket), count=deleted_count)
+
+async def set_session(websocket, token):
+    """Move a connection to another capture session (e.g. the one it used before reconnecting)"""
+    previous = client_sessions.get(websocket)
+    if previous == token:
+        return
+    await capture_store.attach(token)
+    client_sessions[websocket] = token
+    if previous is not None:
+        capture_store.detach(previous)
+
+def record_detection(detection_result, camera_id, source, capture_id=None, request_id=None):
+    """Append a fresh identification to the detection history (cached and failed results are skipped)"""
+    if detection_history is not None and "error" not in detection_result:
+        detection_history.record(detection_result, camera_id, source, capture_id=capture_id, request_id=request_id)
+
+async def handle_history_request(websocket, data):
+    """Answer a history query: paginated detections or per-species counts per hour/day"""
+    if detection_history is None:
+        send_message(websocket, json.dumps({"status": "error", "error": "Detection history is disabled"}))
         return
 
-    deleted_count = 0
-    for filename in user_captures[websocket]:
+    filters = {
+        "since": data.get("since"),
+        "until": data.get("until"),
+        "species": data.get("species"),
+        "camera": data.get("camera"),
+        "min_confidence": data.get("min_confidence"),
+    }
+    query = data.get("query", "detections")
+    try:
+        with stage_seconds.time(stage="history_query"):
+            if query == "aggregate":
+                result = await asyncio.to_thread(detection_history.aggregate, data.get("bucket", "day"), **filters)
+            elif query == "detections":
+                result = await asyncio.to_thread(
+                    detection_history.query, data.get("limit", 50), data.get("before_id"), **filters
+                )
+            else:
+                raise ValueError(f"Unknown history query: {query}")
+    except (ValueError, TypeError) as e:
+        send_message(websocket, json.dumps({"status": "error", "error": str(e), "request_id": data.get("request_id")}))
+        return
+
+    send_message(websocket, json.dumps({
+        "status": "history",
+        "query": query,
+        "request_id": data.get("request_id"),
+        **result,
+        "timestamp": datetime.now().isoformat()
+    }))
+
+async def analyze_and_broadcast(camera_id, frame, frame_timestamp, motion_region):
+    """Identify birds in a frame selected by a camera's motion gate and push the result to its subscribers"""
+    jpeg_bytes = await asyncio.to_thread(frame_to_jpeg, frame)
+    frame_base64 = base64.b64encode(jpeg_bytes).decode('ascii')
+    tracker = trackers[camera_id]
+
+    # No full-frame result cache here: a small bird landing on an unchanged feeder barely moves the
+    # frame hash, and replaying the previous result would undo the motion gate when it matters
+    bird_region = None
+    bird_boxes = [motion_region]
+    if local_detector is not None:
+        _, local_summary, bird_region = await detect_birds_locally(frame, jpeg_bytes)
+        if bird_region is None:
+            # Motion without a bird (wind, light, squirrels): nothing to identify or broadcast
+            remote_calls_avoided.inc(reason="local_detector")
+            log_event("auto_analysis_skipped", camera=camera_id, reason="no_bird",
+                      inference_ms=local_summary["inference_ms"])
+            return
+        bird_boxes = local_summary["birds"]
+
+    # Birds that are already reliably identified are not sent again until their identification gets old
+    tracks = tracker.follow(bird_boxes, frame_timestamp, precise=local_detector is not None)
+    if tracks is not None:
+        remote_calls_avoided.inc(reason="tracker")
+        detection_result = {"birds": [track.to_bird() for track in tracks], "count": len(tracks), "tracked": True}
+    else:
+        # Send only the birds found locally, or the padded motion region when auto-crop is enabled
+        prepared = await asyncio.to_thread(preprocessor.process, frame, jpeg_bytes, motion_region, bird_region)
         try:
-            if os.path.exists(filename):
-                os.remove(filename)
-                deleted_count += 1
-                print(f"Deleted: {filename}")
-        except Exception as e:
-            print(f"Error deleting {filename}: {e}")
+            analysis, _ = analysis_queue.submit(
+                f"{AUTO_DETECT_CLIENT}:{camera_id}", base64.b64encode(prepared.jpeg).decode('ascii'), None, None,
+                BACKGROUND, time.monotonic() + API_AUTO_DEADLINE, priority=BACKGROUND
+            )
+            # User analyses may displace this one from the queue while it waits
+            detection_result = await analysis
+        except QueueFullError as e:
+            log_event("auto_analysis_skipped", level="warning", camera=camera_id, error=str(e))
+            return
+
+        prepared.map_result(detection_result)
+        detection_result["preprocessing"] = prepared.summary()
+        if "error" not in detection_result:
+            tracker.update(detection_result.get("birds", []), frame_timestamp)
+        record_detection(detection_result, camera_id, "auto")
+
+    log_event("auto_analysis_result", camera=camera_id, count=detection_result.get("count", 0),
+              species=[bird.get("species") for bird in detection_result.get("birds", [])],
+              tracked=detection_result.get("tracked", False), error=detection_result.get("error"))
+
+    detection_result["mode"] = "auto"
+    detection_result["camera"] = camera_id
+    detection_result["motion_region"] = motion_region
+    detection_result["frame_age"] = round(time.time() - frame_timestamp, 3)
+    detection_result["timestamp"] = datetime.now().isoformat()
 
-    # Clear the list
-    user_captures[websocket] = []
-    print(f"Deleted {deleted_count} files for user {id(websocket)}")
+    # Queued per client: a slow one only loses its stale automatic results
+    camera_subscribers = [ws for ws, camera_ids in subscribers.items() if camera_id in camera_ids]
+    binary_subscribers = [ws for ws in camera_subscribers if client_protocols.get(ws, 1) >= 2]
+    legacy_subscribers = [ws for ws in camera_subscribers if client_protocols.get(ws, 1) < 2]
+
+    if binary_subscribers:
+        # Protocol 2: JSON header, then the JPEG as a binary frame
+        broadcast_message(binary_subscribers, json.dumps({**detection_result, "binary_follows": True}), jpeg_bytes,
+                          key=f"auto:{camera_id}")
+
+    if legacy_subscribers:
+        detection_result["captured_image"] = f"data:image/jpeg;base64,{frame_base64}"
+        broadcast_message(legacy_subscribers, json.dumps(detection_result), key=f"auto:{camera_id}")
+
+async def auto_detect_loop(camera_id):
+    """Continuously run a camera's motion gate on its latest frame while clients are subscribed to it"""
+    camera = cameras[camera_id]
+    motion_gate = motion_gates[camera_id]
+    last_timestamp = None
+    pending_analysis = None
+
+    while True:
+        await asyncio.sleep(AUTO_DETECT_INTERVAL)
+        if not any(camera_id in camera_ids for camera_ids in subscribers.values()):
+            continue
+
+        frame, frame_timestamp = camera.latest()
+        if frame is None or frame_timestamp == last_timestamp:
+            continue
+        last_timestamp = frame_timestamp
+
+        # Background subtraction is CPU work: keep it off the event loop (OpenCV releases the GIL)
+        motion_region = await asyncio.to_thread(motion_gate.process, frame)
+        if motion_region is None:
+            continue
+
+        # Only one automatic analysis at a time per camera; the cooldown covers the rest
+        if pending_analysis is not None and not pending_analysis.done():
+            continue
+
+        log_event("motion_detected", camera=camera_id, region=motion_region)
+        pending_analysis = asyncio.create_task(analyze_and_broadcast(camera_id, frame, frame_timestamp, motion_region))
+
+async def supervise_cameras():
+    """Restart camera decoder processes that died (crash, out of memory)"""
+    while True:
+        await asyncio.sleep(CAMERA_SUPERVISE_INTERVAL)
+        for camera in cameras.values():
+            camera.ensure_running()
+
+def camera_stats():
+    """Decoder health, motion gate and subscribers of every camera"""
+    return {
+        camera_id: {
+            "grabber": camera.health(),
+            "motion": motion_gates[camera_id].stats(),
+            "tracker": trackers[camera_id].stats(),
+            "subscribers": sum(camera_id in camera_ids for camera_ids in subscribers.values()),
+        }
+        for camera_id, camera in cameras.items()
+    }
+
+def resolve_cameras(requested):
+    """Camera IDs named by a client (one ID or a list; all cameras when omitted), or None if one is unknown"""
+    if requested is None:
+        return set(cameras)
+    if isinstance(requested, str):
+        camera_ids = {requested}
+    elif isinstance(requested, list) and all(isinstance(camera_id, str) for camera_id in requested):
+        camera_ids = set(requested)
+    else:
+        return None
+    if not camera_ids or not camera_ids <= set(cameras):
+        return None
+    return camera_ids
+
+def get_service_stats():
+    """Collect runtime statistics of the detection pipeline"""
+    return {
+        "status": "stats",
+        "clients": len(connected_clients),
+        "cameras": camera_stats(),
+        "queue": {
+            "depth": analysis_queue.depth,
+            "in_flight": analysis_queue.in_flight,
+            "displaced": analysis_queue.displaced,
+        },
+        "cache": result_cache.stats(),
+        "writer": capture_writer.stats(),
+        "captures": capture_store.stats(),
+        "preprocessing": preprocessor.stats(),
+        "local_detector": local_detector.stats() if local_detector else None,
+        "batching": {
+            "interactive": batch_schedulers[INTERACTIVE].stats(),
+            "background": batch_schedulers[BACKGROUND].stats(),
+        },
+        "api": api_scheduler.stats(),
+        "history": detection_history.stats() if detection_history else None,
+        "subscribers": len(subscribers),
+        "outbound": {
+            "messages": sum(queue.depth for queue in outbound_queues.values()),
+            "bytes": sum(queue.bytes for queue in outbound_queues.values()),
+            "largest_bytes": max((queue.bytes for queue in outbound_queues.values()), default=0),
+            "coalesced": outbound_discarded.value(reason="coalesced"),
+            "dropped": outbound_discarded.value(reason="dropped"),
+            "overflow_disconnects": outbound_discarded.value(reason="overflow"),
+        },
+        "timestamp": datetime.now().isoformat()
+    }
+
+def start_analysis(websocket, jpeg_bytes, protocol, request_id=None, camera_id=DEFAULT_CAMERA):
+    """Run an analyze request in the background so the connection keeps receiving messages"""
+    request_id = request_id or new_request_id()
+    task = asyncio.create_task(handle_analyze_request(websocket, jpeg_bytes, protocol, request_id, camera_id))
+    analysis_tasks[websocket].add(task)
+
+    def on_done(task):
+        analysis_tasks.get(websocket, set()).discard(task)
+        if task.cancelled() or task.exception() is None:
+            return
+        # Not caught by handle_analyze_request: log it and let the client stop waiting
+        analyze_requests.inc(outcome="failed")
+        log_event("analysis_failed", level="error", user=id(websocket), request_id=request_id,
+                  error=repr(task.exception()))
+        send_message(websocket, json.dumps({
+            "status": "error",
+            "error": "Analysis failed",
+            "request_id": request_id,
+            "timestamp": datetime.now().isoformat()
+        }))
+
+    task.add_done_callback(on_done)
 
 async def websocket_handler(websocket):
     """Handle WebSocket connections and messages"""
     connected_clients.add(websocket)
-    user_captures[websocket] = []  # Initialize empty capture list for this user
-    print(f"Client connected. Total clients: {len(connected_clients)}")
+    outbound_queues[websocket] = OutboundQueue(
+        websocket,
+        max_messages=OUTBOUND_MAX_MESSAGES,
+        max_bytes=OUTBOUND_MAX_BYTES,
+        on_send=record_send,
+        on_drop=lambda reason: outbound_discarded.inc(reason=reason),
+    )
+    outbound_queues[websocket].start()
+    upload_limiters[websocket] = UploadLimiter(UPLOAD_RATE_PER_MINUTE, UPLOAD_BURST)
+    # Until the client names its own session, its captures go to a fresh one
+    await set_session(websocket, new_session_token())
+    analysis_tasks[websocket] = set()
+    log_event("client_connected", user=id(websocket), clients=len(connected_clients))
 
     try:
         async for message in websocket:
+            bytes_received.inc(len(message))
             try:
+                if isinstance(message, bytes):
+                    # Protocol 2: a binary frame carries the JPEG announced by the previous header
+                    header = pending_uploads.pop(websocket, None)
+                    if header is None:
+                        log_event("unexpected_binary_frame", level="warning", user=id(websocket))
+                        continue
+                    if header.get('refused'):
+                        continue
+                    if len(message) > UPLOAD_MAX_BYTES:
+                        # The header announced a smaller image
+                        check_upload(websocket, len(message), header.get('request_id'))
+                        continue
+                    start_analysis(websocket, message, protocol=2, request_id=header.get('request_id'),
+                                   camera_id=header.get('camera', DEFAULT_CAMERA))
+                    continue
+
                 data = json.loads(message)
-                if data.get('action') == 'analyze':
-                    # Check if frame is provided in the message
+                if data.get('action') == 'session':
+                    token = data.get('session')
+                    if is_valid_token(token):
+                        await set_session(websocket, token)
+                        send_message(websocket, json.dumps({"status": "session", "session": token}))
+                    else:
+                        send_message(websocket, json.dumps({"status": "error", "error": "Invalid session token"}))
+                elif data.get('action') == 'analyze':
+                    camera_id = data.get('camera', DEFAULT_CAMERA)
+                    if not isinstance(camera_id, str) or camera_id not in cameras:
+                        send_message(websocket, json.dumps({
+                            "status": "error", "error": f"Unknown camera: {data.get('camera')}",
+                            "action": "analyze", "request_id": data.get('request_id')
+                        }))
+                        continue
+                    if data.get('binary'):
+                        # Protocol 2 header: the JPEG bytes follow in the next (binary) message, dropped if refused
+                        client_protocols[websocket] = 2
+                        size = data.get('size')
+                        if size is not None and (not isinstance(size, int) or isinstance(size, bool) or size < 0):
+                            analyze_requests.inc(outcome="invalid_image")
+                            send_message(websocket, json.dumps({
+                                "status": "error", "error": f"Invalid upload size: {size!r}",
+                                "action": "analyze", "request_id": data.get('request_id')
+                            }))
+                            pending_uploads[websocket] = {**data, "refused": True}
+                            continue
+                        accepted = check_upload(websocket, size, data.get('request_id'))
+                        pending_uploads[websocket] = data if accepted else {**data, "refused": True}
+                        continue
+
+                    protocol = data.get('protocol', 1)
+                    # Check if frame is provided in the message (protocol 1 sends base64)
                     frame_base64 = data.get('frame')
-                    await handle_analyze_request(websocket, frame_base64)
+                    if frame_base64 and not check_upload(websocket, len(frame_base64) * 3 // 4, data.get('request_id')):
+                        continue
+                    with stage_seconds.time(stage="base64_decode"):
+                        jpeg_bytes = base64.b64decode(frame_base64) if frame_base64 else None
+                    start_analysis(websocket, jpeg_bytes, protocol=protocol, request_id=data.get('request_id'),
+                                   camera_id=camera_id)
+                elif data.get('action') == 'get_capture':
+                    await handle_get_capture(websocket, data.get('capture_id'))
                 elif data.get('action') == 'delete_captures':
                     await handle_delete_captures(websocket)
-                    await websocket.send(json.dumps({"status": "deleted"}))
+                    send_message(websocket, json.dumps({"status": "deleted"}))
+                elif data.get('action') == 'subscribe':
+                    camera_ids = resolve_cameras(data.get('camera'))
+                    if camera_ids is None:
+                        send_message(websocket, json.dumps({
+                            "status": "error", "error": f"Unknown camera: {data.get('camera')}",
+                            "action": "subscribe"
+                        }))
+                        continue
+                    client_protocols[websocket] = data.get('protocol', client_protocols.get(websocket, 1))
+                    subscribers[websocket] = camera_ids
+                    send_message(websocket, json.dumps({"status": "subscribed", "cameras": sorted(camera_ids)}))
+                elif data.get('action') == 'unsubscribe':
+                    subscribers.pop(websocket, None)
+                    send_message(websocket, json.dumps({"status": "unsubscribed"}))
+                elif data.get('action') == 'cameras':
+                    send_message(websocket, json.dumps({
+                        "status": "cameras",
+                        "default": DEFAULT_CAMERA,
+                        "cameras": [camera.health() for camera in cameras.values()],
+                        "timestamp": datetime.now().isoformat()
+                    }))
+                elif data.get('action') == 'stats':
+                    send_message(websocket, json.dumps(get_service_stats()))
+                elif data.get('action') == 'history':
+                    await handle_history_request(websocket, data)
             except json.JSONDecodeError:
-                print(f"Invalid JSON received: {message}")
+                log_event("invalid_json", level="warning", user=id(websocket), message=message[:100])
             except Exception as e:
-                print(f"Error handling message: {e}")
+                log_event("message_error", level="error", user=id(websocket), error=str(e))
     finally:
-        # Clean up user's captures when they disconnect
-        if websocket in user_captures:
-            print(f"Cleaning up captures for disconnected user {id(websocket)}")
-            await handle_delete_captures(websocket)
-            del user_captures[websocket]
+        # Drop queued analyses and stop the running ones for this user
+        analysis_queue.cancel_client(websocket)
+        for task in analysis_tasks.pop(websocket, set()):
+            task.cancel()
+
+        # Captures are kept for the grace period so a reconnecting client finds them again
+        capture_store.detach(client_sessions.pop(websocket))
 
+        subscribers.pop(websocket, None)
+        client_protocols.pop(websocket, None)
+        pending_uploads.pop(websocket, None)
+        outbound_queues.pop(websocket).stop()
+        upload_limiters.pop(websocket, None)
         connected_clients.remove(websocket)
-        print(f"Client disconnected. Total clients: {len(connected_clients)}")
+        log_event("client_disconnected", user=id(websocket), clients=len(connected_clients))
+
+def setup():
+    """Build the service: clients, caches, schedulers, stores and camera handles
+
+    Kept out of module scope because every spawned camera worker re-imports this module
+    (as __mp_main__) and must not rebuild any of it.
+    """
+    global client, metrics_registry, stage_seconds, analyze_requests, remote_calls_avoided, api_errors, api_tokens
+    global bytes_received, bytes_sent, outbound_discarded, event_loop_lag, result_cache, preprocessor
+    global local_detector, api_scheduler, capture_writer, capture_retention, capture_store, detection_history
+    global cameras, motion_gates, trackers, batch_schedulers, analysis_queue
+    # Imported here too: the camera workers have no use for the API client
+    from anthropic import AsyncAnthropic
+
+    configure_logging("bird-detector")
+
+    # Initialize Anthropic client (async so API calls never block the event loop)
+    # Retries are left to api_scheduler, which knows about rate limits and deadlines
+    client = AsyncAnthropic(api_key=ANTHROPIC_API_KEY, max_retries=0)
+
+    # Instrumentation, served on METRICS_PORT
+    metrics_registry = MetricsRegistry()
+    stage_seconds = metrics_registry.histogram(
+        "bird_detector_stage_seconds", "Duration of each stage of an analyze request", ("stage",)
+    )
+    analyze_requests = metrics_registry.counter(
+        "bird_detector_analyze_requests_total", "Analyze requests by outcome", ("outcome",)
+    )
+    remote_calls_avoided = metrics_registry.counter(
+        "bird_detector_remote_calls_avoided_total", "Analyses answered without calling the vision API", ("reason",)
+    )
+    api_errors = metrics_registry.counter("bird_detector_api_errors_total", "Failed vision API calls")
+    api_tokens = metrics_registry.counter("bird_detector_api_tokens_total", "Tokens reported by the vision API", ("type",))
+    bytes_received = metrics_registry.counter("bird_detector_bytes_in_total", "Bytes received from WebSocket clients")
+    bytes_sent = metrics_registry.counter("bird_detector_bytes_out_total", "Bytes sent to WebSocket clients")
+    outbound_discarded = metrics_registry.counter(
+        "bird_detector_outbound_discarded_total", "Replies not sent to slow clients", ("reason",)
+    )
+    metrics_registry.gauge("bird_detector_connected_clients", "Connected WebSocket clients",
+                           function=lambda: len(connected_clients))
+    metrics_registry.gauge("bird_detector_subscribers", "Clients subscribed to automatic detections",
+                           function=lambda: len(subscribers))
+    metrics_registry.gauge("bird_detector_outbound_messages", "Replies waiting in the per-connection send queues",
+                           function=lambda: sum(queue.depth for queue in outbound_queues.values()))
+    metrics_registry.gauge("bird_detector_outbound_bytes", "Bytes held by the per-connection send queues",
+                           function=lambda: sum(queue.bytes for queue in outbound_queues.values()))
+    metrics_registry.gauge("bird_detector_queue_depth", "Analyses waiting for a worker",
+                           function=lambda: analysis_queue.depth)
+    metrics_registry.gauge("bird_detector_analyses_in_flight", "Analyses being processed",
+                           function=lambda: analysis_queue.in_flight)
+    metrics_registry.gauge("bird_detector_cache_hits", "Result cache hits since start",
+                           function=lambda: result_cache.hits)
+    metrics_registry.gauge("bird_detector_cache_misses", "Result cache misses since start",
+                           function=lambda: result_cache.misses)
+    metrics_registry.gauge("bird_detector_pending_writes", "Capture writes queued or in progress",
+                           function=lambda: capture_writer.pending)
+    metrics_registry.gauge("bird_detector_capture_disk_bytes", "Size of the captures directory at the last retention pass",
+                           function=lambda: capture_retention.usage_bytes)
+    metrics_registry.gauge("bird_detector_capture_evictions", "Captures evicted for age or disk budget since start",
+                           function=lambda: capture_retention.evicted_age + capture_retention.evicted_budget)
+    metrics_registry.gauge("bird_detector_capture_sessions", "Capture sessions held in memory",
+                           function=lambda: capture_store.session_count)
+    metrics_registry.gauge("bird_detector_history_pending", "Detection results waiting to be written to the history",
+                           function=lambda: detection_history.pending if detection_history else 0)
+    metrics_registry.gauge("bird_detector_history_written", "Detection results written to the history since start",
+                           function=lambda: detection_history.analyses_written if detection_history else 0)
+    metrics_registry.gauge("bird_detector_history_dropped", "Detection results dropped because the history writer fell behind",
+                           function=lambda: detection_history.dropped if detection_history else 0)
+    metrics_registry.gauge("bird_detector_local_frames_rejected", "Frames the local detector found no bird in",
+                           function=lambda: local_detector.frames_rejected if local_detector else 0)
+    metrics_registry.gauge("bird_detector_api_retries", "Vision API calls retried since start",
+                           function=lambda: api_scheduler.retries)
+    metrics_registry.gauge("bird_detector_api_throttled", "Vision API calls that waited for rate limit capacity",
+                           function=lambda: api_scheduler.throttled)
+    metrics_registry.gauge("bird_detector_api_rate_limited", "429 replies from the vision API since start",
+                           function=lambda: api_scheduler.rate_limited)
+    metrics_registry.gauge("bird_detector_api_waiting", "Vision API calls waiting for rate limit capacity",
+                           function=lambda: api_scheduler.waiting)
+    metrics_registry.gauge("bird_detector_cameras_connected", "Cameras whose decoder process is reading its stream",
+                           function=lambda: sum(camera.health().get("connected", False) for camera in cameras.values()))
+    metrics_registry.gauge("bird_detector_active_tracks", "Birds currently followed across frames",
+                           function=lambda: sum(len(tracker.tracks) for tracker in trackers.values()))
+    metrics_registry.gauge("bird_detector_camera_restarts", "Camera decoder processes restarted after dying",
+                           function=lambda: sum(camera.restarts for camera in cameras.values()))
+    event_loop_lag = register_process_metrics(metrics_registry, "bird_detector")
+
+    # Detection results of recently analyzed frames, keyed by perceptual hash
+    result_cache = FrameCache(
+        max_distance=CACHE_MAX_DISTANCE,
+        ttl=CACHE_TTL,
+        max_entries=CACHE_MAX_ENTRIES,
+        max_bytes=CACHE_MAX_BYTES,
+    )
+
+    # Shrinks frames before they are sent to the vision model
+    preprocessor = FramePreprocessor(
+        max_long_edge=PREPROCESS_MAX_EDGE,
+        jpeg_quality=PREPROCESS_JPEG_QUALITY,
+        auto_crop=PREPROCESS_AUTO_CROP,
+        denoise=PREPROCESS_DENOISE,
+        sharpen=PREPROCESS_SHARPEN,
+    )
+
+    # Optional first stage: frames without a bird never reach the vision model, the others are cropped to the birds
+    local_detector = load_detector(
+        LOCAL_DETECTOR_MODEL,
+        config_path=LOCAL_DETECTOR_CONFIG,
+        bird_class=LOCAL_DETECTOR_CLASS,
+        confidence=LOCAL_DETECTOR_CONFIDENCE,
+        input_size=LOCAL_DETECTOR_INPUT_SIZE,
+        scale=LOCAL_DETECTOR_SCALE,
+        mean=LOCAL_DETECTOR_MEAN,
+        padding=LOCAL_DETECTOR_PADDING,
+        min_crop=LOCAL_DETECTOR_MIN_CROP,
+    ) if LOCAL_DETECTOR_MODEL else None
+
+    # Rate limits, priorities and retries in front of the vision API
+    api_scheduler = ApiScheduler(
+        requests_per_minute=API_REQUESTS_PER_MINUTE or None,
+        input_tokens_per_minute=API_INPUT_TOKENS_PER_MINUTE or None,
+        max_retries=API_MAX_RETRIES,
+        base_delay=API_RETRY_BASE_DELAY,
+    )
+
+    # Writes and deletes capture files off the event loop
+    capture_writer = CaptureWriter(on_write=lambda seconds: stage_seconds.observe(seconds, stage="disk_write"))
+
+    # Disk budget and maximum age of the captures directory, shared with the other service
+    capture_retention = CaptureRetention(CAPTURES_DIR, max_bytes=CAPTURE_MAX_BYTES, max_age=CAPTURE_MAX_AGE)
+
+    # Session-keyed, content-addressed captures (analyzed frames are stored as kind "frame")
+    capture_store = CaptureStore(
+        capture_writer,
+        root=CAPTURES_DIR,
+        grace_period=CAPTURE_GRACE_PERIOD,
+        sweep_interval=CAPTURE_SWEEP_INTERVAL,
+        retention=capture_retention,
+        on_sweep=lambda seconds: stage_seconds.observe(seconds, stage="capture_sweep"),
+    )
+
+    # Every fresh identification, written in batches by a background thread (started in main())
+    detection_history = DetectionHistory(
+        HISTORY_DB, batch_size=HISTORY_BATCH_SIZE, flush_interval=HISTORY_FLUSH_INTERVAL
+    ) if HISTORY_DB else None
+
+    # One long-lived stream decoder process per camera, started in main()
+    cameras = {
+        camera_id: CameraProcess(camera_id, url, buffer_size=STREAM_BUFFER_SIZE, max_frame_size=CAMERA_MAX_FRAME)
+        for camera_id, url in CAMERAS.items()
+    }
+
+    # Change detection deciding which stream frames are sent for identification (background model per camera)
+    motion_gates = {
+        camera_id: MotionGate(
+            min_area=MOTION_MIN_AREA,
+            var_threshold=MOTION_VAR_THRESHOLD,
+            cooldown=MOTION_COOLDOWN,
+            mask_regions=parse_mask_regions(MOTION_MASK),
+        )
+        for camera_id in cameras
+    }
+
+    # Birds followed across the automatic detections of each camera
+    trackers = {
+        camera_id: BirdTracker(
+            iou_threshold=TRACK_IOU_THRESHOLD,
+            max_distance=TRACK_MAX_DISTANCE,
+            max_age=TRACK_MAX_AGE,
+            stable_votes=TRACK_STABLE_VOTES,
+            reidentify_after=TRACK_REIDENTIFY_AFTER,
+            coarse_coverage=TRACK_COARSE_COVERAGE,
+        )
+        for camera_id in cameras
+    }
+
+    # Coalesces analyses running at the same time into multi-image requests, one scheduler per priority
+    batch_schedulers = {
+        priority: BatchScheduler(send_analysis_batch, max_batch_size=BATCH_MAX_SIZE, window=BATCH_WINDOW)
+        for priority in (INTERACTIVE, BACKGROUND)
+    }
+
+    # Fair work queue in front of the vision API, started in main(); user analyses go before automatic ones
+    analysis_queue = AnalysisQueue(
+        analyze_job,
+        concurrency=ANALYSIS_CONCURRENCY,
+        max_size=ANALYSIS_QUEUE_SIZE,
+        max_per_client=ANALYSIS_QUEUE_PER_CLIENT,
+        reserved_workers=ANALYSIS_RESERVED_WORKERS,
+    )
 
 async def main():
     """Start WebSocket server"""
-    # Start WebSocket server with increased message size limit (10MB for base64 images)
+    # Keep every stream open in its own decoder process so captures are instantaneous
+    for camera in cameras.values():
+        camera.start()
+    start_background_task(supervise_cameras(), "camera_supervisor")
+
+    # Start the analysis workers
+    analysis_queue.start()
+
+    # Detection history writer
+    if detection_history is not None:
+        detection_history.start()
+
+    # Continuous detection for subscribed clients, one loop per camera
+    for camera_id in cameras:
+        start_background_task(auto_detect_loop(camera_id), f"auto_detect:{camera_id}")
+
+    # Expire idle capture sessions and enforce the disk budget in the background (first pass right away)
+    start_background_task(capture_store.run_sweeper(), "capture_sweeper")
+
+    # Local metrics endpoint
+    if METRICS_PORT:
+        await start_metrics_server(metrics_registry, METRICS_PORT)
+        start_background_task(monitor_event_loop(event_loop_lag), "loop_monitor")
+
+    # Start WebSocket server; messages are capped at the largest upload (base64 in protocol 1) and
+    # only a few are buffered per connection, which bounds the memory a client can hold on the way in
     ws_server = await websockets.serve(
         websocket_handler,
         "0.0.0.0",
         WEBSOCKET_PORT,
-        max_size=10 * 1024 * 1024  # 10MB
+        max_size=UPLOAD_MAX_BYTES * 4 // 3 + 64 * 1024,
+        max_queue=INBOUND_MAX_MESSAGES,
     )
-    print(f"WebSocket server started on port {WEBSOCKET_PORT}")
-    print("Waiting for analyze requests from clients...")
+    log_event("websocket_server_started", port=WEBSOCKET_PORT)
 
     # Keep running
-    await ws_server.wait_closed()
+    try:
+        await ws_server.wait_closed()
+    finally:
+        if detection_history is not None:
+            detection_history.stop()
+        for camera in cameras.values():
+            camera.stop()
 
 if __name__ == "__main__":
     if not ANTHROPIC_API_KEY:
-        print("Error: ANTHROPIC_API_KEY environment variable not set")
+        log_event("missing_api_key", level="error", error="ANTHROPIC_API_KEY environment variable not set")
         exit(1)
 
-    print("Bird Detection Service (On-Demand Mode)")
-    print("=" * 50)
-    print(f"Stream URL: {STREAM_URL}")
-    print(f"WebSocket port: {WEBSOCKET_PORT}")
-    print("=" * 50)
+    setup()
+
+    log_event(
+        "service_starting",
+        mode="on-demand + continuous",
+        cameras=CAMERAS,
+        websocket_port=WEBSOCKET_PORT,
+        metrics_port=METRICS_PORT,
+        prompt_version=PROMPT_VERSION,
+        local_detector=LOCAL_DETECTOR_MODEL or None,
+        prompt_characters=len(IDENTIFICATION_GUIDE),
+        analysis_concurrency=ANALYSIS_CONCURRENCY,
+        queue_size=ANALYSIS_QUEUE_SIZE,
+        batch_max_size=BATCH_MAX_SIZE,
+        batch_window=BATCH_WINDOW,
+    )
 
     asyncio.run(main())
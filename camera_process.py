@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Camera Process
+Decodes each camera stream in its own worker process and shares the latest
+frames through shared memory, so decoding uses every core and frames are
+never pickled
+
+Workers are spawned rather than forked, which keeps restarting a dead worker
+safe from the threaded service process. A spawned worker re-imports the
+service's main module, so services build their state behind their __main__
+guard rather than at import time.
+"""
+
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from metrics import configure_logging, log_event
+from stream_grabber import StreamGrabber
+
+_context = multiprocessing.get_context("spawn")
+
+# Shared health values written by the worker
+STATUS_CONNECTED, STATUS_FRAMES_READ, STATUS_RECONNECTS, STATUS_STARTED_AT = range(4)
+LAST_ERROR_SIZE = 256
+
+
+def parse_cameras(spec, default_id, default_url):
+    """Parse "id=url,id=url" into an ordered {camera id: stream url}; one default camera when spec is empty"""
+    cameras = {}
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        camera_id, separator, url = part.partition("=")
+        if not separator or not camera_id.strip() or not url.strip():
+            raise ValueError(f"Invalid camera entry {part!r} (expected id=url)")
+        cameras[camera_id.strip()] = url.strip()
+    return cameras or {default_id: default_url}
+
+
+def parse_frame_size(spec):
+    """Parse "WIDTHxHEIGHT" into (width, height)"""
+    width, _, height = spec.lower().partition("x")
+    return int(width), int(height)
+
+
+class SharedFrameRing:
+    """Ring of fixed-size frame slots in shared memory: one writer process, any number of readers
+
+    The sequence number of the newest frame is published after its pixels and metadata,
+    and readers check it again after copying, so a frame overwritten mid-copy is discarded.
+    """
+
+    def __init__(self, shm, slots, max_width, max_height, sequence, meta):
+        self.shm = shm
+        self.slots = slots
+        self.max_width = max_width
+        self.max_height = max_height
+        self.slot_bytes = max_width * max_height * 3
+        self.sequence = sequence  # Number of frames written so far
+        self.meta = meta  # Per slot: timestamp, height, width
+
+    @classmethod
+    def create(cls, slots, max_width, max_height):
+        shm = shared_memory.SharedMemory(create=True, size=slots * max_width * max_height * 3)
+        return cls(shm, slots, max_width, max_height,
+                   _context.Value("q", 0, lock=False), _context.Array("d", slots * 3, lock=False))
+
+    def _view(self, slot, height, width):
+        return np.ndarray((height, width, 3), np.uint8, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+    def write(self, frame, timestamp):
+        """Publish a BGR frame (writer process only); frames larger than a slot are downscaled"""
+        height, width = frame.shape[:2]
+        if width > self.max_width or height > self.max_height:
+            scale = min(self.max_width / width, self.max_height / height)
+            width, height = max(1, int(width * scale)), max(1, int(height * scale))
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+        sequence = self.sequence.value + 1
+        slot = sequence % self.slots
+        self._view(slot, height, width)[:] = frame
+        self.meta[slot * 3:slot * 3 + 3] = [timestamp, height, width]
+        self.sequence.value = sequence
+
+    def read(self):
+        """Copy of the newest (frame, timestamp), or (None, None) before the first frame"""
+        for _ in range(3):
+            sequence = self.sequence.value
+            if sequence == 0:
+                return None, None
+            slot = sequence % self.slots
+            timestamp, height, width = self.meta[slot * 3:slot * 3 + 3]
+            frame = self._view(slot, int(height), int(width)).copy()
+            if self.sequence.value - sequence < self.slots - 1:
+                return frame, timestamp
+        return None, None
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class _SharedMemoryGrabber(StreamGrabber):
+    """StreamGrabber publishing its frames to a SharedFrameRing instead of a local buffer"""
+
+    def __init__(self, stream_url, ring, **kwargs):
+        super().__init__(stream_url, **kwargs)
+        self.ring = ring
+
+    def _store(self, frame):
+        self.ring.write(frame, time.time())
+        self.frames_read += 1
+
+
+def _run_worker(camera_id, stream_url, shm_name, slots, max_width, max_height, sequence, meta, status, last_error,
+                stop_event):
+    """Worker process: decode the stream until stopped or orphaned, publishing frames and health"""
+    configure_logging(f"camera-{camera_id}")
+    ring = SharedFrameRing(shared_memory.SharedMemory(name=shm_name), slots, max_width, max_height, sequence, meta)
+    grabber = _SharedMemoryGrabber(stream_url, ring)
+    grabber.start()
+    status[STATUS_STARTED_AT] = grabber.started_at
+
+    parent = os.getppid()
+    try:
+        while not stop_event.wait(0.5) and os.getppid() == parent:
+            status[STATUS_CONNECTED] = grabber.connected
+            status[STATUS_FRAMES_READ] = grabber.frames_read
+            status[STATUS_RECONNECTS] = grabber.reconnects
+            last_error.value = (grabber.last_error or "").encode()[:LAST_ERROR_SIZE - 1]
+    finally:
+        grabber.stop()
+        ring.close()
+
+
+class CameraProcess:
+    """Handle on one camera decoded in a worker process, with the StreamGrabber read API"""
+
+    def __init__(self, camera_id, stream_url, buffer_size=5, max_frame_size=(1920, 1080)):
+        self.camera_id = camera_id
+        self.stream_url = stream_url
+        self.buffer_size = buffer_size
+        self.max_width, self.max_height = max_frame_size
+
+        self._ring = None
+        self._process = None
+        self._stop_event = None
+        self._status = None
+        self._last_error = None
+        self.restarts = 0
+
+    def start(self):
+        """Allocate the shared frame ring (once) and spawn the worker process"""
+        if self._ring is None:
+            self._ring = SharedFrameRing.create(max(3, self.buffer_size), self.max_width, self.max_height)
+            self._status = _context.Array("d", 4, lock=False)
+            self._last_error = _context.Array("c", LAST_ERROR_SIZE, lock=False)
+
+        self._stop_event = _context.Event()
+        self._process = _context.Process(
+            target=_run_worker,
+            args=(self.camera_id, self.stream_url, self._ring.shm.name, self._ring.slots, self.max_width,
+                  self.max_height, self._ring.sequence, self._ring.meta, self._status, self._last_error,
+                  self._stop_event),
+            name=f"camera-{self.camera_id}",
+            daemon=True,
+        )
+        self._process.start()
+        log_event("camera_worker_started", camera=self.camera_id, pid=self._process.pid)
+
+    def ensure_running(self):
+        """Restart the worker if it died; returns True if it had to"""
+        if self._process is None or self._process.is_alive():
+            return False
+        log_event("camera_worker_died", level="error", camera=self.camera_id, exitcode=self._process.exitcode)
+        self.restarts += 1
+        self.start()
+        return True
+
+    def stop(self, timeout=5.0):
+        """Stop the worker and release the shared memory"""
+        if self._process is not None:
+            self._stop_event.set()
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+        if self._ring is not None:
+            self._ring.close(unlink=True)
+            self._ring = None
+
+    def latest(self):
+        """Return a copy of the most recent (frame, timestamp), or (None, None) if nothing was read yet"""
+        if self._ring is None:
+            return None, None
+        return self._ring.read()
+
+    def health(self):
+        """Return a JSON-serializable summary of the worker and its stream"""
+        if self._ring is None:
+            return {"camera": self.camera_id, "running": False}
+        sequence = self._ring.sequence.value
+        timestamp = self._ring.meta[(sequence % self._ring.slots) * 3] if sequence else None
+        started_at = self._status[STATUS_STARTED_AT]
+        return {
+            "camera": self.camera_id,
+            "running": self._process is not None and self._process.is_alive(),
+            "pid": self._process.pid if self._process is not None else None,
+            "restarts": self.restarts,
+            "connected": bool(self._status[STATUS_CONNECTED]),
+            "frames_read": int(self._status[STATUS_FRAMES_READ]),
+            "reconnects": int(self._status[STATUS_RECONNECTS]),
+            "last_error": self._last_error.value.decode(errors="replace") or None,
+            "last_frame_age": round(time.time() - timestamp, 3) if timestamp else None,
+            "uptime": round(time.time() - started_at, 1) if started_at else None,
+        }
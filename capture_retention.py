@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Capture Retention
+Keeps the shared capture directory under a disk budget and a maximum age by
+evicting the least recently used captures in batches
+
+Every pass rebuilds its index from the directory (so it survives crashes and
+restarts and sees captures written by the other service), and only one process
+runs a pass at a time. A capture's last use is the mtime of its object file,
+which saving the same image again or reading it refreshes.
+
+Flat *.jpg files left at the top of the directory by earlier versions (one file
+per capture, no session links) are indexed too, with their mtime as last use,
+so they count against the budget and age out like any other capture.
+"""
+
+import fcntl
+import os
+import time
+
+from capture_store import LINK_NAME
+
+
+class RetainedObject:
+    """One stored image and the session links naming it"""
+
+    def __init__(self, capture_id, path, size, last_used):
+        self.id = capture_id
+        self.path = path
+        self.size = size
+        self.last_used = last_used
+        self.links = []
+
+
+def _scan(root, objects_dir, sessions_dir):
+    """Index the directory: ({capture id: RetainedObject}, [(capture id, path)] of links whose object is gone)
+
+    Sessions are listed before objects: an object always exists before its first link,
+    so a link created during the scan can never be mistaken for a stray one.
+    """
+    links = []
+    stray = []
+    try:
+        sessions = list(os.scandir(sessions_dir))
+    except FileNotFoundError:
+        sessions = []
+    for session in sessions:
+        if not session.is_dir():
+            continue
+        try:
+            entries = list(os.scandir(session.path))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            match = LINK_NAME.match(entry.name)
+            if not match:
+                continue
+            try:
+                info = entry.stat()
+            except FileNotFoundError:
+                continue
+            if info.st_nlink == 1:
+                stray.append((match.group(2), entry.path))
+            else:
+                links.append((match.group(2), entry.path))
+
+    index = {}
+    for directory, _, names in os.walk(objects_dir):
+        for name in names:
+            if not name.endswith(".jpg"):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                info = os.stat(path)
+            except FileNotFoundError:
+                continue
+            capture_id = name[:-4]
+            index[capture_id] = RetainedObject(capture_id, path, info.st_size, info.st_mtime)
+
+    # Legacy flat captures, named after their file (never a SHA-256, so no clash with stored objects)
+    try:
+        legacy = list(os.scandir(root))
+    except FileNotFoundError:
+        legacy = []
+    for entry in legacy:
+        if not entry.name.endswith(".jpg") or not entry.is_file():
+            continue
+        try:
+            info = entry.stat()
+        except FileNotFoundError:
+            continue
+        capture_id = entry.name[:-4]
+        index[capture_id] = RetainedObject(capture_id, entry.path, info.st_size, info.st_mtime)
+
+    for capture_id, link in links:
+        if capture_id in index:
+            index[capture_id].links.append(link)
+    return index, stray
+
+
+def _remove(paths):
+    removed = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+class CaptureRetention:
+    """Disk budget and maximum age for the capture directory, enforced by CaptureStore's sweeper"""
+
+    def __init__(self, root, max_bytes=0, max_age=0, low_water=0.9):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.sessions_dir = os.path.join(root, "sessions")
+        self.lock_path = os.path.join(root, ".retention.lock")
+        self.max_bytes = max_bytes  # Disk budget for all captures (0 = unlimited)
+        self.max_age = max_age  # Seconds since last use after which a capture is evicted (0 = forever)
+        self.low_water = low_water  # Over budget, evict down to this fraction of it so passes come in batches
+
+        # Directory state at the last pass
+        self.usage_bytes = 0
+        self.objects = 0
+        self.last_pass = None
+        self.last_pass_seconds = None
+
+        # Counters
+        self.evicted_age = 0
+        self.evicted_budget = 0
+        self.bytes_evicted = 0
+        self.stray_links_removed = 0
+
+    def _select(self, index, now, is_pending):
+        """Objects to evict: those unused for max_age, then the least recently used ones over budget"""
+        candidates = sorted(
+            (item for item in index.values() if not is_pending(item.path)), key=lambda item: item.last_used
+        )
+        expired = [item for item in candidates if self.max_age and now - item.last_used > self.max_age]
+
+        over_budget = []
+        if self.max_bytes:
+            usage = sum(item.size for item in index.values()) - sum(item.size for item in expired)
+            if usage > self.max_bytes:
+                target = self.max_bytes * self.low_water
+                expired_ids = {item.id for item in expired}
+                for item in candidates:
+                    if usage <= target:
+                        break
+                    if item.id not in expired_ids:
+                        over_budget.append(item)
+                        usage -= item.size
+        return expired, over_budget
+
+    def enforce(self, is_pending=lambda path: False):
+        """Run one pass (blocking file work); returns the removed capture IDs, or None if another process holds the lock"""
+        started = time.perf_counter()
+        os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+
+            index, stray = _scan(self.root, self.objects_dir, self.sessions_dir)
+            self.stray_links_removed += _remove(path for _, path in stray)
+
+            expired, over_budget = self._select(index, time.time(), is_pending)
+            for item in expired + over_budget:
+                # Links first: the object's space is only freed once its last name is gone
+                _remove(item.links)
+                _remove([item.path])
+                del index[item.id]
+
+        self.evicted_age += len(expired)
+        self.evicted_budget += len(over_budget)
+        self.bytes_evicted += sum(item.size for item in expired + over_budget)
+        self.usage_bytes = sum(item.size for item in index.values())
+        self.objects = len(index)
+        self.last_pass = time.time()
+        self.last_pass_seconds = time.perf_counter() - started
+        return [item.id for item in expired + over_budget] + [capture_id for capture_id, _ in stray]
+
+    def stats(self):
+        """Return a JSON-serializable summary of disk usage and evictions"""
+        return {
+            "usage_bytes": self.usage_bytes,
+            "objects": self.objects,
+            "max_bytes": self.max_bytes,
+            "max_age": self.max_age,
+            "evicted_age": self.evicted_age,
+            "evicted_budget": self.evicted_budget,
+            "bytes_evicted": self.bytes_evicted,
+            "stray_links_removed": self.stray_links_removed,
+            "last_pass_ms": round(self.last_pass_seconds * 1000, 2) if self.last_pass_seconds is not None else None,
+        }
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Capture Store
+Content-addressed capture storage shared by the WebSocket services, keyed by
+client session tokens that survive reconnects
+
+Layout under the root directory:
+    objects/<2 hex>/<capture id>.jpg      one file per distinct image (SHA-256 name)
+    sessions/<token>/<kind>_<id>.jpg      hard links naming the captures of a session
+
+The file system is the shared index: any process can see a session's captures,
+an object is garbage once no session links to it (link count 1), and a session
+directory's mtime records its last activity in any process. Sessions expire a
+grace period after their last activity instead of when a socket closes; a
+CaptureRetention, if given, also caps disk usage and capture age.
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import secrets
+import shutil
+import time
+
+from metrics import log_event
+
+# Client tokens: URL-safe, long enough not to be guessed
+SESSION_TOKEN = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+CAPTURE_ID = re.compile(r"^[0-9a-f]{32}$")
+LINK_NAME = re.compile(r"^([a-z]+)_([0-9a-f]{32})\.jpg$")
+
+
+def new_session_token():
+    """Random token for clients that do not send their own"""
+    return secrets.token_urlsafe(18)
+
+
+def is_valid_token(token):
+    return isinstance(token, str) and bool(SESSION_TOKEN.match(token))
+
+
+class CaptureInfo:
+    """One capture of a session"""
+
+    def __init__(self, capture_id, kind, path, link, created):
+        self.id = capture_id
+        self.kind = kind  # Service-specific category, e.g. "frame" or "capture"
+        self.path = path  # Content-addressed object file
+        self.link = link  # Hard link in the session directory
+        self.created = created
+
+
+class Session:
+    """In-memory index of one session's captures"""
+
+    def __init__(self, token):
+        self.token = token
+        self.captures = {}  # (kind, capture id) -> CaptureInfo
+        self.connections = 0  # Open sockets of this process using the session
+        self.last_active = time.time()
+
+    def find(self, capture_id):
+        for (_, existing_id), info in self.captures.items():
+            if existing_id == capture_id:
+                return info
+        return None
+
+
+def _list_session(session_dir, objects_dir):
+    """Read a session directory back into (kind, capture id, object path, link path, mtime) tuples"""
+    entries = []
+    try:
+        names = os.listdir(session_dir)
+    except FileNotFoundError:
+        return entries
+    for name in names:
+        match = LINK_NAME.match(name)
+        if not match:
+            continue
+        kind, capture_id = match.groups()
+        link = os.path.join(session_dir, name)
+        try:
+            mtime = os.path.getmtime(link)
+        except OSError:
+            continue
+        entries.append((kind, capture_id, os.path.join(objects_dir, capture_id[:2], f"{capture_id}.jpg"), link, mtime))
+    return entries
+
+
+def _remove_links(links):
+    """Remove session links, then every object left without links; returns (links removed, objects removed)"""
+    removed_links = 0
+    removed_objects = 0
+    for link, object_path in links:
+        try:
+            os.remove(link)
+            removed_links += 1
+        except FileNotFoundError:
+            pass
+        try:
+            if os.stat(object_path).st_nlink == 1:
+                os.remove(object_path)
+                removed_objects += 1
+        except FileNotFoundError:
+            pass
+    return removed_links, removed_objects
+
+
+def _remove_session(session_dir, objects_dir, older_than):
+    """Remove an idle session directory and the objects only it used; returns objects removed
+
+    The mtime is checked again so a session another process just used is left alone.
+    """
+    try:
+        if os.path.getmtime(session_dir) >= older_than:
+            return 0
+    except FileNotFoundError:
+        return 0
+    entries = _list_session(session_dir, objects_dir)
+    _, removed_objects = _remove_links([(link, path) for _, _, path, link, _ in entries])
+    shutil.rmtree(session_dir, ignore_errors=True)
+    return removed_objects
+
+
+def _touch(directory):
+    """Mark a session directory (or a capture, for LRU eviction) as used now"""
+    try:
+        os.utime(directory)
+    except FileNotFoundError:
+        pass
+
+
+def _expired_sessions(sessions_dir, older_than, skip):
+    """Session directories not modified since older_than, except those in skip"""
+    expired = []
+    try:
+        entries = list(os.scandir(sessions_dir))
+    except FileNotFoundError:
+        return expired
+    for entry in entries:
+        if entry.name in skip or not entry.is_dir():
+            continue
+        try:
+            if entry.stat().st_mtime < older_than:
+                expired.append(entry.name)
+        except FileNotFoundError:
+            pass
+    return expired
+
+
+def _orphan_objects(objects_dir, older_than):
+    """Objects no session links to (left behind by a crash between write and link)"""
+    orphans = []
+    for directory, _, names in os.walk(objects_dir):
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                info = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.endswith(".jpg") and info.st_nlink == 1 and info.st_mtime < older_than:
+                orphans.append(path)
+    return orphans
+
+
+class CaptureStore:
+    """Session-keyed, deduplicated capture storage with grace-period expiry"""
+
+    def __init__(self, writer, root="captures", grace_period=600, sweep_interval=60, retention=None, on_sweep=None):
+        self.writer = writer  # CaptureWriter doing the file work off the event loop
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.sessions_dir = os.path.join(root, "sessions")
+        self.grace_period = grace_period
+        self.sweep_interval = sweep_interval
+        self.retention = retention  # Optional CaptureRetention enforced at every sweep
+        self.on_sweep = on_sweep  # Optional callable receiving the duration of each sweep
+
+        self._sessions = {}  # token -> Session
+
+        # Counters
+        self.captures_saved = 0
+        self.duplicates = 0
+        self.sessions_expired = 0
+        self.objects_removed = 0
+
+    def _session_dir(self, token):
+        return os.path.join(self.sessions_dir, token)
+
+    def _object_path(self, capture_id):
+        return os.path.join(self.objects_dir, capture_id[:2], f"{capture_id}.jpg")
+
+    async def attach(self, token):
+        """Start using a session from a connection, loading its captures from disk if needed"""
+        session = self._sessions.get(token)
+        if session is None:
+            session = self._sessions[token] = Session(token)
+            await self._reload(session)
+        session.connections += 1
+        session.last_active = time.time()
+        await self.writer.run(_touch, self._session_dir(token))
+        return session
+
+    def detach(self, token):
+        """A connection stopped using the session; its captures stay until the grace period ends"""
+        session = self._sessions.get(token)
+        if session is not None:
+            session.connections = max(0, session.connections - 1)
+            session.last_active = time.time()
+
+    async def _reload(self, session):
+        """Merge captures saved for the session by any process"""
+        entries = await self.writer.run(_list_session, self._session_dir(session.token), self.objects_dir)
+        for kind, capture_id, path, link, created in entries:
+            session.captures.setdefault((kind, capture_id), CaptureInfo(capture_id, kind, path, link, created))
+
+    def save(self, token, kind, data):
+        """Queue a capture for storage and return its CaptureInfo immediately"""
+        session = self._sessions.get(token) or self._sessions.setdefault(token, Session(token))
+        session.last_active = time.time()
+
+        capture_id = hashlib.sha256(data).hexdigest()[:32]
+        existing = session.captures.get((kind, capture_id))
+        if existing is not None:
+            self.duplicates += 1
+            return existing
+
+        path = self._object_path(capture_id)
+        link = os.path.join(self._session_dir(token), f"{kind}_{capture_id}.jpg")
+        # Write the object once, link it into the session; links also refresh the session's mtime
+        self.writer.save(path, data, link=link)
+
+        info = CaptureInfo(capture_id, kind, path, link, time.time())
+        session.captures[(kind, capture_id)] = info
+        self.captures_saved += 1
+        return info
+
+    async def find(self, token, capture_id):
+        """CaptureInfo of one of the session's captures (saved by any process), or None"""
+        if not isinstance(capture_id, str) or not CAPTURE_ID.match(capture_id):
+            return None
+        session = self._sessions.get(token)
+        if session is None:
+            return None
+        info = session.find(capture_id)
+        if info is None:
+            await self._reload(session)
+            info = session.find(capture_id)
+        if info is not None:
+            # Reading a capture counts as a use for LRU eviction
+            await self.writer.run(_touch, info.path)
+        return info
+
+    def forget(self, capture_ids):
+        """Drop captures removed from disk behind the sessions' back (e.g. evicted) from memory"""
+        capture_ids = set(capture_ids)
+        for session in self._sessions.values():
+            for key in [key for key in session.captures if key[1] in capture_ids]:
+                del session.captures[key]
+
+    async def delete(self, token, kind=None):
+        """Delete the session's captures (only those of one kind, if given); returns the deleted count"""
+        session = self._sessions.get(token)
+        if session is None:
+            return 0
+        await self._reload(session)
+
+        doomed = [info for (capture_kind, _), info in session.captures.items() if kind in (None, capture_kind)]
+        for info in doomed:
+            del session.captures[(info.kind, info.id)]
+        if not doomed:
+            return 0
+
+        await self.writer.wait_for([info.path for info in doomed])
+        removed_links, removed_objects = await self.writer.run(
+            _remove_links, [(info.link, info.path) for info in doomed]
+        )
+        self.objects_removed += removed_objects
+        return removed_links
+
+    async def sweep(self):
+        """Refresh active sessions, expire idle ones, remove orphaned objects and enforce retention"""
+        started = time.perf_counter()
+        now = time.time()
+
+        active = {token for token, session in self._sessions.items() if session.connections > 0}
+        for token in active:
+            await self.writer.run(_touch, self._session_dir(token))
+
+        # Idle sessions are dropped from memory; the disk still has them until they expire
+        for token, session in list(self._sessions.items()):
+            if token not in active and now - session.last_active > self.grace_period:
+                del self._sessions[token]
+
+        # Sessions idle in this process and, per the directory mtime, in every other one
+        expired = await self.writer.run(_expired_sessions, self.sessions_dir, now - self.grace_period, active)
+        for token in expired:
+            self.objects_removed += await self.writer.run(
+                _remove_session, self._session_dir(token), self.objects_dir, now - self.grace_period
+            )
+            self.sessions_expired += 1
+
+        orphans = await self.writer.run(_orphan_objects, self.objects_dir, now - self.grace_period)
+        orphans = [path for path in orphans if not self.writer.is_pending(path)]
+        if orphans:
+            deleted = await self.writer.delete(orphans)
+            self.objects_removed += deleted
+
+        evicted = []
+        if self.retention is not None:
+            # None when the other service is running its pass right now
+            evicted = await self.writer.run(self.retention.enforce, self.writer.is_pending) or []
+            self.forget(evicted)
+
+        seconds = time.perf_counter() - started
+        if self.on_sweep is not None:
+            self.on_sweep(seconds)
+        if expired or orphans or evicted:
+            log_event("capture_sweep", expired_sessions=len(expired), orphans=len(orphans), evicted=len(evicted),
+                      usage_bytes=self.retention.usage_bytes if self.retention else None, seconds=round(seconds, 3))
+
+    async def run_sweeper(self):
+        """Sweep at startup (cleaning up after crashes and restarts), then every sweep_interval seconds"""
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                log_event("capture_sweep_error", level="error", error=str(e))
+            await asyncio.sleep(self.sweep_interval)
+
+    @property
+    def session_count(self):
+        return len(self._sessions)
+
+    def stats(self):
+        """Return a JSON-serializable summary of the store"""
+        return {
+            "sessions": len(self._sessions),
+            "connected_sessions": sum(1 for session in self._sessions.values() if session.connections > 0),
+            "captures_saved": self.captures_saved,
+            "duplicates": self.duplicates,
+            "sessions_expired": self.sessions_expired,
+            "objects_removed": self.objects_removed,
+            "grace_period": self.grace_period,
+            "retention": self.retention.stats() if self.retention else None,
+        }
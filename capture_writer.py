@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Capture Writer
+Validates uploaded JPEGs cheaply and writes/deletes capture files from a thread pool,
+so slow disks never block the asyncio event loop
+"""
+
+import asyncio
+import itertools
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import log_event
+
+# JPEG start-of-frame markers carrying the image dimensions (baseline, progressive, lossless...)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Unique suffix for temporary files written concurrently
+_temp_counter = itertools.count()
+
+
+class InvalidImageError(ValueError):
+    """Raised when uploaded bytes are not a usable JPEG"""
+
+
+def jpeg_dimensions(data):
+    """Return (width, height) of a JPEG by reading its headers only (no decoding)"""
+    if len(data) < 4 or data[0:2] != b"\xff\xd8":
+        raise InvalidImageError("Not a JPEG image (missing SOI marker)")
+
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            raise InvalidImageError(f"Corrupt JPEG header at byte {offset}")
+
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte
+            offset += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            # Markers without a length field
+            offset += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            # End of image or start of scan before any frame header
+            break
+
+        (segment_length,) = struct.unpack(">H", data[offset + 2:offset + 4])
+        if marker in SOF_MARKERS:
+            if offset + 9 > len(data):
+                break
+            height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+            if width == 0 or height == 0:
+                raise InvalidImageError("JPEG has empty dimensions")
+            return width, height
+        offset += 2 + segment_length
+
+    raise InvalidImageError("JPEG has no frame header")
+
+
+def _reuse(filename):
+    """Mark an existing content-addressed file as recently used; False if it does not exist"""
+    try:
+        os.utime(filename)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _write_atomic(filename, data, link=None):
+    """Write data to a temporary file next to filename, then rename it into place; returns (size, seconds)
+
+    With a link path, filename is content-addressed: an existing file is reused (and its
+    mtime refreshed) instead of rewritten, and a hard link to it is created at link.
+    """
+    start = time.perf_counter()
+    directory = os.path.dirname(filename) or "."
+    os.makedirs(directory, exist_ok=True)
+
+    written = 0
+    for _ in range(2):
+        if link is None or not _reuse(filename):
+            temp_filename = f"{filename}.{os.getpid()}.{next(_temp_counter)}.tmp"
+            try:
+                with open(temp_filename, "wb") as f:
+                    f.write(data)
+                os.replace(temp_filename, filename)
+            except OSError:
+                if os.path.exists(temp_filename):
+                    os.remove(temp_filename)
+                raise
+            written = len(data)
+
+        if link is None:
+            break
+        os.makedirs(os.path.dirname(link) or ".", exist_ok=True)
+        try:
+            os.link(filename, link)
+            break
+        except FileExistsError:
+            break
+        except FileNotFoundError:
+            # Garbage-collected by another process between the check and the link: write it again
+            continue
+    return written, time.perf_counter() - start
+
+
+def _delete_files(filenames):
+    """Delete files, returning (deleted count, errors)"""
+    deleted = 0
+    errors = []
+    for filename in filenames:
+        try:
+            os.remove(filename)
+            deleted += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            errors.append(f"{filename}: {e}")
+    return deleted, errors
+
+
+class CaptureWriter:
+    """Thread-pool backed writer for capture files"""
+
+    def __init__(self, max_workers=2, on_write=None):
+        self.on_write = on_write  # Optional callable receiving the duration of each successful write
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="capture-writer")
+        # Maps filename to its pending write future, so deletes wait for in-flight writes
+        self._pending_writes = {}
+
+        # Counters (only updated from the event loop thread)
+        self.files_written = 0
+        self.bytes_written = 0
+        self.files_deleted = 0
+        self.errors = 0
+
+    @property
+    def pending(self):
+        """Number of writes queued or in progress"""
+        return len(self._pending_writes)
+
+    def is_pending(self, filename):
+        """Whether a write of filename is queued or in progress"""
+        return filename in self._pending_writes
+
+    def save(self, filename, data, link=None):
+        """Queue an atomic write of data to filename (see _write_atomic for link) and return its future"""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, _write_atomic, filename, data, link)
+        self._pending_writes[filename] = future
+
+        def on_done(done):
+            if self._pending_writes.get(filename) is done:
+                del self._pending_writes[filename]
+            if done.cancelled():
+                return
+            if done.exception():
+                self.errors += 1
+                log_event("capture_write_error", level="error", filename=filename, error=str(done.exception()))
+                return
+            size, seconds = done.result()
+            self.files_written += 1 if size else 0
+            self.bytes_written += size
+            if self.on_write is not None:
+                self.on_write(seconds)
+
+        future.add_done_callback(on_done)
+        return future
+
+    async def wait_for(self, filenames):
+        """Wait until pending writes of the given files are done"""
+        pending = [self._pending_writes[name] for name in filenames if name in self._pending_writes]
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def delete(self, filenames):
+        """Delete files in a worker thread once their pending writes are done; returns the deleted count"""
+        filenames = list(filenames)
+        if not filenames:
+            return 0
+
+        await self.wait_for(filenames)
+
+        loop = asyncio.get_running_loop()
+        deleted, errors = await loop.run_in_executor(self._executor, _delete_files, filenames)
+
+        self.files_deleted += deleted
+        self.errors += len(errors)
+        for error in errors:
+            log_event("capture_delete_error", level="error", error=error)
+        return deleted
+
+    async def run(self, func, *args):
+        """Run other blocking file work (scans, links) on the writer threads"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def stats(self):
+        """Return a JSON-serializable summary of the writer state"""
+        return {
+            "pending": self.pending,
+            "files_written": self.files_written,
+            "bytes_written": self.bytes_written,
+            "files_deleted": self.files_deleted,
+            "errors": self.errors,
+        }
+
+    def shutdown(self):
+        """Wait for queued writes and stop the worker threads"""
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Connection Limits
+Bounds what a single WebSocket client can make the service hold: replies go
+through a per-connection queue written by its own task, capped in messages
+and bytes, and uploads are rate limited per connection
+
+When a slow client's queue is full, superseded and droppable messages
+(progress updates, automatic detections) are discarded first; a client that
+still cannot keep up with the replies it asked for is disconnected.
+"""
+
+import asyncio
+import time
+from collections import deque
+
+import websockets
+
+# Close code sent to clients whose queue overflowed ("Try Again Later")
+CLOSE_TOO_SLOW = 1013
+
+
+class _Outgoing:
+    """Frames sent back to back (e.g. a JSON header and its JPEG), dropped or replaced as a unit"""
+
+    def __init__(self, frames, key, droppable):
+        self.frames = frames
+        self.size = sum(len(frame) for frame in frames)
+        self.key = key
+        self.droppable = droppable
+
+
+class OutboundQueue:
+    """Bounded send queue of one connection; put() never waits"""
+
+    def __init__(self, websocket, max_messages=64, max_bytes=8 * 1024 * 1024, on_send=None, on_drop=None):
+        self.websocket = websocket
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes  # Queued and in-flight bytes; a single larger message is sent when the queue is empty
+        self.on_send = on_send  # Called with (bytes, seconds) after each message
+        self.on_drop = on_drop  # Called with the reason ("coalesced", "dropped", "overflow") of each discarded message
+
+        self._items = deque()
+        self._bytes = 0
+        self._ready = asyncio.Event()
+        self._task = None
+        self.closed = False
+
+        # Counters
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    @property
+    def depth(self):
+        """Messages waiting to be sent"""
+        return len(self._items)
+
+    @property
+    def bytes(self):
+        """Bytes waiting to be sent or being sent"""
+        return self._bytes
+
+    def start(self):
+        """Spawn the writer task (must be called from the running event loop)"""
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """Discard what is left and stop the writer task"""
+        self.closed = True
+        self._items.clear()
+        self._bytes = 0
+        if self._task is not None:
+            self._task.cancel()
+
+    def _discard(self, reason):
+        if self.on_drop is not None:
+            self.on_drop(reason)
+
+    def _full(self, size):
+        return len(self._items) >= self.max_messages or (self._bytes and self._bytes + size > self.max_bytes)
+
+    def put(self, *frames, key=None, droppable=False):
+        """Queue frames to send back to back; returns False if they were discarded
+
+        A message with a key replaces a queued message with the same key (a newer result
+        supersedes a stale one) and may be dropped, like any droppable message.
+        """
+        if self.closed:
+            return False
+        item = _Outgoing(frames, key, droppable or key is not None)
+
+        if key is not None:
+            for queued in self._items:
+                if queued.key == key:
+                    self._bytes += item.size - queued.size
+                    queued.frames, queued.size = item.frames, item.size
+                    self.coalesced += 1
+                    self._discard("coalesced")
+                    return True
+
+        # Make room by dropping the oldest droppable messages
+        while self._full(item.size):
+            victim = next((queued for queued in self._items if queued.droppable), None)
+            if victim is None:
+                break
+            self._items.remove(victim)
+            self._bytes -= victim.size
+            self.dropped += 1
+            self._discard("dropped")
+
+        if self._full(item.size):
+            self.dropped += 1
+            if item.droppable:
+                self._discard("dropped")
+                return False
+            # The client cannot keep up with its own replies: let it reconnect rather than buffer them
+            self._discard("overflow")
+            self.stop()
+            asyncio.create_task(self.websocket.close(CLOSE_TOO_SLOW, "Send queue full"))
+            return False
+
+        self._items.append(item)
+        self._bytes += item.size
+        self._ready.set()
+        return True
+
+    async def _run(self):
+        while True:
+            if not self._items:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            item = self._items.popleft()
+            started = time.perf_counter()
+            try:
+                for frame in item.frames:
+                    await self.websocket.send(frame)
+            except websockets.ConnectionClosed:
+                return
+            finally:
+                if not self.closed:
+                    self._bytes -= item.size
+            self.sent += 1
+            if self.on_send is not None:
+                self.on_send(item.size, time.perf_counter() - started)
+
+
+class UploadLimiter:
+    """Token bucket on the uploads of one connection: a burst, then uploads_per_minute"""
+
+    def __init__(self, uploads_per_minute=30, burst=5):
+        self.rate = uploads_per_minute / 60
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def acquire(self):
+        """Take one upload; returns 0 if allowed, else the seconds until the next one is"""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate if self.rate else float("inf")
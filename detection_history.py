@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Detection History
+Appends every identification to a local SQLite database (WAL mode) from a
+background writer thread that commits in batches, and answers paginated
+queries and per-species aggregates straight from its indexes
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from metrics import log_event
+
+# Confidence words from the identification prompt, ranked so they can be filtered and indexed
+CONFIDENCE_RANKS = {
+    "élevé": 3, "élevée": 3, "high": 3,
+    "moyen": 2, "moyenne": 2, "medium": 2,
+    "faible": 1, "low": 1,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    camera TEXT NOT NULL,
+    source TEXT NOT NULL,
+    bird_count INTEGER NOT NULL,
+    capture_id TEXT,
+    request_id TEXT
+);
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY,
+    analysis_id INTEGER NOT NULL REFERENCES analyses(id),
+    ts REAL NOT NULL,
+    camera TEXT NOT NULL,
+    species TEXT NOT NULL,
+    scientific_name TEXT,
+    confidence TEXT,
+    confidence_rank INTEGER NOT NULL,
+    bbox TEXT
+);
+CREATE INDEX IF NOT EXISTS analyses_ts ON analyses(ts);
+CREATE INDEX IF NOT EXISTS detections_ts ON detections(ts);
+CREATE INDEX IF NOT EXISTS detections_species_ts ON detections(species, ts);
+CREATE INDEX IF NOT EXISTS detections_camera_ts ON detections(camera, ts);
+CREATE INDEX IF NOT EXISTS detections_confidence_ts ON detections(confidence_rank, ts);
+"""
+
+# Aggregation buckets, in the server's local time
+BUCKETS = {
+    "hour": "%Y-%m-%d %H:00",
+    "day": "%Y-%m-%d",
+}
+
+
+def confidence_rank(confidence):
+    return CONFIDENCE_RANKS.get(str(confidence or "").strip().lower(), 0)
+
+
+def _connect(path):
+    connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+def _where(since=None, until=None, species=None, camera=None, min_confidence=None, before_id=None):
+    """SQL conditions and parameters shared by queries and aggregates"""
+    conditions = []
+    params = []
+    if since is not None:
+        conditions.append("ts >= ?")
+        params.append(float(since))
+    if until is not None:
+        conditions.append("ts < ?")
+        params.append(float(until))
+    if species:
+        conditions.append("species = ?")
+        params.append(str(species))
+    if camera:
+        conditions.append("camera = ?")
+        params.append(str(camera))
+    if min_confidence:
+        conditions.append("confidence_rank >= ?")
+        params.append(confidence_rank(min_confidence) or int(min_confidence))
+    if before_id is not None:
+        conditions.append("id < ?")
+        params.append(int(before_id))
+    return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+
+class DetectionHistory:
+    """SQLite-backed history of detection results with a batched background writer"""
+
+    def __init__(self, path, batch_size=200, flush_interval=1.0, max_pending=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval  # Longest time a result waits before being committed
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._local = threading.local()  # Read connection per query thread
+
+        # Counters
+        self.analyses_written = 0
+        self.detections_written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.last_batch_seconds = None
+
+    def start(self):
+        """Create the schema and start the writer thread"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = _connect(self.path)
+        connection.executescript(SCHEMA)
+        connection.close()
+
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Flush pending results and stop the writer thread"""
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def record(self, result, camera, source, capture_id=None, request_id=None, timestamp=None):
+        """Queue a detection result for writing; never blocks (drops the result if the queue is full)"""
+        birds = [bird for bird in result.get("birds", []) if isinstance(bird, dict)]
+        item = (timestamp or time.time(), camera, source, capture_id, request_id, [
+            (
+                str(bird.get("species") or "Inconnu"),
+                bird.get("scientific_name"),
+                bird.get("confidence"),
+                confidence_rank(bird.get("confidence")),
+                json.dumps(bird["bbox"]) if isinstance(bird.get("bbox"), dict) else None,
+            )
+            for bird in birds
+        ])
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        connection = _connect(self.path)
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            # Gather what else arrives within the flush interval, up to a batch
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            stopping = item is None
+
+            if batch:
+                self._write_batch(connection, batch)
+        connection.close()
+
+    def _write_batch(self, connection, batch):
+        started = time.perf_counter()
+        try:
+            with connection:
+                detections = 0
+                for ts, camera, source, capture_id, request_id, birds in batch:
+                    cursor = connection.execute(
+                        "INSERT INTO analyses (ts, camera, source, bird_count, capture_id, request_id) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (ts, camera, source, len(birds), capture_id, request_id),
+                    )
+                    connection.executemany(
+                        "INSERT INTO detections (analysis_id, ts, camera, species, scientific_name, confidence, "
+                        "confidence_rank, bbox) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(cursor.lastrowid, ts, camera, *bird) for bird in birds],
+                    )
+                    detections += len(birds)
+        except sqlite3.Error as e:
+            log_event("history_write_error", level="error", error=str(e), batch=len(batch))
+            return
+
+        self.batches += 1
+        self.analyses_written += len(batch)
+        self.detections_written += detections
+        self.last_batch_seconds = time.perf_counter() - started
+
+    def _reader(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = _connect(self.path)
+            connection.row_factory = sqlite3.Row
+        return connection
+
+    def query(self, limit=50, before_id=None, **filters):
+        """Most recent detections first; pass the returned next_before_id to get the next page"""
+        limit = max(1, min(int(limit), 500))
+        where, params = _where(before_id=before_id, **filters)
+        rows = self._reader().execute(
+            "SELECT id, ts, camera, species, scientific_name, confidence, bbox, analysis_id FROM detections"
+            f"{where} ORDER BY id DESC LIMIT ?",
+            params + [limit],
+        ).fetchall()
+
+        detections = [{
+            "id": row["id"],
+            "timestamp": datetime.fromtimestamp(row["ts"]).isoformat(),
+            "camera": row["camera"],
+            "species": row["species"],
+            "scientific_name": row["scientific_name"],
+            "confidence": row["confidence"],
+            "bbox": json.loads(row["bbox"]) if row["bbox"] else None,
+            "analysis_id": row["analysis_id"],
+        } for row in rows]
+        return {
+            "detections": detections,
+            "next_before_id": detections[-1]["id"] if len(detections) == limit else None,
+        }
+
+    def aggregate(self, bucket="day", **filters):
+        """Detection counts per species per hour or day, most recent bucket first"""
+        if bucket not in BUCKETS:
+            raise ValueError(f"Unknown bucket {bucket!r} (expected one of {', '.join(BUCKETS)})")
+        where, params = _where(**filters)
+        rows = self._reader().execute(
+            f"SELECT strftime('{BUCKETS[bucket]}', ts, 'unixepoch', 'localtime') AS period, species, "
+            f"COUNT(*) AS count FROM detections{where} GROUP BY period, species ORDER BY period DESC, count DESC",
+            params,
+        ).fetchall()
+        return {
+            "bucket": bucket,
+            "counts": [{"period": row["period"], "species": row["species"], "count": row["count"]} for row in rows],
+        }
+
+    def stats(self):
+        """Return a JSON-serializable summary of the writer"""
+        return {
+            "path": self.path,
+            "pending": self.pending,
+            "analyses_written": self.analyses_written,
+            "detections_written": self.detections_written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "last_batch_ms": round(self.last_batch_seconds * 1000, 2) if self.last_batch_seconds is not None else None,
+        }
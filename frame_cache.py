@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Frame Cache
+Perceptual-hash cache of detection results so near-identical frames skip the vision API
+"""
+
+import copy
+import json
+import time
+from collections import OrderedDict
+
+import cv2
+
+
+def dhash(frame, hash_size=8):
+    """Compute a 64-bit difference hash of an OpenCV frame"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    # One extra column so each row yields hash_size horizontal gradients
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    diff = small[:, 1:] > small[:, :-1]
+
+    value = 0
+    for bit in diff.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two hashes"""
+    return bin(a ^ b).count("1")
+
+
+class FrameCache:
+    """LRU cache of detection results keyed by perceptual hash, with TTL and memory cap"""
+
+    def __init__(self, max_distance=6, ttl=120, max_entries=256, max_bytes=2 * 1024 * 1024,
+                 aspect_tolerance=0.1):
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.aspect_tolerance = aspect_tolerance
+
+        # Maps entry id to (hash, aspect ratio, result, created_at, size), least recently used first
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._bytes = 0
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _aspect(frame):
+        height, width = frame.shape[:2]
+        return width / height if height else 0
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        self._bytes -= entry[4]
+
+    def _expire(self, now):
+        """Drop entries older than the TTL"""
+        for entry_id, entry in list(self._entries.items()):
+            if now - entry[3] > self.ttl:
+                self._remove(entry_id)
+                self.expirations += 1
+
+    def get(self, frame):
+        """Return (frame_hash, cached result or None) for a frame"""
+        frame_hash = dhash(frame)
+        aspect = self._aspect(frame)
+        now = time.time()
+        self._expire(now)
+
+        best_id, best_distance = None, None
+        for entry_id, (entry_hash, entry_aspect, _, _, _) in self._entries.items():
+            if abs(entry_aspect - aspect) > self.aspect_tolerance * max(aspect, entry_aspect):
+                continue
+            distance = hamming_distance(frame_hash, entry_hash)
+            if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                best_id, best_distance = entry_id, distance
+
+        if best_id is None:
+            self.misses += 1
+            return frame_hash, None
+
+        self.hits += 1
+        self._entries.move_to_end(best_id)
+        _, _, result, created_at, _ = self._entries[best_id]
+
+        cached = copy.deepcopy(result)
+        cached["cached"] = True
+        cached["cache_age"] = round(now - created_at, 1)
+        cached["cache_distance"] = best_distance
+        return frame_hash, cached
+
+    def put(self, frame_hash, frame, result):
+        """Store a detection result; results with errors are never cached"""
+        if "error" in result:
+            return
+
+        size = len(json.dumps(result))
+        if size > self.max_bytes:
+            return
+
+        self._entries[self._next_id] = (frame_hash, self._aspect(frame), copy.deepcopy(result), time.time(), size)
+        self._next_id += 1
+        self._bytes += size
+
+        # Evict least recently used entries until within limits
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def stats(self):
+        """Return a JSON-serializable summary of the cache state"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
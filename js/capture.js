@@ -22,6 +22,15 @@ function connectScreenshotWebSocket() {
 
     screenshotWs.onopen = () => {
         console.log('Connected to screenshot service');
+        screenshotWs.send(JSON.stringify({ action: 'session', session: getCaptureSessionToken() }));
+    };
+
+    screenshotWs.onmessage = (event) => {
+        // The capture stays available locally; a refused save is only worth a console note
+        const data = JSON.parse(event.data);
+        if (data.status === 'error') {
+            console.warn('Screenshot service refused the request:', data.error);
+        }
     };
 
     screenshotWs.onerror = (error) => {
@@ -41,6 +41,9 @@ function initializeDetectionToggle() {
             showDetectionUI();
             detectionsDiv.innerHTML = '<div class="no-detection">Cliquer sur "Identifier un oiseau" pour tenter de trouver leur nom</div>';
 
+            // Receive automatic detections triggered by motion on the stream
+            sendWebSocketMessage({ action: 'subscribe', protocol: 2, camera: cameraId });
+
             // Update status text if connected (ws is global from websocket.js)
             if (typeof ws !== 'undefined' && ws.readyState === WebSocket.OPEN) {
                 statusText.textContent = 'Detection Active';
@@ -49,6 +52,9 @@ function initializeDetectionToggle() {
             // Hide detection UI (but keep the status/switch visible)
             hideDetectionUI();
 
+            // Stop receiving automatic detections
+            sendWebSocketMessage({ action: 'unsubscribe' });
+
             // Update status text
             statusText.textContent = 'Détection désactivée';
         }
@@ -4,6 +4,7 @@ let capturedFrameCanvas = null;
 let isDrawing = false;
 let startX, startY, currentX, currentY;
 let selectedRect = null;
+let lastAnalyzedImageUrl = null; // Object URL of the last crop sent for analysis
 
 // Get DOM elements
 const selectionOverlay = document.getElementById('selection-overlay');
@@ -161,16 +162,18 @@ function initializeSelectionButtons() {
         // Apply image enhancements to improve AI recognition
         applyImageEnhancements(croppedCanvas);
 
-        // Convert to base64
-        const frameBase64 = croppedCanvas.toDataURL('image/jpeg', 0.8).split(',')[1];
+        // Encode as JPEG and send the raw bytes (no base64)
+        croppedCanvas.toBlob((blob) => {
+            if (lastAnalyzedImageUrl) {
+                URL.revokeObjectURL(lastAnalyzedImageUrl);
+            }
+            lastAnalyzedImageUrl = URL.createObjectURL(blob);
 
-        console.log(`Sending cropped frame: ${croppedCanvas.width}x${croppedCanvas.height}, size: ${(frameBase64.length / 1024).toFixed(0)}KB`);
+            console.log(`Sending cropped frame: ${croppedCanvas.width}x${croppedCanvas.height}, size: ${(blob.size / 1024).toFixed(0)}KB`);
 
-        // Send analyze request with cropped frame to backend
-        sendWebSocketMessage({
-            action: 'analyze',
-            frame: frameBase64
-        });
+            // Send analyze request with cropped frame to backend
+            sendBinaryWebSocketMessage({ action: 'analyze', protocol: 2, camera: cameraId }, blob);
+        }, 'image/jpeg', 0.8);
 
         // Re-enable button after response (timeout as backup)
         setTimeout(() => {
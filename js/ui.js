@@ -25,12 +25,70 @@ function formatTimestamp(isoString) {
     return date.toLocaleTimeString('fr-FR');
 }
 
+let partialBirds = []; // Birds streamed so far for the analysis in progress
+
 function displayDetections(data) {
     const detectionsDiv = document.getElementById('detections');
     const analyzeButton = document.getElementById('analyze-button');
 
+    // Continuous detection results never touch the manual analysis state, and wait while one is running
+    if (data.mode === 'auto') {
+        if (!analyzeButton.classList.contains('analyzing')) {
+            renderDetectionResult(detectionsDiv, data);
+        }
+        return;
+    }
+
+    // A bird identified before the full reply is ready
+    if (data.status === 'partial') {
+        partialBirds.push(data.bird);
+        const species = partialBirds.map(bird => bird.species || 'Inconnu').join(', ');
+        detectionsDiv.innerHTML = `<div class="analyzing-in-progress">Analyse en cours... ${species}</div>`;
+        return;
+    }
+    partialBirds = [];
+
+    // Analysis is waiting behind other requests on the server
+    if (data.status === 'queued') {
+        detectionsDiv.innerHTML = `<div class="analyzing-in-progress">En attente (position ${data.queue_position})...</div>`;
+        return;
+    }
+
+    // The vision API is rate limited or failed: the server waits, then tries again
+    if (data.status === 'throttled') {
+        detectionsDiv.innerHTML = `<div class="analyzing-in-progress">Limite de requêtes atteinte, attente de ${Math.ceil(data.wait)} s...</div>`;
+        return;
+    }
+    if (data.status === 'retrying') {
+        detectionsDiv.innerHTML = `<div class="analyzing-in-progress">Nouvel essai (${data.attempt}) dans ${Math.ceil(data.retry_in)} s...</div>`;
+        return;
+    }
+
+    // Server refused the analysis because its queue is full
+    if (data.status === 'busy') {
+        analyzeButton.disabled = false;
+        analyzeButton.classList.remove('analyzing');
+        analyzeButton.textContent = '📷 Identifier un oiseau';
+        detectionsDiv.innerHTML = `<div class="no-detection">Service occupé, réessayez dans quelques instants</div>`;
+        return;
+    }
+
+    // Request refused before any analysis (upload too large or too frequent, unknown camera...)
+    if (data.status === 'error') {
+        analyzeButton.disabled = false;
+        analyzeButton.classList.remove('analyzing');
+        analyzeButton.textContent = '📷 Identifier un oiseau';
+        const retry = data.retry_in ? ` (réessayez dans ${Math.ceil(data.retry_in)} s)` : '';
+        detectionsDiv.innerHTML = `<div class="no-detection">Erreur : ${data.error}${retry}</div>`;
+        if (data.action === 'subscribe') {
+            // This page's camera is not served: no automatic detections will come
+            updateDetectionStatus('inactive', 'Caméra inconnue');
+        }
+        return;
+    }
+
     // Ignore status messages (like delete confirmations)
-    if (data.status && !data.birds && !data.count) {
+    if (data.status && data.status !== 'final' && !data.birds && !data.count) {
         return;
     }
 
@@ -42,6 +100,10 @@ function displayDetections(data) {
     // Delete all captures after displaying results
     sendWebSocketMessage({ action: 'delete_captures' });
 
+    renderDetectionResult(detectionsDiv, data);
+}
+
+function renderDetectionResult(detectionsDiv, data) {
     if (data.error) {
         detectionsDiv.innerHTML = `<div class="no-detection">Error: ${data.error} - please retry</div>`;
         return;
@@ -115,9 +177,11 @@ function displayDetections(data) {
         `;
     });
 
-    // Add captured image if available
-    if (data.captured_image) {
-        html += `<img src="${data.captured_image}" alt="Image capturée" class="captured-image">`;
+    // Add captured image if available (protocol 2 replies only carry the capture ID of the uploaded crop)
+    const capturedImage = data.captured_image
+        || (data.capture_id && typeof lastAnalyzedImageUrl !== 'undefined' ? lastAnalyzedImageUrl : null);
+    if (capturedImage) {
+        html += `<img src="${capturedImage}" alt="Image capturée" class="captured-image">`;
     }
 
     // Add reset button
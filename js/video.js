@@ -7,7 +7,11 @@ const HLS_RETRY_DELAY = 5000; // 5 seconds between retries
 
 // Detect if running locally or in production
 const isLocal = ['8080', '8888'].includes(window.location.port);
-const streamUrl = isLocal ? "http://localhost:8080/live/camera/index.m3u8" : "/live/camera/index.m3u8";
+
+// Camera shown by this page (?camera=<id>); undefined lets the detection service use its default camera
+const cameraId = new URLSearchParams(window.location.search).get('camera') || undefined;
+const streamKey = cameraId || 'camera';
+const streamUrl = isLocal ? `http://localhost:8080/live/${streamKey}/index.m3u8` : `/live/${streamKey}/index.m3u8`;
 
 function initializeVideo() {
     const video = document.getElementById('video');
@@ -4,6 +4,20 @@ let ws;
 let reconnectInterval = null;
 let wasConnected = false;
 let isReconnecting = false;
+let pendingBinaryHeader = null; // JSON message waiting for its binary JPEG frame
+let lastBinaryImageUrl = null; // Object URL of the last image received as a binary frame
+
+// Token identifying this tab's captures on both services, kept across reconnects and reloads
+function getCaptureSessionToken() {
+    let token = sessionStorage.getItem('captureSession');
+    if (!token) {
+        const bytes = new Uint8Array(18);
+        crypto.getRandomValues(bytes);
+        token = Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+        sessionStorage.setItem('captureSession', token);
+    }
+    return token;
+}
 
 function connectWebSocket() {
     // Prevent multiple simultaneous connection attempts
@@ -25,10 +39,12 @@ function connectWebSocket() {
         wsUrl = `${wsProtocol}//${wsHost}/ws`;
     }
     ws = new WebSocket(wsUrl);
+    ws.binaryType = 'arraybuffer';
 
     ws.onopen = () => {
         console.log('Connected to bird detection service');
         updateDetectionStatus('active', 'Detection Active');
+        ws.send(JSON.stringify({ action: 'session', session: getCaptureSessionToken() }));
 
         // Clear reconnection interval
         if (reconnectInterval) {
@@ -54,7 +70,26 @@ function connectWebSocket() {
     };
 
     ws.onmessage = (event) => {
+        // Binary frames carry the JPEG announced by the previous JSON message
+        if (event.data instanceof ArrayBuffer) {
+            if (pendingBinaryHeader) {
+                const blob = new Blob([event.data], { type: 'image/jpeg' });
+                if (lastBinaryImageUrl) {
+                    URL.revokeObjectURL(lastBinaryImageUrl);
+                }
+                lastBinaryImageUrl = URL.createObjectURL(blob);
+                pendingBinaryHeader.captured_image = lastBinaryImageUrl;
+                displayDetections(pendingBinaryHeader);
+                pendingBinaryHeader = null;
+            }
+            return;
+        }
+
         const data = JSON.parse(event.data);
+        if (data.binary_follows) {
+            pendingBinaryHeader = data;
+            return;
+        }
         displayDetections(data);
     };
 
@@ -90,9 +125,6 @@ function reinitializeVideoAfterReconnection() {
     // Wait longer for HLS stream to be ready after Docker restart
     let retryCount = 0;
     const maxRetries = 5;
-    const streamUrl = ['8080', '8888'].includes(window.location.port)
-        ? "http://localhost:8080/live/camera/index.m3u8"
-        : "/live/camera/index.m3u8";
 
     const tryReinitVideo = () => {
         retryCount++;
@@ -125,4 +157,12 @@ function sendWebSocketMessage(message) {
     if (ws && ws.readyState === WebSocket.OPEN) {
         ws.send(JSON.stringify(message));
     }
+}
+
+function sendBinaryWebSocketMessage(header, blob) {
+    // Protocol 2: a small JSON header followed by the raw bytes in a binary frame
+    if (ws && ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify({ ...header, binary: true, size: blob.size }));
+        ws.send(blob);
+    }
 }
\ No newline at end of file
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+JSON Extraction
+Brace-balanced, tolerant extraction of JSON objects from model replies, and an
+incremental parser that yields each bird object as soon as it is complete in a
+streamed reply
+
+Examples (run with `python -m doctest json_extract.py`):
+
+>>> extract_json_object('Voici le résultat : {"birds": [{"bbox": {"x": 1}}], "count": 1} Fin.', "birds")
+{'birds': [{'bbox': {'x': 1}}], 'count': 1}
+>>> extract_json_object('```json\\n{"birds": [], "count": 0,}\\n```')
+{'birds': [], 'count': 0}
+>>> extract_json_object('{"note": "accolade } dans une chaîne", "birds": []}', "birds")
+{'note': 'accolade } dans une chaîne', 'birds': []}
+>>> extract_json_object('pas de JSON ici') is None
+True
+>>> parser = IncrementalBirdParser()
+>>> parser.feed('{"birds": [{"species": "Mésange bleue", "bbox": {"x"')
+[]
+>>> parser.feed(': 10}}, {"species": "Sitelle"')
+[{'species': 'Mésange bleue', 'bbox': {'x': 10}}]
+>>> parser.feed('}], "count": 2}')
+[{'species': 'Sitelle'}]
+"""
+
+import json
+import re
+
+# Commas directly before a closing bracket, a common model mistake
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def loads_tolerant(text):
+    """json.loads, retrying once with trailing commas removed; returns None if it still fails"""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(TRAILING_COMMA.sub(r"\1", text))
+    except json.JSONDecodeError:
+        return None
+
+
+def _balanced_end(text, start):
+    """Index of the brace closing the object opened at text[start], ignoring braces inside strings; None if unclosed"""
+    depth = 0
+    in_string = False
+    escaped = False
+
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return index
+    return None
+
+
+def iter_balanced_objects(text):
+    """Yield every {...} substring whose braces balance, outermost and earliest first
+
+    Each opening brace is tried in turn, so a stray brace in the prose before the JSON
+    (which never closes, or closes too early) does not hide the object that follows it.
+    """
+    start = text.find("{")
+    while start != -1:
+        end = _balanced_end(text, start)
+        if end is not None:
+            yield text[start:end + 1]
+        start = text.find("{", start + 1)
+
+
+def extract_json_object(text, required_key=None):
+    """Return the first JSON object in text (containing required_key, if given), or None"""
+    for candidate in iter_balanced_objects(text):
+        value = loads_tolerant(candidate)
+        if isinstance(value, dict) and (required_key is None or required_key in value):
+            return value
+    return None
+
+
+class IncrementalBirdParser:
+    """Scans a streamed reply and returns each element of the "birds" array once it is complete"""
+
+    def __init__(self, array_key="birds"):
+        self.array_key = array_key
+        self.birds = []  # Every complete bird seen so far
+
+        self._buffer = []
+        self._position = 0
+        self._stack = []  # Open containers: "{" or "["
+        self._keys = []  # Last key seen in each open container (None for arrays)
+        self._array_depth = None  # Stack depth of the open birds array
+        self._item_start = None  # Buffer position where the current bird object starts
+
+        self._in_string = False
+        self._escaped = False
+        self._string_chars = []
+        self._last_string = None
+
+    def feed(self, chunk):
+        """Consume a chunk of text; returns the list of bird objects completed by it"""
+        completed = []
+
+        for char in chunk:
+            self._buffer.append(char)
+            position = self._position
+            self._position += 1
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                    self._string_chars.append(char)
+                elif char == "\\":
+                    self._escaped = True
+                    self._string_chars.append(char)
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = "".join(self._string_chars)
+                else:
+                    self._string_chars.append(char)
+                continue
+
+            if char == '"':
+                if self._stack:
+                    self._in_string = True
+                    self._string_chars = []
+            elif char == ":":
+                if self._stack and self._stack[-1] == "{":
+                    self._keys[-1] = self._last_string
+            elif char in "{[":
+                parent_key = self._keys[-1] if self._stack and self._stack[-1] == "{" else None
+                self._stack.append(char)
+                self._keys.append(None)
+
+                if char == "[" and self._array_depth is None and parent_key == self.array_key:
+                    self._array_depth = len(self._stack)
+                elif char == "{" and self._array_depth is not None and len(self._stack) == self._array_depth + 1:
+                    self._item_start = position
+            elif char in "}]" and self._stack:
+                depth = len(self._stack)
+                self._stack.pop()
+                self._keys.pop()
+
+                if char == "}" and self._item_start is not None and depth == self._array_depth + 1:
+                    bird = loads_tolerant("".join(self._buffer[self._item_start:position + 1]))
+                    self._item_start = None
+                    if isinstance(bird, dict):
+                        self.birds.append(bird)
+                        completed.append(bird)
+                elif char == "]" and depth == self._array_depth:
+                    self._array_depth = None
+
+        return completed
+
+    @property
+    def text(self):
+        """Everything fed so far"""
+        return "".join(self._buffer)
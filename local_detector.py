@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Local Detector
+Small CPU object detector (OpenCV DNN) run before the vision model: frames
+without a bird are answered locally, the others are cropped to the birds
+"""
+
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# Class index of "bird" in the COCO label set used by YOLO exports
+COCO_BIRD_CLASS = 14
+
+
+class LocalDetection:
+    """One bird box found by the local detector, in pixels of the analyzed frame"""
+
+    def __init__(self, x, y, width, height, confidence):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.confidence = confidence
+
+    def to_dict(self, frame_width, frame_height):
+        """Box in percentages of the frame, like the bboxes returned by the vision model"""
+        return {
+            "x": round(self.x * 100 / frame_width, 2),
+            "y": round(self.y * 100 / frame_height, 2),
+            "width": round(self.width * 100 / frame_width, 2),
+            "height": round(self.height * 100 / frame_height, 2),
+            "confidence": round(self.confidence, 3),
+        }
+
+
+class LocalDetector:
+    """Base class: counts and times detections; subclasses implement _detect()"""
+
+    def __init__(self, padding=0.3, min_crop=256):
+        self.padding = padding  # Fraction of the bird box added on each side of the crop
+        self.min_crop = min_crop  # Smallest crop side in pixels, so tiny birds keep some context
+
+        self._lock = threading.Lock()  # OpenCV networks are not safe to run from several threads
+
+        # Counters
+        self.frames_examined = 0
+        self.frames_rejected = 0
+        self.birds_found = 0
+        self.total_seconds = 0.0
+        self.last_seconds = None
+
+    def _detect(self, frame):
+        raise NotImplementedError
+
+    def detect(self, frame):
+        """Bird boxes in a BGR frame (empty list when there is no bird)"""
+        started = time.perf_counter()
+        with self._lock:
+            detections = self._detect(frame)
+        elapsed = time.perf_counter() - started
+
+        self.frames_examined += 1
+        self.total_seconds += elapsed
+        self.last_seconds = elapsed
+        self.birds_found += len(detections)
+        if not detections:
+            self.frames_rejected += 1
+        return detections
+
+    def crop_region(self, detections, frame_width, frame_height):
+        """Padded box around every detection, in percentages of the frame (the preprocessor's region format)"""
+        x0 = min(detection.x for detection in detections)
+        y0 = min(detection.y for detection in detections)
+        x1 = max(detection.x + detection.width for detection in detections)
+        y1 = max(detection.y + detection.height for detection in detections)
+
+        pad_x = max((x1 - x0) * self.padding, (self.min_crop - (x1 - x0)) / 2)
+        pad_y = max((y1 - y0) * self.padding, (self.min_crop - (y1 - y0)) / 2)
+        x0 = max(0, x0 - pad_x)
+        y0 = max(0, y0 - pad_y)
+        x1 = min(frame_width, x1 + pad_x)
+        y1 = min(frame_height, y1 + pad_y)
+        return {
+            "x": x0 * 100 / frame_width,
+            "y": y0 * 100 / frame_height,
+            "width": (x1 - x0) * 100 / frame_width,
+            "height": (y1 - y0) * 100 / frame_height,
+        }
+
+    def stats(self):
+        """Return a JSON-serializable summary of the detector counters"""
+        return {
+            "model": self.name,
+            "frames_examined": self.frames_examined,
+            "frames_rejected": self.frames_rejected,
+            "rejection_rate": round(self.frames_rejected / self.frames_examined, 4) if self.frames_examined else None,
+            "birds_found": self.birds_found,
+            "mean_inference_ms": round(self.total_seconds / self.frames_examined * 1000, 2)
+            if self.frames_examined else None,
+            "last_inference_ms": round(self.last_seconds * 1000, 2) if self.last_seconds is not None else None,
+        }
+
+
+class DnnDetector(LocalDetector):
+    """Any model cv2.dnn can read (ONNX, Caffe, TensorFlow, Darknet), with YOLO or SSD style outputs
+
+    YOLO outputs are (1, boxes, 5 + classes) for v5 exports and (1, 4 + classes, boxes)
+    for v8 exports; SSD outputs are (1, 1, boxes, 7) with normalized corners.
+    """
+
+    def __init__(self, model_path, config_path="", bird_class=COCO_BIRD_CLASS, confidence=0.35, nms_threshold=0.45,
+                 input_size=640, scale=1 / 255, mean=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.name = model_path
+        self.bird_class = bird_class
+        self.confidence = confidence
+        self.nms_threshold = nms_threshold
+        self.input_size = input_size
+        self.scale = scale
+        self.mean = mean
+
+        self._net = cv2.dnn.readNet(model_path, config_path)
+        self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+    def _detect(self, frame):
+        height, width = frame.shape[:2]
+        blob = cv2.dnn.blobFromImage(frame, self.scale, (self.input_size, self.input_size),
+                                     (self.mean, self.mean, self.mean), swapRB=True, crop=False)
+        self._net.setInput(blob)
+        output = self._net.forward()
+
+        if output.ndim == 4 and output.shape[-1] == 7:
+            boxes, scores = self._parse_ssd(output.reshape(-1, 7), width, height)
+        else:
+            boxes, scores = self._parse_yolo(output, width, height)
+        if not boxes:
+            return []
+
+        keep = cv2.dnn.NMSBoxes(boxes, scores, self.confidence, self.nms_threshold)
+        return [LocalDetection(*boxes[i], scores[i]) for i in np.array(keep).flatten()]
+
+    def _parse_ssd(self, rows, width, height):
+        boxes = []
+        scores = []
+        for _, class_id, score, x0, y0, x1, y1 in rows:
+            if int(class_id) != self.bird_class or score < self.confidence:
+                continue
+            boxes.append([int(x0 * width), int(y0 * height), int((x1 - x0) * width), int((y1 - y0) * height)])
+            scores.append(float(score))
+        return boxes, scores
+
+    def _parse_yolo(self, output, width, height):
+        rows = output[0]
+        has_objectness = True
+        if rows.shape[0] < rows.shape[1]:
+            # v8 layout: one column per candidate box and no objectness score
+            rows = rows.T
+            has_objectness = False
+
+        class_offset = 5 if has_objectness else 4
+        scores = rows[:, class_offset + self.bird_class]
+        if has_objectness:
+            scores = scores * rows[:, 4]
+        candidates = np.flatnonzero(scores >= self.confidence)
+
+        x_factor = width / self.input_size
+        y_factor = height / self.input_size
+        boxes = []
+        for i in candidates:
+            center_x, center_y, box_width, box_height = rows[i, :4]
+            boxes.append([
+                int((center_x - box_width / 2) * x_factor),
+                int((center_y - box_height / 2) * y_factor),
+                int(box_width * x_factor),
+                int(box_height * y_factor),
+            ])
+        return boxes, [float(scores[i]) for i in candidates]
+
+
+class DarkBlobDetector(LocalDetector):
+    """Offline stand-in for a real model: reports dark blobs on a brighter background as birds
+
+    Good enough for the synthetic stream in bench/ and for tests; not for real footage.
+    """
+
+    name = "stub"
+
+    def __init__(self, threshold=55, min_area=0.0002, max_area=0.2, processing_width=320, **kwargs):
+        super().__init__(**kwargs)
+        self.threshold = threshold  # Gray level below which a pixel counts as dark
+        self.min_area = min_area  # Blob area limits, as fractions of the frame
+        self.max_area = max_area
+        self.processing_width = processing_width
+
+    def _detect(self, frame):
+        height, width = frame.shape[:2]
+        scale = min(1.0, self.processing_width / width)
+        small = cv2.resize(frame, (max(1, int(width * scale)), max(1, int(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        _, dark = cv2.threshold(small, self.threshold, 255, cv2.THRESH_BINARY_INV)
+        count, _, blobs, _ = cv2.connectedComponentsWithStats(dark)
+        area = small.shape[0] * small.shape[1]
+
+        detections = []
+        for x, y, blob_width, blob_height, pixels in blobs[1:count]:
+            if self.min_area * area <= pixels <= self.max_area * area:
+                detections.append(LocalDetection(
+                    x / scale, y / scale, blob_width / scale, blob_height / scale, pixels / (blob_width * blob_height)
+                ))
+        return detections
+
+
+def load_detector(model_path, **options):
+    """DarkBlobDetector for "stub", otherwise a DnnDetector reading the model file"""
+    if model_path == "stub":
+        return DarkBlobDetector(padding=options.get("padding", 0.3), min_crop=options.get("min_crop", 256))
+    return DnnDetector(model_path, **options)
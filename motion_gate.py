@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Motion Gate
+Cheap CPU-side change detection deciding which frames are worth sending for identification
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+
+def parse_mask_regions(spec):
+    """Parse "x,y,w,h;x,y,w,h" (percentages of the frame) into a list of region dicts"""
+    regions = []
+    if not spec:
+        return regions
+
+    for part in spec.split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        x, y, width, height = (float(value) for value in part.split(","))
+        regions.append({"x": x, "y": y, "width": width, "height": height})
+    return regions
+
+
+class MotionGate:
+    """MOG2 background subtraction on downscaled frames, with ignore regions and a cooldown"""
+
+    def __init__(self, min_area=0.002, var_threshold=16, history=300, cooldown=5.0,
+                 mask_regions=None, processing_width=320, warmup_frames=25):
+        self.min_area = min_area  # Fraction of the frame that must change to trigger
+        self.cooldown = cooldown  # Minimum seconds between two forwarded frames
+        self.mask_regions = mask_regions or []
+        self.processing_width = processing_width
+        self.warmup_frames = warmup_frames  # Frames used to learn the background before triggering
+
+        self._subtractor = cv2.createBackgroundSubtractorMOG2(
+            history=history, varThreshold=var_threshold, detectShadows=False
+        )
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        self._mask = None
+        self._mask_shape = None
+        self._last_forwarded = 0
+
+        # Counters
+        self.frames_examined = 0
+        self.frames_with_motion = 0
+        self.frames_forwarded = 0
+
+    def _build_mask(self, shape):
+        """Build the binary mask of pixels to consider (255) vs ignore (0)"""
+        height, width = shape
+        mask = np.full((height, width), 255, np.uint8)
+        for region in self.mask_regions:
+            x = int(region["x"] * width / 100)
+            y = int(region["y"] * height / 100)
+            x2 = int((region["x"] + region["width"]) * width / 100)
+            y2 = int((region["y"] + region["height"]) * height / 100)
+            mask[y:y2, x:x2] = 0
+        return mask
+
+    def process(self, frame):
+        """Feed a frame; returns the motion bbox in percentages if the frame should be forwarded, else None"""
+        self.frames_examined += 1
+
+        height, width = frame.shape[:2]
+        scale = min(1.0, self.processing_width / width)
+        small = cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(small, (5, 5), 0)
+
+        foreground = self._subtractor.apply(small)
+        if self.mask_regions:
+            if self._mask_shape != foreground.shape:
+                self._mask = self._build_mask(foreground.shape)
+                self._mask_shape = foreground.shape
+            foreground = cv2.bitwise_and(foreground, self._mask)
+
+        # Remove isolated noise pixels before measuring the changed area
+        foreground = cv2.morphologyEx(foreground, cv2.MORPH_OPEN, self._kernel)
+        if self.frames_examined <= self.warmup_frames:
+            return None
+
+        changed = cv2.countNonZero(foreground)
+        if changed < self.min_area * foreground.size:
+            return None
+
+        self.frames_with_motion += 1
+        now = time.time()
+        if now - self._last_forwarded < self.cooldown:
+            return None
+
+        self._last_forwarded = now
+        self.frames_forwarded += 1
+
+        small_height, small_width = foreground.shape
+        x, y, box_width, box_height = cv2.boundingRect(foreground)
+        return {
+            "x": x * 100 / small_width,
+            "y": y * 100 / small_height,
+            "width": box_width * 100 / small_width,
+            "height": box_height * 100 / small_height,
+        }
+
+    def stats(self):
+        """Return a JSON-serializable summary of the gate counters"""
+        return {
+            "frames_examined": self.frames_examined,
+            "frames_with_motion": self.frames_with_motion,
+            "frames_forwarded": self.frames_forwarded,
+            "forward_rate": round(self.frames_forwarded / self.frames_examined, 4) if self.frames_examined else None,
+        }
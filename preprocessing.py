@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Frame Preprocessing
+Shrinks frames before they are sent to the vision model and maps the returned
+bounding boxes back to the original frame coordinates
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+from capture_writer import jpeg_dimensions
+
+
+class PreparedImage:
+    """JPEG ready for the vision model, plus what is needed to map results back"""
+
+    def __init__(self, jpeg, original_size, region, bytes_in, timings):
+        self.jpeg = jpeg
+        self.original_size = original_size  # (width, height) of the source frame
+        self.region = region  # (x, y, width, height) of the source frame that was kept, in pixels
+        self.bytes_in = bytes_in
+        self.timings = timings  # Milliseconds per stage
+
+    @property
+    def bytes_out(self):
+        return len(self.jpeg)
+
+    def map_bbox(self, bbox):
+        """Convert a bbox in percentages of the prepared image to percentages of the original frame"""
+        frame_width, frame_height = self.original_size
+        region_x, region_y, region_width, region_height = self.region
+        return {
+            "x": (region_x + bbox["x"] * region_width / 100) * 100 / frame_width,
+            "y": (region_y + bbox["y"] * region_height / 100) * 100 / frame_height,
+            "width": bbox["width"] * region_width / frame_width,
+            "height": bbox["height"] * region_height / frame_height,
+        }
+
+    def map_result(self, result):
+        """Rewrite the bbox of every bird in a detection result to original frame coordinates"""
+        for bird in result.get("birds", []):
+            bbox = bird.get("bbox")
+            if not isinstance(bbox, dict):
+                continue
+            try:
+                bird["bbox"] = self.map_bbox({key: float(bbox[key]) for key in ("x", "y", "width", "height")})
+            except (KeyError, TypeError, ValueError):
+                continue
+        return result
+
+    def summary(self):
+        """Return a JSON-serializable description of what preprocessing did"""
+        return {
+            "original_size": list(self.original_size),
+            "region": list(self.region),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out if self.bytes_in else 0,
+            "timings_ms": self.timings,
+        }
+
+
+class FramePreprocessor:
+    """Configurable pipeline: auto-crop, resize, denoise, sharpen, JPEG encode"""
+
+    def __init__(self, max_long_edge=1280, jpeg_quality=85, auto_crop=False, crop_padding=0.25,
+                 denoise=False, sharpen=False):
+        self.max_long_edge = max_long_edge
+        self.jpeg_quality = jpeg_quality
+        self.auto_crop = auto_crop
+        self.crop_padding = crop_padding  # Fraction of the motion box added on each side
+        self.denoise = denoise
+        self.sharpen = sharpen
+
+        # Totals across all processed images
+        self.images_processed = 0
+        self.images_passed_through = 0
+        self.total_bytes_in = 0
+        self.total_bytes_out = 0
+
+    def _needs_processing(self, width, height, motion_region, crop_region):
+        """Whether the image must be decoded and re-encoded at all"""
+        return (
+            max(width, height) > self.max_long_edge
+            or (self.auto_crop and motion_region is not None)
+            or crop_region is not None
+            or self.denoise
+            or self.sharpen
+        )
+
+    def _crop_region(self, width, height, motion_region, crop_region=None):
+        """Pixel region to keep: the given crop, the padded motion box, or the whole frame"""
+        if crop_region:
+            box, padding = crop_region, 0
+        elif self.auto_crop and motion_region:
+            box, padding = motion_region, self.crop_padding
+        else:
+            return 0, 0, width, height
+
+        box_x = box["x"] * width / 100
+        box_y = box["y"] * height / 100
+        box_width = box["width"] * width / 100
+        box_height = box["height"] * height / 100
+        pad_x = box_width * padding
+        pad_y = box_height * padding
+
+        x0 = max(0, int(box_x - pad_x))
+        y0 = max(0, int(box_y - pad_y))
+        x1 = min(width, int(box_x + box_width + pad_x))
+        y1 = min(height, int(box_y + box_height + pad_y))
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            return 0, 0, width, height
+        return x0, y0, x1 - x0, y1 - y0
+
+    def process(self, frame=None, jpeg_bytes=None, motion_region=None, crop_region=None):
+        """Prepare a frame (OpenCV array and/or JPEG bytes) for the vision model
+
+        crop_region (percentages, already padded) is always applied, even with auto-crop off.
+        """
+        timings = {}
+        bytes_in = len(jpeg_bytes) if jpeg_bytes is not None else 0
+
+        if frame is not None:
+            height, width = frame.shape[:2]
+        else:
+            width, height = jpeg_dimensions(jpeg_bytes)
+
+        # Already small enough: send the original bytes untouched
+        if jpeg_bytes is not None and not self._needs_processing(width, height, motion_region, crop_region):
+            self.images_passed_through += 1
+            self._account(bytes_in, bytes_in)
+            return PreparedImage(jpeg_bytes, (width, height), (0, 0, width, height), bytes_in, timings)
+
+        if frame is None:
+            start = time.perf_counter()
+            frame = cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), cv2.IMREAD_COLOR)
+            timings["decode"] = round((time.perf_counter() - start) * 1000, 2)
+            if frame is None:
+                raise ValueError("Could not decode image")
+
+        region = self._crop_region(width, height, motion_region, crop_region)
+        x, y, region_width, region_height = region
+        if region != (0, 0, width, height):
+            start = time.perf_counter()
+            frame = frame[y:y + region_height, x:x + region_width]
+            timings["crop"] = round((time.perf_counter() - start) * 1000, 2)
+
+        scale = self.max_long_edge / max(region_width, region_height)
+        if scale < 1:
+            start = time.perf_counter()
+            frame = cv2.resize(frame, (max(1, int(region_width * scale)), max(1, int(region_height * scale))),
+                               interpolation=cv2.INTER_AREA)
+            timings["resize"] = round((time.perf_counter() - start) * 1000, 2)
+
+        if self.denoise:
+            start = time.perf_counter()
+            frame = cv2.fastNlMeansDenoisingColored(frame, None, 3, 3, 7, 21)
+            timings["denoise"] = round((time.perf_counter() - start) * 1000, 2)
+
+        if self.sharpen:
+            start = time.perf_counter()
+            blurred = cv2.GaussianBlur(frame, (0, 0), 2)
+            frame = cv2.addWeighted(frame, 1.5, blurred, -0.5, 0)
+            timings["sharpen"] = round((time.perf_counter() - start) * 1000, 2)
+
+        start = time.perf_counter()
+        _, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        jpeg = buffer.tobytes()
+        timings["encode"] = round((time.perf_counter() - start) * 1000, 2)
+
+        self.images_processed += 1
+        self._account(bytes_in, len(jpeg))
+        return PreparedImage(jpeg, (width, height), region, bytes_in, timings)
+
+    def _account(self, bytes_in, bytes_out):
+        self.total_bytes_in += bytes_in
+        self.total_bytes_out += bytes_out
+
+    def stats(self):
+        """Return a JSON-serializable summary of the preprocessing totals"""
+        return {
+            "images_processed": self.images_processed,
+            "images_passed_through": self.images_passed_through,
+            "bytes_in": self.total_bytes_in,
+            "bytes_out": self.total_bytes_out,
+            "bytes_saved": self.total_bytes_in - self.total_bytes_out,
+        }
@@ -4,142 +4,254 @@ Screenshot Service
 Handles image capture and storage for users
 """
 
-import cv2
 import base64
 import json
+import os
+import time
 import asyncio
 import websockets
-import os
-from datetime import datetime
+from capture_writer import CaptureWriter, jpeg_dimensions
+from capture_store import CaptureStore, is_valid_token, new_session_token
+from capture_retention import CaptureRetention
+from connection_limits import OutboundQueue, UploadLimiter
+from metrics import (
+    MetricsRegistry, configure_logging, log_event, monitor_event_loop, new_request_id, register_process_metrics,
+    start_background_task, start_metrics_server
+)
 
 # Configuration
-WEBSOCKET_PORT = 8766  # Different port from bird detector
+WEBSOCKET_PORT = int(os.getenv("WEBSOCKET_PORT", "8766"))  # Different port from bird detector
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9101"))  # Local Prometheus endpoint (0 disables it)
+CAPTURES_DIR = os.getenv("CAPTURES_DIR", "captures")  # Shared with the bird detector
+CAPTURE_GRACE_PERIOD = int(os.getenv("CAPTURE_GRACE_PERIOD", "600"))  # Seconds a session's captures outlive its last activity
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", str(1024 * 1024 * 1024)))  # Disk budget of the captures directory (0 = unlimited)
+CAPTURE_MAX_AGE = int(os.getenv("CAPTURE_MAX_AGE", "86400"))  # Seconds since last use after which a capture is evicted (0 = never)
+CAPTURE_SWEEP_INTERVAL = int(os.getenv("CAPTURE_SWEEP_INTERVAL", "60"))  # Seconds between expiry/retention passes
+OUTBOUND_MAX_MESSAGES = int(os.getenv("OUTBOUND_MAX_MESSAGES", "64"))  # Replies queued for a slow client before it is disconnected
+OUTBOUND_MAX_BYTES = int(os.getenv("OUTBOUND_MAX_BYTES", str(1024 * 1024)))  # Same, in bytes (replies are small JSON)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(4 * 1024 * 1024)))  # Largest JPEG a client may upload
+UPLOAD_RATE_PER_MINUTE = float(os.getenv("UPLOAD_RATE_PER_MINUTE", "30"))  # Sustained uploads per connection
+UPLOAD_BURST = int(os.getenv("UPLOAD_BURST", "5"))  # Uploads a connection may send back to back
+INBOUND_MAX_MESSAGES = int(os.getenv("INBOUND_MAX_MESSAGES", "4"))  # Received messages buffered per connection
+
+configure_logging("screenshot")
 
-# Store connected WebSocket clients and their captures
+# Store connected WebSocket clients and their sessions
 connected_clients = set()
-user_captures = {}  # Maps websocket to list of their capture filenames
+client_sessions = {}  # Maps websocket to the session token its captures are stored under
+outbound_queues = {}  # Maps websocket to the queue its replies are sent from
+upload_limiters = {}  # Maps websocket to its upload rate limit
 
-async def handle_save_capture(websocket, image_base64):
-    """Save a captured image from the user"""
-    try:
-        # Decode base64 to image
-        import numpy as np
-        nparr = np.frombuffer(base64.b64decode(image_base64), np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+# Instrumentation, served on METRICS_PORT
+metrics_registry = MetricsRegistry()
+stage_seconds = metrics_registry.histogram(
+    "screenshot_stage_seconds", "Duration of each stage of a save request", ("stage",)
+)
+save_requests = metrics_registry.counter("screenshot_save_requests_total", "Save requests by outcome", ("outcome",))
+bytes_received = metrics_registry.counter("screenshot_bytes_in_total", "Bytes received from WebSocket clients")
+bytes_sent = metrics_registry.counter("screenshot_bytes_out_total", "Bytes sent to WebSocket clients")
+outbound_discarded = metrics_registry.counter(
+    "screenshot_outbound_discarded_total", "Replies not sent to slow clients", ("reason",)
+)
+metrics_registry.gauge("screenshot_connected_clients", "Connected WebSocket clients",
+                       function=lambda: len(connected_clients))
+metrics_registry.gauge("screenshot_outbound_messages", "Replies waiting in the per-connection send queues",
+                       function=lambda: sum(queue.depth for queue in outbound_queues.values()))
+metrics_registry.gauge("screenshot_outbound_bytes", "Bytes held by the per-connection send queues",
+                       function=lambda: sum(queue.bytes for queue in outbound_queues.values()))
+metrics_registry.gauge("screenshot_pending_writes", "Capture writes queued or in progress",
+                       function=lambda: capture_writer.pending)
+metrics_registry.gauge("screenshot_capture_disk_bytes", "Size of the captures directory at the last retention pass",
+                       function=lambda: capture_retention.usage_bytes)
+metrics_registry.gauge("screenshot_capture_evictions", "Captures evicted for age or disk budget since start",
+                       function=lambda: capture_retention.evicted_age + capture_retention.evicted_budget)
+event_loop_lag = register_process_metrics(metrics_registry, "screenshot")
 
-        if frame is None:
-            raise ValueError("Failed to decode image")
+# Writes and deletes capture files off the event loop
+capture_writer = CaptureWriter(on_write=lambda seconds: stage_seconds.observe(seconds, stage="disk_write"))
 
-        # Generate unique identifier for this user and capture
-        user_id = id(websocket)
-        timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]  # Include milliseconds
-        capture_filename = f"captures/user_{user_id}_capture_{timestamp_str}.jpg"
+# Disk budget and maximum age of the captures directory, shared with the other service
+capture_retention = CaptureRetention(CAPTURES_DIR, max_bytes=CAPTURE_MAX_BYTES, max_age=CAPTURE_MAX_AGE)
 
-        # Create captures directory if it doesn't exist
-        os.makedirs("captures", exist_ok=True)
+# Session-keyed, content-addressed captures (screenshots are stored as kind "capture")
+capture_store = CaptureStore(
+    capture_writer,
+    root=CAPTURES_DIR,
+    grace_period=CAPTURE_GRACE_PERIOD,
+    sweep_interval=CAPTURE_SWEEP_INTERVAL,
+    retention=capture_retention,
+    on_sweep=lambda seconds: stage_seconds.observe(seconds, stage="capture_sweep"),
+)
 
-        # Save the image
-        cv2.imwrite(capture_filename, frame)
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] Capture saved: {capture_filename}")
+def record_send(size, seconds):
+    """Account for a message written by a connection's writer task"""
+    bytes_sent.inc(size)
+    stage_seconds.observe(seconds, stage="send")
 
-        # Track this capture for this user
-        if websocket not in user_captures:
-            user_captures[websocket] = []
-        user_captures[websocket].append(capture_filename)
+def send_message(websocket, message):
+    """Queue a message for the client's writer task (never waits)"""
+    queue = outbound_queues.get(websocket)
+    return queue is not None and queue.put(message)
+
+def check_upload(websocket, size, request_id=None):
+    """Apply the upload size and rate limits; sends the error and returns False when the upload is refused"""
+    if size > UPLOAD_MAX_BYTES:
+        save_requests.inc(outcome="too_large")
+        error, retry_in = f"Image too large ({size} bytes, max {UPLOAD_MAX_BYTES})", None
+    else:
+        retry_in = upload_limiters[websocket].acquire()
+        if not retry_in:
+            return True
+        save_requests.inc(outcome="rate_limited")
+        error = "Too many uploads, slow down"
+
+    log_event("upload_refused", level="warning", user=id(websocket), request_id=request_id, size=size, error=error)
+    send_message(websocket, json.dumps({
+        "status": "error",
+        "error": error,
+        "retry_in": round(retry_in, 1) if retry_in else None,
+        "request_id": request_id
+    }))
+    return False
+
+async def handle_save_capture(websocket, image_base64, request_id=None):
+    """Save a captured image from the user"""
+    request_id = request_id or new_request_id()
+    request_started = time.perf_counter()
+    try:
+        # Decode base64 and check the JPEG headers (the image itself is stored as-is)
+        with stage_seconds.time(stage="decode"):
+            image_bytes = base64.b64decode(image_base64)
+        with stage_seconds.time(stage="validate"):
+            width, height = jpeg_dimensions(image_bytes)
+
+        # Queue the original bytes for storage in the user's session; the write happens in the background
+        with stage_seconds.time(stage="write_queue"):
+            capture = capture_store.save(client_sessions[websocket], "capture", image_bytes)
+        log_event("capture_queued", request_id=request_id, capture_id=capture.id,
+                  width=width, height=height, bytes=len(image_bytes))
 
         # Send confirmation to client
-        await websocket.send(json.dumps({
+        send_message(websocket, json.dumps({
             "status": "saved",
-            "filename": capture_filename
+            "filename": capture.path,
+            "capture_id": capture.id,
+            "request_id": request_id
         }))
+        save_requests.inc(outcome="ok")
+        stage_seconds.observe(time.perf_counter() - request_started, stage="total")
 
     except Exception as e:
-        print(f"Error saving capture: {e}")
-        await websocket.send(json.dumps({
+        save_requests.inc(outcome="error")
+        log_event("capture_save_error", level="error", request_id=request_id, error=str(e))
+        send_message(websocket, json.dumps({
             "status": "error",
-            "error": str(e)
+            "error": str(e),
+            "request_id": request_id
         }))
 
 async def handle_delete_captures(websocket):
-    """Delete all captures for a specific user"""
-    if websocket not in user_captures:
-        return
-
-    deleted_count = 0
-    for filename in user_captures[websocket]:
-        try:
-            if os.path.exists(filename):
-                os.remove(filename)
-                deleted_count += 1
-                print(f"[{datetime.now().strftime('%H:%M:%S')}] Deleted: {filename}")
-        except Exception as e:
-            print(f"Error deleting {filename}: {e}")
+    """Delete the screenshots of the user's session (analyzed frames are left to the bird detector)"""
+    deleted_count = await capture_store.delete(client_sessions[websocket], kind="capture")
+    log_event("captures_deleted", user=id(websocket), count=deleted_count)
 
-    # Clear the list
-    user_captures[websocket] = []
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] Deleted {deleted_count} files for user {id(websocket)}")
+async def set_session(websocket, token):
+    """Move a connection to another capture session (e.g. the one it used before reconnecting)"""
+    previous = client_sessions.get(websocket)
+    if previous == token:
+        return
+    await capture_store.attach(token)
+    client_sessions[websocket] = token
+    if previous is not None:
+        capture_store.detach(previous)
 
 async def websocket_handler(websocket):
     """Handle WebSocket connections and messages"""
     connected_clients.add(websocket)
-    user_captures[websocket] = []  # Initialize empty capture list for this user
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] Screenshot client connected. Total clients: {len(connected_clients)}")
+    outbound_queues[websocket] = OutboundQueue(
+        websocket,
+        max_messages=OUTBOUND_MAX_MESSAGES,
+        max_bytes=OUTBOUND_MAX_BYTES,
+        on_send=record_send,
+        on_drop=lambda reason: outbound_discarded.inc(reason=reason),
+    )
+    outbound_queues[websocket].start()
+    upload_limiters[websocket] = UploadLimiter(UPLOAD_RATE_PER_MINUTE, UPLOAD_BURST)
+    # Until the client names its own session, its captures go to a fresh one
+    await set_session(websocket, new_session_token())
+    log_event("client_connected", user=id(websocket), clients=len(connected_clients))
 
     try:
         async for message in websocket:
+            bytes_received.inc(len(message))
             try:
                 data = json.loads(message)
 
-                if data.get('action') == 'save_capture':
+                if data.get('action') == 'session':
+                    token = data.get('session')
+                    if is_valid_token(token):
+                        await set_session(websocket, token)
+                        send_message(websocket, json.dumps({"status": "session", "session": token}))
+                    else:
+                        send_message(websocket, json.dumps({"status": "error", "error": "Invalid session token"}))
+
+                elif data.get('action') == 'save_capture':
                     # Save captured image
                     image_base64 = data.get('image')
                     if image_base64:
-                        await handle_save_capture(websocket, image_base64)
+                        if not check_upload(websocket, len(image_base64) * 3 // 4, data.get('request_id')):
+                            continue
+                        await handle_save_capture(websocket, image_base64, data.get('request_id'))
                     else:
-                        await websocket.send(json.dumps({
+                        save_requests.inc(outcome="missing_image")
+                        send_message(websocket, json.dumps({
                             "status": "error",
                             "error": "No image data provided"
                         }))
 
                 elif data.get('action') == 'delete_captures':
                     await handle_delete_captures(websocket)
-                    await websocket.send(json.dumps({"status": "deleted"}))
+                    send_message(websocket, json.dumps({"status": "deleted"}))
 
             except json.JSONDecodeError:
-                print(f"Invalid JSON received: {message[:100]}...")
+                log_event("invalid_json", level="warning", user=id(websocket), message=message[:100])
             except Exception as e:
-                print(f"Error handling message: {e}")
+                log_event("message_error", level="error", user=id(websocket), error=str(e))
 
     finally:
-        # Clean up user's captures when they disconnect
-        if websocket in user_captures:
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] Cleaning up captures for disconnected user {id(websocket)}")
-            await handle_delete_captures(websocket)
-            del user_captures[websocket]
+        # Captures are kept for the grace period so a reconnecting client finds them again
+        capture_store.detach(client_sessions.pop(websocket))
 
+        outbound_queues.pop(websocket).stop()
+        upload_limiters.pop(websocket, None)
         connected_clients.remove(websocket)
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] Screenshot client disconnected. Total clients: {len(connected_clients)}")
+        log_event("client_disconnected", user=id(websocket), clients=len(connected_clients))
 
 async def main():
     """Start WebSocket server"""
-    # Start WebSocket server with increased message size limit (10MB for base64 images)
+    # Local metrics endpoint
+    if METRICS_PORT:
+        await start_metrics_server(metrics_registry, METRICS_PORT)
+        start_background_task(monitor_event_loop(event_loop_lag), "loop_monitor")
+
+    # Expire idle capture sessions and enforce the disk budget in the background (first pass right away)
+    start_background_task(capture_store.run_sweeper(), "capture_sweeper")
+
+    # Start WebSocket server; messages are capped at the largest upload in base64 and only a few
+    # are buffered per connection, which bounds the memory a client can hold on the way in
     ws_server = await websockets.serve(
         websocket_handler,
         "0.0.0.0",
         WEBSOCKET_PORT,
-        max_size=10 * 1024 * 1024  # 10MB
+        max_size=UPLOAD_MAX_BYTES * 4 // 3 + 64 * 1024,
+        max_queue=INBOUND_MAX_MESSAGES,
     )
-    print(f"Screenshot WebSocket server started on port {WEBSOCKET_PORT}")
-    print("Waiting for capture requests from clients...")
-    print("=" * 50)
+    log_event("websocket_server_started", port=WEBSOCKET_PORT)
 
     # Keep running
     await ws_server.wait_closed()
 
 if __name__ == "__main__":
-    print("Screenshot Service")
-    print("=" * 50)
-    print(f"WebSocket port: {WEBSOCKET_PORT}")
-    print("=" * 50)
+    log_event("service_starting", websocket_port=WEBSOCKET_PORT, metrics_port=METRICS_PORT)
 
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Stream Grabber
+Keeps the HLS stream open in a background thread and buffers the latest decoded frames
+"""
+
+import threading
+import time
+from collections import deque
+
+import cv2
+
+from metrics import log_event
+
+
+class StreamGrabber:
+    """Long-lived stream reader holding the most recent frames in a ring buffer"""
+
+    def __init__(self, stream_url, buffer_size=5, reconnect_delay=1.0, max_reconnect_delay=30.0):
+        self.stream_url = stream_url
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        # Ring buffer of (frame, timestamp) tuples, newest last
+        self._frames = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # Health information
+        self.connected = False
+        self.frames_read = 0
+        self.reconnects = 0
+        self.last_error = None
+        self.started_at = None
+
+    def start(self):
+        """Start the background reader thread"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="stream-grabber", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stop the background reader thread"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _open_capture(self):
+        """Open the stream, keeping the decoder-side buffer as small as possible"""
+        cap = cv2.VideoCapture(self.stream_url)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def _run(self):
+        """Read frames until stopped, reconnecting with exponential backoff"""
+        delay = self.reconnect_delay
+
+        while not self._stop_event.is_set():
+            cap = self._open_capture()
+
+            if not cap.isOpened():
+                cap.release()
+                self.connected = False
+                self.last_error = "Cannot open stream"
+                log_event("stream_open_failed", level="warning", retry_in=delay)
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+
+            self.connected = True
+            self.last_error = None
+            delay = self.reconnect_delay
+            log_event("stream_connected", stream_url=self.stream_url)
+
+            while not self._stop_event.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    self.last_error = "Cannot read frame"
+                    break
+
+                self._store(frame)
+
+            cap.release()
+            self.connected = False
+
+            if not self._stop_event.is_set():
+                self.reconnects += 1
+                log_event("stream_lost", level="warning", error=self.last_error, reconnect_in=delay)
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _store(self, frame):
+        """Keep a decoded frame (overridden to publish frames elsewhere)"""
+        with self._lock:
+            self._frames.append((frame, time.time()))
+            self.frames_read += 1
+
+    def latest(self):
+        """Return the most recent (frame, timestamp), or (None, None) if nothing was read yet"""
+        with self._lock:
+            if not self._frames:
+                return None, None
+            return self._frames[-1]
+
+    def recent(self):
+        """Return all buffered (frame, timestamp) tuples, oldest first"""
+        with self._lock:
+            return list(self._frames)
+
+    def health(self):
+        """Return a JSON-serializable summary of the grabber state"""
+        _, timestamp = self.latest()
+        return {
+            "connected": self.connected,
+            "frames_read": self.frames_read,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+            "last_frame_age": round(time.time() - timestamp, 3) if timestamp else None,
+            "uptime": round(time.time() - self.started_at, 1) if self.started_at else None,
+        }
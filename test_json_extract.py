@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tests for json_extract (run with `python -m pytest test_json_extract.py`)
+"""
+
+import json
+
+from json_extract import IncrementalBirdParser, extract_json_object, iter_balanced_objects, loads_tolerant
+
+BATCH_REPLY = json.dumps({
+    "birds": [
+        {"species": "Mésange bleue", "image": 1, "bbox": {"x": 10, "y": 20, "width": 5, "height": 5}},
+        {"species": "Rouge-gorge", "image": 2, "bbox": {"x": 40, "y": 30, "width": 8, "height": 6}},
+        {"species": "Sittelle torchepot", "image": 2, "bbox": {"x": 70, "y": 10, "width": 6, "height": 9}},
+    ],
+    "count": 3,
+}, ensure_ascii=False)
+
+
+def feed_in_chunks(parser, text, size):
+    birds = []
+    for start in range(0, len(text), size):
+        birds.extend(parser.feed(text[start:start + size]))
+    return birds
+
+
+def test_loads_tolerant_removes_trailing_commas():
+    assert loads_tolerant('{"birds": [{"species": "Merle",},], "count": 1,}') == {
+        "birds": [{"species": "Merle"}], "count": 1
+    }
+    assert loads_tolerant('{"birds": [') is None
+
+
+def test_extract_plain_and_fenced_object():
+    assert extract_json_object('{"birds": [], "count": 0}', "birds") == {"birds": [], "count": 0}
+    assert extract_json_object('```json\n{"birds": [], "count": 0}\n```', "birds") == {"birds": [], "count": 0}
+
+
+def test_extract_skips_unclosed_brace_in_prose():
+    text = 'Voici l\'analyse { en bref : {"birds": [{"species": "Merle noir"}], "count": 1}'
+    assert extract_json_object(text, "birds") == {"birds": [{"species": "Merle noir"}], "count": 1}
+
+
+def test_extract_skips_closed_braces_in_prose():
+    text = 'Format {x, y} en pourcentages. {"birds": [], "count": 0} Fin {sic}.'
+    assert extract_json_object(text, "birds") == {"birds": [], "count": 0}
+
+
+def test_extract_skips_objects_without_required_key():
+    text = 'Exemple : {"species": "?"} puis {"birds": [{"species": "Pinson"}], "count": 1}'
+    assert extract_json_object(text, "birds") == {"birds": [{"species": "Pinson"}], "count": 1}
+    assert extract_json_object(text) == {"species": "?"}
+
+
+def test_extract_braces_and_escaped_quotes_inside_strings():
+    text = r'{"birds": [{"species": "Merle", "description": "dit \"}\" puis {"}], "count": 1}'
+    result = extract_json_object(text, "birds")
+    assert result["birds"][0]["description"] == 'dit "}" puis {'
+    assert result["count"] == 1
+
+
+def test_extract_truncated_reply_returns_none():
+    truncated = BATCH_REPLY[:len(BATCH_REPLY) // 2]
+    assert extract_json_object(truncated, "birds") is None
+    assert extract_json_object("pas de JSON ici", "birds") is None
+
+
+def test_iter_balanced_objects_outermost_first():
+    assert list(iter_balanced_objects('a {"b": {"c": 1}} d')) == ['{"b": {"c": 1}}', '{"c": 1}']
+
+
+def test_parser_yields_each_bird_once_complete():
+    parser = IncrementalBirdParser()
+    assert parser.feed('{"birds": [{"species": "Mésange bleue", "bbox": {"x"') == []
+    assert parser.feed(': 10}}, {"species": "Sittelle"') == [{"species": "Mésange bleue", "bbox": {"x": 10}}]
+    assert parser.feed('}], "count": 2}') == [{"species": "Sittelle"}]
+    assert len(parser.birds) == 2
+
+
+def test_parser_any_chunk_size():
+    for size in (1, 3, 7, 64, len(BATCH_REPLY)):
+        parser = IncrementalBirdParser()
+        assert feed_in_chunks(parser, BATCH_REPLY, size) == json.loads(BATCH_REPLY)["birds"]
+        assert parser.text == BATCH_REPLY
+
+
+def test_parser_keeps_image_index_of_batched_replies():
+    parser = IncrementalBirdParser()
+    birds = feed_in_chunks(parser, BATCH_REPLY, 5)
+    assert [bird["image"] for bird in birds] == [1, 2, 2]
+
+
+def test_parser_ignores_prose_and_braces_in_strings():
+    reply = (
+        'Voici le résultat {"note": "} et ]", "birds": [{"species": "Merle", '
+        r'"description": "\"{\" noté"}], "count": 1}'
+    )
+    parser = IncrementalBirdParser()
+    assert feed_in_chunks(parser, reply, 4) == [{"species": "Merle", "description": '"{" noté'}]
+
+
+def test_parser_truncated_reply_keeps_complete_birds():
+    truncated = BATCH_REPLY[:BATCH_REPLY.index("Sittelle")]
+    parser = IncrementalBirdParser()
+    birds = feed_in_chunks(parser, truncated, 8)
+    assert [bird["species"] for bird in birds] == ["Mésange bleue", "Rouge-gorge"]
+    assert extract_json_object(parser.text, "birds") is None
+
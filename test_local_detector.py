@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Tests for local_detector (run with `python -m pytest test_local_detector.py`)
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from local_detector import (  # noqa: E402
+    COCO_BIRD_CLASS, DarkBlobDetector, DnnDetector, LocalDetection, LocalDetector, load_detector
+)
+
+CLASSES = 80
+
+
+class FakeNet:
+    """Stands in for a cv2.dnn network and returns a fixed output"""
+
+    def __init__(self, output):
+        self.output = output
+        self.inputs = []
+
+    def setInput(self, blob):
+        self.inputs.append(blob.shape)
+
+    def forward(self):
+        return self.output
+
+
+def make_dnn_detector(output, confidence=0.35, input_size=640):
+    """DnnDetector around a FakeNet, without reading a model file"""
+    detector = DnnDetector.__new__(DnnDetector)
+    LocalDetector.__init__(detector)
+    detector.name = "fake"
+    detector.bird_class = COCO_BIRD_CLASS
+    detector.confidence = confidence
+    detector.nms_threshold = 0.45
+    detector.input_size = input_size
+    detector.scale = 1 / 255
+    detector.mean = 0.0
+    detector._net = FakeNet(output)
+    return detector
+
+
+def white_frame(width=640, height=480):
+    return np.full((height, width, 3), 230, np.uint8)
+
+
+def test_dark_blob_detector_finds_dark_birds():
+    frame = white_frame()
+    frame[120:150, 100:140] = 10
+    frame[300:360, 400:480] = 20
+
+    detector = DarkBlobDetector()
+    detections = sorted(detector.detect(frame), key=lambda detection: detection.x)
+
+    assert len(detections) == 2
+    first, second = detections
+    assert first.x == pytest.approx(100, abs=2) and first.y == pytest.approx(120, abs=2)
+    assert first.width == pytest.approx(40, abs=2) and first.height == pytest.approx(30, abs=2)
+    assert second.x == pytest.approx(400, abs=2) and second.width == pytest.approx(80, abs=2)
+    assert detector.frames_examined == 1 and detector.frames_rejected == 0 and detector.birds_found == 2
+
+
+def test_dark_blob_detector_rejects_empty_frames_and_out_of_range_blobs():
+    detector = DarkBlobDetector()
+    assert detector.detect(white_frame()) == []
+
+    speck = white_frame()
+    speck[10:11, 10:11] = 0
+    assert detector.detect(speck) == []
+
+    night = np.zeros((480, 640, 3), np.uint8)
+    assert detector.detect(night) == []
+
+    assert detector.frames_rejected == 3
+    assert detector.stats()["rejection_rate"] == 1.0
+
+
+def test_crop_region_pads_around_every_detection():
+    detector = DarkBlobDetector(padding=0.5, min_crop=0)
+    detections = [LocalDetection(200, 100, 100, 50, 0.9), LocalDetection(400, 150, 100, 50, 0.8)]
+
+    region = detector.crop_region(detections, 1000, 500)
+
+    # Union 200..500 x 100..200, padded by half its size on each side
+    assert region == pytest.approx({"x": 5.0, "y": 10.0, "width": 60.0, "height": 40.0})
+
+
+def test_crop_region_min_crop_and_frame_edges():
+    detector = DarkBlobDetector(padding=0.1, min_crop=256)
+
+    centered = detector.crop_region([LocalDetection(500, 400, 20, 20, 0.9)], 1000, 1000)
+    assert centered["width"] == pytest.approx(25.6) and centered["height"] == pytest.approx(25.6)
+
+    corner = detector.crop_region([LocalDetection(0, 0, 20, 20, 0.9)], 1000, 1000)
+    assert corner["x"] == 0 and corner["y"] == 0
+    assert corner["width"] == pytest.approx(13.8) and corner["height"] == pytest.approx(13.8)
+
+
+def test_to_dict_is_in_percentages():
+    assert LocalDetection(64, 48, 32, 24, 0.91234).to_dict(640, 480) == {
+        "x": 10.0, "y": 10.0, "width": 5.0, "height": 5.0, "confidence": 0.912
+    }
+
+
+def test_parse_yolo_v5_output():
+    rows = np.zeros((1, 200, 5 + CLASSES), np.float32)
+    rows[0, 0, :5] = [320, 160, 64, 32, 0.9]
+    rows[0, 0, 5 + COCO_BIRD_CLASS] = 0.8
+    rows[0, 1, :5] = [100, 100, 50, 50, 0.9]
+    rows[0, 1, 5 + 2] = 0.95  # Not a bird
+    rows[0, 2, :5] = [500, 500, 50, 50, 0.3]
+    rows[0, 2, 5 + COCO_BIRD_CLASS] = 0.9  # Objectness too low
+
+    detector = make_dnn_detector(rows)
+    boxes, scores = detector._parse_yolo(rows, 1280, 640)
+
+    assert boxes == [[576, 144, 128, 32]]
+    assert scores == [pytest.approx(0.72)]
+
+
+def test_parse_yolo_v8_output():
+    rows = np.zeros((1, 4 + CLASSES, 200), np.float32)
+    rows[0, :4, 7] = [320, 320, 100, 60]
+    rows[0, 4 + COCO_BIRD_CLASS, 7] = 0.6
+    rows[0, :4, 8] = [50, 50, 10, 10]
+    rows[0, 4 + COCO_BIRD_CLASS, 8] = 0.2  # Below the confidence threshold
+
+    detector = make_dnn_detector(rows)
+    boxes, scores = detector._parse_yolo(rows, 640, 640)
+
+    assert boxes == [[270, 290, 100, 60]]
+    assert scores == [pytest.approx(0.6)]
+
+
+def test_parse_ssd_output():
+    rows = np.array([
+        [0, COCO_BIRD_CLASS, 0.9, 0.1, 0.2, 0.3, 0.6],
+        [0, 3, 0.99, 0.0, 0.0, 0.5, 0.5],
+        [0, COCO_BIRD_CLASS, 0.1, 0.5, 0.5, 0.6, 0.6],
+    ], np.float32)
+
+    detector = make_dnn_detector(rows)
+    boxes, scores = detector._parse_ssd(rows, 1000, 500)
+
+    assert boxes == [[100, 100, 200, 200]]
+    assert scores == [pytest.approx(0.9)]
+
+
+def test_dnn_detect_merges_overlapping_boxes():
+    rows = np.zeros((1, 200, 5 + CLASSES), np.float32)
+    rows[0, 0, :5] = [320, 320, 100, 100, 1.0]
+    rows[0, 0, 5 + COCO_BIRD_CLASS] = 0.9
+    rows[0, 1, :5] = [325, 322, 100, 100, 1.0]  # Same bird, slightly shifted
+    rows[0, 1, 5 + COCO_BIRD_CLASS] = 0.7
+
+    detector = make_dnn_detector(rows)
+    detections = detector.detect(white_frame(640, 640))
+
+    assert len(detections) == 1
+    assert detections[0].confidence == pytest.approx(0.9)
+    assert detector._net.inputs == [(1, 3, 640, 640)]
+
+
+def test_dnn_detect_ssd_layout():
+    output = np.array([[[[0, COCO_BIRD_CLASS, 0.8, 0.25, 0.25, 0.5, 0.5]]]], np.float32)
+
+    detections = make_dnn_detector(output).detect(white_frame(400, 200))
+
+    assert [(d.x, d.y, d.width, d.height) for d in detections] == [(100, 50, 100, 50)]
+
+
+def test_load_detector_stub():
+    detector = load_detector("stub", padding=0.5, min_crop=64)
+    assert isinstance(detector, DarkBlobDetector)
+    assert detector.padding == 0.5 and detector.min_crop == 64
+    assert detector.stats()["model"] == "stub"
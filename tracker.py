@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Bird Tracker
+Follows the birds of one camera across frames by matching their boxes (IoU,
+then centroid distance), gives each one a stable track ID and a species label
+voted over all of its identifications, and recognizes frames that only show
+birds identified recently enough to skip asking the vision model again
+"""
+
+import itertools
+import time
+
+from detection_history import confidence_rank
+
+# Track IDs are unique across cameras
+_track_ids = itertools.count(1)
+
+
+def box_iou(a, b):
+    """Intersection over union of two {x, y, width, height} boxes"""
+    width = min(a["x"] + a["width"], b["x"] + b["width"]) - max(a["x"], b["x"])
+    height = min(a["y"] + a["height"], b["y"] + b["height"]) - max(a["y"], b["y"])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    return intersection / (a["width"] * a["height"] + b["width"] * b["height"] - intersection)
+
+
+def centroid_distance(a, b):
+    """Distance between the centers of two boxes, in the boxes' units"""
+    dx = (a["x"] + a["width"] / 2) - (b["x"] + b["width"] / 2)
+    dy = (a["y"] + a["height"] / 2) - (b["y"] + b["height"] / 2)
+    return (dx * dx + dy * dy) ** 0.5
+
+
+def covered_fraction(box, others):
+    """Share of a box's area inside the union of other boxes (exact, on the grid of their edges)"""
+    def edges(start, size, key, length):
+        inner = {min(max(other[key] + offset, start), start + size) for other in others
+                 for offset in (0, other[length])}
+        return sorted(inner | {start, start + size})
+
+    def inside(x, y):
+        return any(other["x"] <= x <= other["x"] + other["width"] and other["y"] <= y <= other["y"] + other["height"]
+                   for other in others)
+
+    xs = edges(box["x"], box["width"], "x", "width")
+    ys = edges(box["y"], box["height"], "y", "height")
+    covered = sum(
+        (right - left) * (bottom - top)
+        for left, right in zip(xs, xs[1:])
+        for top, bottom in zip(ys, ys[1:])
+        if inside((left + right) / 2, (top + bottom) / 2)
+    )
+    return covered / (box["width"] * box["height"])
+
+
+def _box(bbox):
+    """The position fields of a bbox as floats, or None if it is incomplete"""
+    try:
+        box = {key: float(bbox[key]) for key in ("x", "y", "width", "height")}
+    except (KeyError, TypeError, ValueError):
+        return None
+    return box if box["width"] > 0 and box["height"] > 0 else None
+
+
+class Track:
+    """One bird followed across frames and the species votes of its identifications"""
+
+    def __init__(self, box, now):
+        self.id = next(_track_ids)
+        self.box = box
+        self.first_seen = now
+        self.last_seen = now
+        self.last_identified = None
+        self.identifications = 0
+        self.votes = {}  # Maps species to its summed confidence weight
+        self.details = {}  # Maps species to the latest bird reported with it (scientific name, description...)
+        self.label = None
+
+    @property
+    def agreement(self):
+        """Share of the vote weight held by the label"""
+        total = sum(self.votes.values())
+        return self.votes[self.label] / total if total else 0.0
+
+    def vote(self, bird, now):
+        """Count one identification, weighted by its confidence (élevé 3, moyen 2, faible 1)"""
+        species = bird.get("species")
+        if not species:
+            return
+        self.votes[species] = self.votes.get(species, 0) + max(1, confidence_rank(bird.get("confidence")))
+        self.details[species] = {key: value for key, value in bird.items() if key != "bbox"}
+        self.identifications += 1
+        self.last_identified = now
+        # Ties keep the current label so it does not flip on every other frame
+        best = max(self.votes, key=self.votes.get)
+        if self.label is None or self.votes[best] > self.votes[self.label]:
+            self.label = best
+
+    def to_bird(self):
+        """The track as a bird of a detection result, under its voted label"""
+        bird = dict(self.details.get(self.label, {}))
+        bird.pop("observed_species", None)
+        bird.update(
+            species=self.label,
+            bbox={key: round(value, 2) for key, value in self.box.items()},
+            track_id=self.id,
+            track_votes=dict(self.votes),
+        )
+        return bird
+
+
+class BirdTracker:
+    """Tracks of one camera, updated from the event loop only"""
+
+    def __init__(self, iou_threshold=0.3, max_distance=10.0, max_age=30.0, stable_votes=2, stable_agreement=0.6,
+                 reidentify_after=120.0, coarse_coverage=0.9):
+        self.iou_threshold = iou_threshold
+        self.max_distance = max_distance  # Farthest centroid move still matched, in percent of the frame
+        self.max_age = max_age  # Seconds a track survives without being seen
+        self.stable_votes = stable_votes  # Identifications a track needs before frames can skip the vision model
+        self.stable_agreement = stable_agreement  # Share of the votes its label needs
+        self.reidentify_after = reidentify_after  # Seconds after which a stable track is identified again (0 = always)
+        self.coarse_coverage = coarse_coverage  # Share of a coarse box the tracks must cover for it to skip the model
+
+        self.tracks = []
+
+        # Counters
+        self.tracks_created = 0
+        self.identifications_skipped = 0
+        self.labels_overridden = 0
+
+    def _expire(self, now):
+        self.tracks = [track for track in self.tracks if now - track.last_seen <= self.max_age]
+
+    def _match(self, boxes):
+        """Greedy one-to-one matching, best IoU first, then nearest centroid: {box index: track}"""
+        candidates = []
+        for index, box in enumerate(boxes):
+            for track in self.tracks:
+                overlap = box_iou(box, track.box)
+                distance = centroid_distance(box, track.box)
+                if overlap >= self.iou_threshold or distance <= self.max_distance:
+                    candidates.append((-overlap, distance, index, track))
+        candidates.sort(key=lambda candidate: candidate[:2])
+
+        matches = {}
+        used = set()
+        for _, _, index, track in candidates:
+            if index not in matches and track.id not in used:
+                matches[index] = track
+                used.add(track.id)
+        return matches
+
+    def _stable(self, track, now):
+        return (
+            self.reidentify_after > 0
+            and track.identifications >= self.stable_votes
+            and track.agreement >= self.stable_agreement
+            and now - track.last_identified <= self.reidentify_after
+        )
+
+    def update(self, birds, now=None):
+        """Match freshly identified birds to tracks and relabel them in place with their track's vote
+
+        Each bird with a bbox gets a track_id and track_votes; when the vote disagrees with
+        the model's answer, species holds the vote and observed_species the answer.
+        """
+        now = now or time.time()
+        self._expire(now)
+
+        located = [(bird, _box(bird.get("bbox"))) for bird in birds]
+        located = [(bird, box) for bird, box in located if box is not None]
+        matches = self._match([box for _, box in located])
+
+        for index, (bird, box) in enumerate(located):
+            track = matches.get(index)
+            if track is None:
+                track = Track(box, now)
+                self.tracks.append(track)
+                self.tracks_created += 1
+            track.box = box
+            track.last_seen = now
+            track.vote(bird, now)
+
+            bird["track_id"] = track.id
+            bird["track_votes"] = dict(track.votes)
+            if track.label and track.label != bird.get("species"):
+                self.labels_overridden += 1
+                bird["observed_species"] = bird.get("species")
+                bird.update({key: value for key, value in track.details[track.label].items()
+                             if key in ("species", "scientific_name")})
+
+    def follow(self, boxes, now=None, precise=True):
+        """Tracks covering every box if they are all stably identified, else None (the frame must be identified)
+
+        Precise boxes (local detector) are matched one to one and move their tracks. A coarse
+        box (motion region) may hold birds no track knows about, so it is only covered when the
+        tracks it overlaps fill almost all of it (coarse_coverage), and it moves none.
+        """
+        now = now or time.time()
+        self._expire(now)
+        boxes = [box for box in (_box(box) for box in boxes) if box is not None]
+        if not boxes or not self.tracks:
+            return None
+
+        if precise:
+            matches = self._match(boxes)
+            if len(matches) < len(boxes):
+                return None
+            tracks = list(matches.values())
+        else:
+            tracks = [track for track in self.tracks if any(box_iou(box, track.box) > 0 for box in boxes)]
+            if not tracks:
+                return None
+            track_boxes = [track.box for track in tracks]
+            if any(covered_fraction(box, track_boxes) < self.coarse_coverage for box in boxes):
+                return None
+
+        if not all(self._stable(track, now) for track in tracks):
+            return None
+
+        if precise:
+            for index, track in matches.items():
+                track.box = boxes[index]
+        for track in tracks:
+            track.last_seen = now
+        self.identifications_skipped += 1
+        return tracks
+
+    def stats(self):
+        """Return a JSON-serializable summary of the tracks and counters"""
+        now = time.time()
+        return {
+            "active_tracks": len(self.tracks),
+            "stable_tracks": sum(1 for track in self.tracks if self._stable(track, now)),
+            "tracks_created": self.tracks_created,
+            "identifications_skipped": self.identifications_skipped,
+            "labels_overridden": self.labels_overridden,
+        }